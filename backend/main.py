@@ -2,15 +2,41 @@
 Voxel3Di Backend API
 Orchestrates 3D Slicer processing jobs for CBCT analysis
 """
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers import slicer, dental_segmentator, implant_planner, panoramic_generator, dental_ai_opg, cephalometric_ai
+from services import http_clients, mesh_export
+import asyncio
 import os
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared resources on startup and release them on shutdown"""
+    http_clients.get_orthanc_client()
+    http_clients.get_slicer_client()
+    if dental_segmentator.DENTAL_SEGMENTATOR_WARMUP:
+        # Load the nnU-Net model in the background so startup is not blocked
+        app.state.predictor_warmup = asyncio.create_task(dental_segmentator.warmup_predictor())
+    # Jobs left unfinished by a crashed or stopped process would otherwise look queued forever
+    dental_segmentator.segmentation_jobs.fail_orphaned(**dental_segmentator.ABANDONED_JOB_FIELDS)
+    panoramic_generator.jobs.fail_orphaned(**panoramic_generator.ABANDONED_JOB_FIELDS)
+    dental_segmentator.segmentation_queue.start()
+    yield
+    await dental_segmentator.segmentation_queue.stop()
+    # The queue dropped its waiting jobs; fail them (and their claims) rather than leave them queued
+    dental_segmentator.segmentation_jobs.fail_abandoned(**dental_segmentator.ABANDONED_JOB_FIELDS)
+    panoramic_generator.jobs.fail_abandoned(**panoramic_generator.ABANDONED_JOB_FIELDS)
+    await http_clients.close_clients()
+    mesh_export.shutdown_mesh_pool()
+
+
 app = FastAPI(
     title="Voxel3Di Backend API",
     description="CBCT Processing with 3D Slicer Integration and AI Segmentation",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS configuration - allow VoxelApp frontend
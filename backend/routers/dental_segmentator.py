@@ -9,7 +9,7 @@ Segments:
 - Lower Teeth
 - Mandibular Canal
 """
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Header, Response
 from pydantic import BaseModel
 import httpx
 import os
@@ -17,9 +17,47 @@ import logging
 import tempfile
 import shutil
 import uuid
+import hashlib
+import threading
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, BinaryIO, Callable, Awaitable
+from io import BytesIO
 import asyncio
+import numpy as np
+from services.http_clients import get_orthanc_client, ORTHANC_URL
+from services.orthanc_fetch import fetch_series
+from services.orthanc_upload import spool_file, upload_instance
+from services.labelmap_transport import (
+    IDENTITY,
+    LABELMAP_ENCODINGS,
+    negotiate_compression,
+    parse_slices,
+    parse_range,
+    iter_bytes,
+    iter_encoded,
+    iter_compressed,
+    labelmap_header,
+    etag_matches
+)
+from services.series_index import series_index
+from services.dicom_series import DicomSeries, load_dicom_dir
+from services.dicom_seg import (
+    SEG_ENCODINGS,
+    SEGMENTATION_STORAGE,
+    LABEL_MAP_SEGMENTATION_STORAGE,
+    label_presence,
+    build_per_frame_functional_groups,
+    binary_frame_index,
+    pack_binary_frames,
+    build_binary_per_frame_functional_groups,
+    seg_dataset_to_labelmap
+)
+from services.job_queue import JobQueue, QueueFullError
+from services.job_store import job_store
+from services.job_events import wait_for_job, job_event_response
+from services.result_cache import segmentation_results
+from services.volume_cache import series_version, volume_cache, hot_volume_cache, labelmap_cache, hot_labelmap_cache, mesh_cache
+from services.mesh_export import write_binary_stl, write_glb, mesh_labelmap, parse_lods, SMOOTHING_METHODS, MAX_SMOOTHING_ITERATIONS, MESH_FORMAT_VERSION, mesh_to_xyz
 
 router = APIRouter()
 
@@ -29,12 +67,35 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 # Configuration
-ORTHANC_URL = os.getenv("ORTHANC_URL", "http://127.0.0.1:8042")
 MODEL_DIR = os.getenv("DENTAL_SEGMENTATOR_MODEL_DIR", "/tmp/dental_segmentator_model")
 NNUNET_RESULTS = os.getenv("nnUNet_results", "/tmp/nnunet_results")
 
-# Job tracking
-segmentation_jobs: Dict[str, Dict[str, Any]] = {}
+# Load the nnU-Net predictor at startup instead of on the first job
+DENTAL_SEGMENTATOR_WARMUP = os.getenv("DENTAL_SEGMENTATOR_WARMUP", "false").lower() in ("1", "true", "yes")
+
+# nnU-Net inference settings; part of the result cache key
+INFERENCE_PARAMS = {"tile_step_size": 0.5, "use_mirroring": True, "folds": [0]}
+
+# Job execution: concurrent segmentation jobs and how many may wait
+SEGMENTATION_WORKERS = int(os.getenv("SEGMENTATION_WORKERS", "1"))
+SEGMENTATION_QUEUE_SIZE = int(os.getenv("SEGMENTATION_QUEUE_SIZE", "16"))
+
+# Decoded label maps may be cached by browsers but must be revalidated (ETag)
+LABELMAP_CACHE_CONTROL = "private, no-cache"
+
+# Job tracking (shared between workers, see services.job_store)
+segmentation_jobs = job_store.table("segmentation")
+# Merged into jobs that will never finish because their server process stopped or died
+ABANDONED_JOB_FIELDS = {
+    "error": "The server stopped before the job finished",
+    "progress": "Failed: the server stopped before the job finished",
+}
+
+# Persistent nnU-Net predictor (see load_predictor)
+_predictor = None
+_predictor_device: Optional[str] = None
+_predictor_fingerprint: Optional[str] = None
+_predictor_lock = threading.Lock()
 
 # Segment labels and colors (RGBA)
 SEGMENT_INFO = {
@@ -50,6 +111,8 @@ class SegmentationRequest(BaseModel):
     """Request model for dental segmentation"""
     studyInstanceUID: str
     seriesInstanceUID: str
+    recompute: bool = False  # Ignore a cached result for this series
+    segEncoding: str = "labelmap"  # DICOM SEG output encoding, one of SEG_ENCODINGS
 
 
 class SegmentationResponse(BaseModel):
@@ -59,6 +122,9 @@ class SegmentationResponse(BaseModel):
     job_id: Optional[str] = None
     segmentation_uid: Optional[str] = None
     segments: Optional[list] = None
+    queue_position: Optional[int] = None
+    percent: Optional[int] = None
+    version: Optional[int] = None
 
 
 async def download_model_if_needed():
@@ -102,103 +168,90 @@ async def download_model_if_needed():
         return False
 
 
-async def fetch_dicom_from_orthanc(series_uid: str, output_dir: Path) -> bool:
-    """Fetch DICOM series from Orthanc and save to directory"""
+async def resolve_source_series(series_uid: str) -> Optional[Dict[str, Any]]:
+    """Series index entry of the series to segment (None if Orthanc has no usable series)"""
+    # Strategy 1: Exact SeriesInstanceUID lookup in the series index
+    logger.info(f"Searching Orthanc for series: {series_uid}")
+    entry = await series_index.resolve(series_uid)
+    if entry:
+        logger.info(f"Found series: {entry['orthanc_id']}")
+        return entry
+    
+    # Strategy 2: If not found, match a partial UID against the index
+    logger.info("Series not found by exact UID, checking all series...")
+    entry = await series_index.find_partial(series_uid)
+    if entry:
+        logger.info(f"Found series by partial UID: {entry['orthanc_id']}")
+        return entry
+    
+    # Strategy 3: If still not found, use the largest CT series (best for CBCT)
+    logger.warning(f"Series {series_uid} not found. Finding largest CT series...")
+    entry = await series_index.largest_series("CT")
+    if entry:
+        logger.info(f"Using largest CT series: {entry['orthanc_id']} ({entry['instances']} instances)")
+        return entry
+    
+    logger.error(f"No series available in Orthanc")
+    return None
+
+
+async def fetch_dicom_from_orthanc(orthanc_series_id: str, output_dir: Path, job_id: Optional[str] = None) -> bool:
+    """
+    Fetch DICOM series from Orthanc and save to directory
+    
+    The series is streamed as one archive, or fetched per instance with bounded
+    concurrency if that fails (see services.orthanc_fetch).
+    If job_id is given, download progress is reported into segmentation_jobs.
+    """
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            orthanc_series_id = None
-            
-            # Strategy 1: Find series by SeriesInstanceUID using /tools/find
-            logger.info(f"Searching Orthanc for series: {series_uid}")
-            response = await client.post(
-                f"{ORTHANC_URL}/tools/find",
-                json={
-                    "Level": "Series",
-                    "Query": {"SeriesInstanceUID": series_uid},
-                    "Expand": False
-                }
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result:
-                    orthanc_series_id = result[0]
-                    logger.info(f"Found series via /tools/find: {orthanc_series_id}")
-            
-            # Strategy 2: If not found, iterate through all series to find matching UID
-            if not orthanc_series_id:
-                logger.info("Series not found via /tools/find, checking all series...")
-                response = await client.get(f"{ORTHANC_URL}/series")
-                if response.status_code == 200:
-                    all_series = response.json()
-                    for sid in all_series:
-                        series_info = await client.get(f"{ORTHANC_URL}/series/{sid}")
-                        if series_info.status_code == 200:
-                            info = series_info.json()
-                            dicom_uid = info.get("MainDicomTags", {}).get("SeriesInstanceUID", "")
-                            if dicom_uid == series_uid or series_uid in dicom_uid:
-                                orthanc_series_id = sid
-                                logger.info(f"Found series by scanning: {orthanc_series_id}")
-                                break
-            
-            # Strategy 3: If still not found, find the largest CT series (best for CBCT)
-            if not orthanc_series_id:
-                logger.warning(f"Series {series_uid} not found. Finding largest CT series...")
-                response = await client.get(f"{ORTHANC_URL}/series")
-                if response.status_code == 200:
-                    all_series = response.json()
-                    best_series = None
-                    best_count = 0
-                    for sid in all_series:
-                        series_info = await client.get(f"{ORTHANC_URL}/series/{sid}")
-                        if series_info.status_code == 200:
-                            info = series_info.json()
-                            modality = info.get("MainDicomTags", {}).get("Modality", "")
-                            instances = info.get("Instances", [])
-                            # Prefer CT modality with the most instances
-                            if modality == "CT" and len(instances) > best_count:
-                                best_count = len(instances)
-                                best_series = sid
-                    if best_series:
-                        orthanc_series_id = best_series
-                        logger.info(f"Using largest CT series: {orthanc_series_id} ({best_count} instances)")
-            
-            if not orthanc_series_id:
-                logger.error(f"No series available in Orthanc")
-                return False
-            
-            # Get all instances in the series
-            response = await client.get(f"{ORTHANC_URL}/series/{orthanc_series_id}/instances")
-            if response.status_code != 200:
-                logger.error(f"Failed to get instances: {response.status_code}")
-                return False
-                
-            instances = response.json()
-            
-            if not instances:
-                logger.error("No instances found in series")
-                return False
-            
-            # Download each instance
-            output_dir.mkdir(parents=True, exist_ok=True)
-            
-            logger.info(f"Downloading {len(instances)} DICOM instances...")
-            for i, instance in enumerate(instances):
-                instance_id = instance["ID"]
-                resp = await client.get(f"{ORTHANC_URL}/instances/{instance_id}/file")
-                
-                if resp.status_code != 200:
-                    logger.warning(f"Failed to download instance {instance_id}")
-                    continue
-                
-                dcm_path = output_dir / f"instance_{i:04d}.dcm"
-                with open(dcm_path, "wb") as f:
-                    f.write(resp.content)
-            
-            downloaded = len(list(output_dir.glob("*.dcm")))
-            logger.info(f"Downloaded {downloaded} DICOM files")
-            return downloaded > 0
+        client = get_orthanc_client()
+        
+        # Get all instances in the series
+        response = await client.get(f"/series/{orthanc_series_id}/instances")
+        if response.status_code != 200:
+            logger.error(f"Failed to get instances: {response.status_code}")
+            if response.status_code == 404:
+                series_index.invalidate(orthanc_series_id)
+            return False
             
+        instances = response.json()
+        
+        if not instances:
+            logger.error("No instances found in series")
+            return False
+        
+        # Download the series (bulk archive, falling back to per-instance fetch)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        
+        def save_instance(index: int, data: bytes):
+            with open(output_dir / f"instance_{index:04d}.dcm", "wb") as f:
+                f.write(data)
+        
+        def clear_instances():
+            for path in output_dir.glob("instance_*.dcm"):
+                path.unlink()
+        
+        def report_progress(done: int, total: int):
+            # Throttled: every update is a write to the shared job store
+            if job_id and (done == total or done % max(1, total // 50) == 0):
+                segmentation_jobs.update(
+                    job_id,
+                    progress=f"Downloading DICOM... {done}/{total}",
+                    percent=int(40 * done / max(total, 1))
+                )
+        
+        await fetch_series(
+            orthanc_series_id,
+            [instance["ID"] for instance in instances],
+            save_instance,
+            report_progress,
+            on_reset=clear_instances
+        )
+        
+        downloaded = len(list(output_dir.glob("*.dcm")))
+        logger.info(f"Downloaded {downloaded} DICOM files")
+        return downloaded > 0
+        
     except Exception as e:
         logger.error(f"Error fetching DICOM from Orthanc: {e}")
         import traceback
@@ -206,121 +259,273 @@ async def fetch_dicom_from_orthanc(series_uid: str, output_dir: Path) -> bool:
         return False
 
 
-async def run_nnunet_inference(input_dir: Path, output_dir: Path) -> bool:
+async def load_source_series(series_uid: str, download_dir: Path, job_id: Optional[str] = None) -> DicomSeries:
     """
-    Run nnU-Net inference using DentalSegmentator model.
+    Decoded series to segment, from the in-memory or on-disk volume cache when it is unchanged
+    
+    A repeated job on the same series (recompute, another segEncoding) skips
+    the download and DICOM decoding. On a miss the series is downloaded into
+    download_dir, decoded and cached with its headers (see
+    DicomSeries.cache_metadata). The returned volume may be shared with other
+    jobs and is read-only.
+    
+    Raises:
+        Exception: If the series cannot be found, downloaded or decoded
+    """
+    entry = await resolve_source_series(series_uid)
+    if entry is None:
+        raise Exception("Failed to fetch DICOM from Orthanc")
+    # Sorted by slice position with headers; not the stack cached by the panoramic generator
+    key = f"segmentation-source/{entry['series_uid'] or entry['orthanc_id']}"
+    version = series_version(entry)
+    
+    hot = hot_volume_cache.get(key, version)
+    if hot is not None:
+        logger.info(f"Hot volume cache hit for {key}")
+        volume, metadata = hot
+        return DicomSeries(volume=volume, datasets=metadata["datasets"], geometry=metadata["geometry"])
+    
+    cached = await asyncio.to_thread(volume_cache.get, key, version)
+    if cached is not None:
+        logger.info(f"Volume cache hit for {key}")
+        series = await asyncio.to_thread(DicomSeries.from_cache, *cached)
+    else:
+        if not await fetch_dicom_from_orthanc(entry["orthanc_id"], download_dir, job_id):
+            raise Exception("Failed to fetch DICOM from Orthanc")
+        
+        # Decode the series once; every later stage works from this object
+        series = await asyncio.to_thread(load_dicom_dir, download_dir)
+        await asyncio.to_thread(volume_cache.put, key, version, series.volume, series.cache_metadata())
+    
+    hot_volume_cache.put(key, version, series.volume, {"datasets": series.datasets, "geometry": series.geometry})
+    return series
+
+
+def find_model_folder() -> Optional[Path]:
+    """Locate the trained nnU-Net model folder inside MODEL_DIR"""
+    model_path = Path(MODEL_DIR)
+    if not model_path.exists():
+        return None
+    
+    model_folder = model_path
+    for item in model_path.iterdir():
+        if item.is_dir() and "Dataset" in item.name:
+            for sub in item.iterdir():
+                if sub.is_dir():
+                    model_folder = sub
+                    break
+    return model_folder
+
+
+def model_fingerprint(model_folder: Path) -> str:
+    """Short hash of the checkpoint and plan files (name, size, mtime)"""
+    h = hashlib.sha1()
+    for f in sorted(model_folder.rglob("*")):
+        if f.is_file() and f.suffix in (".pth", ".json"):
+            st = f.stat()
+            h.update(f"{f.relative_to(model_folder)}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()[:16]
+
+
+def select_device() -> str:
+    """
+    Pick the inference device and configure torch for it.
     
     Supports MPS (Apple Silicon), CUDA (NVIDIA), or CPU fallback.
     """
-    try:
-        import torch
-        
-        # Auto-detect best device (MPS for Apple Silicon)
-        if torch.backends.mps.is_available():
-            device = "mps"
-            logger.info("Using MPS (Apple Silicon GPU) for inference")
-        elif torch.cuda.is_available():
-            device = "cuda"
-            logger.info("Using CUDA (NVIDIA GPU) for inference")
-        else:
-            device = "cpu"
-            logger.warning("Using CPU - inference will take 10-20 minutes")
-        
-        os.environ["nnUNet_device"] = device
-        os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
-        
-        # For MPS, enable maximum GPU utilization
-        if device == "mps":
-            os.environ["PYTORCH_MPS_HIGH_WATERMARK_RATIO"] = "0.0"  # Prevent memory fragmentation
-            torch.mps.set_per_process_memory_fraction(0.95)  # Use up to 95% of GPU memory
-            # Enable MPS to use as much GPU as possible
-            torch.mps.empty_cache()
+    import torch
+    
+    # Auto-detect best device (MPS for Apple Silicon)
+    if torch.backends.mps.is_available():
+        device = "mps"
+        logger.info("Using MPS (Apple Silicon GPU) for inference")
+    elif torch.cuda.is_available():
+        device = "cuda"
+        logger.info("Using CUDA (NVIDIA GPU) for inference")
+    else:
+        device = "cpu"
+        logger.warning("Using CPU - inference will take 10-20 minutes")
+    
+    os.environ["nnUNet_device"] = device
+    os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
+    
+    # For MPS, enable maximum GPU utilization
+    if device == "mps":
+        os.environ["PYTORCH_MPS_HIGH_WATERMARK_RATIO"] = "0.0"  # Prevent memory fragmentation
+        torch.mps.set_per_process_memory_fraction(0.95)  # Use up to 95% of GPU memory
+        # Enable MPS to use as much GPU as possible
+        torch.mps.empty_cache()
+    
+    return device
+
+
+def load_predictor(force_reload: bool = False):
+    """
+    Load the DentalSegmentator nnU-Net predictor (cached).
+    
+    The predictor is built once and reused by every job; force_reload
+    re-reads the checkpoints (see /reload-model).
+    
+    Returns:
+        nnUNetPredictor instance, or None if nnU-Net or the model is unavailable
+    """
+    global _predictor, _predictor_device, _predictor_fingerprint
+    
+    with _predictor_lock:
+        if _predictor is not None and not force_reload:
+            return _predictor
         
         try:
+            import torch
             from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
         except ImportError:
             logger.warning("nnU-Net not installed. Run: pip install nnunetv2 torch")
-            return False
+            return None
         
-        model_path = Path(MODEL_DIR)
-        if not model_path.exists():
+        model_folder = find_model_folder()
+        if model_folder is None:
             logger.warning(f"Model not found at {MODEL_DIR}")
-            return False
+            return None
         
-        # Find model folder
-        model_folder = model_path
-        for item in model_path.iterdir():
-            if item.is_dir() and "Dataset" in item.name:
-                for sub in item.iterdir():
-                    if sub.is_dir():
-                        model_folder = sub
-                        break
+        device = select_device()
         
         # Enable full GPU performance for both CUDA and MPS (nnU-Net is patched for MPS)
         perform_on_device = True
         
         predictor = nnUNetPredictor(
-            tile_step_size=0.5,
-            use_mirroring=True,
+            tile_step_size=INFERENCE_PARAMS["tile_step_size"],
+            use_mirroring=INFERENCE_PARAMS["use_mirroring"],
             perform_everything_on_device=perform_on_device,
             device=torch.device(device),
             verbose=True,
             verbose_preprocessing=False,
             allow_tqdm=True
         )
-        predictor.initialize_from_trained_model_folder(str(model_folder), use_folds=(0,))
+        predictor.initialize_from_trained_model_folder(str(model_folder), use_folds=tuple(INFERENCE_PARAMS["folds"]))
+        
+        _predictor = predictor
+        _predictor_device = device
+        _predictor_fingerprint = model_fingerprint(model_folder)
         
         logger.info(f"Model loaded. Device: {device}, perform_on_device: {perform_on_device} (FULL GPU)")
+        return _predictor
+
+
+def result_params(seg_encoding: str) -> Dict[str, Any]:
+    """Result cache parameters: inference settings plus the SEG output encoding"""
+    return {**INFERENCE_PARAMS, "seg_encoding": seg_encoding}
+
+
+def current_model_fingerprint() -> Optional[str]:
+    """Fingerprint of the model that would serve the next job (None if there is none)"""
+    if _predictor_fingerprint is not None:
+        return _predictor_fingerprint
+    model_folder = find_model_folder()
+    return model_fingerprint(model_folder) if model_folder else None
+
+
+async def find_cached_segmentation(series_uid: str, seg_encoding: str = "labelmap") -> Optional[str]:
+    """
+    SEG SeriesInstanceUID of a previous nnU-Net run on this series, if still valid.
+    
+    The entry must match the current model fingerprint, inference parameters
+    and SEG encoding, the source series must be unchanged, and the SEG must
+    still exist in Orthanc.
+    """
+    # Walks the model folder when no predictor is loaded yet
+    fingerprint = await asyncio.to_thread(current_model_fingerprint)
+    if fingerprint is None:
+        return None
+    
+    entry = await series_index.resolve(series_uid)
+    if entry is None:
+        return None
+    
+    seg_uid = await asyncio.to_thread(
+        segmentation_results.get, series_uid, fingerprint, result_params(seg_encoding), series_version(entry)
+    )
+    if seg_uid is None:
+        return None
+    
+    if await series_index.resolve(seg_uid) is None:
+        logger.info(f"Cached SEG {seg_uid} is no longer in Orthanc, discarding")
+        await asyncio.to_thread(segmentation_results.invalidate, series_uid, fingerprint, result_params(seg_encoding))
+        return None
+    
+    return seg_uid
+
+
+async def warmup_predictor():
+    """Download the model if needed and load the predictor ahead of the first job"""
+    try:
+        await download_model_if_needed()
+        await asyncio.to_thread(load_predictor)
+    except Exception as e:
+        logger.warning(f"Predictor warm-up failed: {e}")
+
+
+async def run_nnunet_inference(series: DicomSeries):
+    """
+    Run nnU-Net inference using DentalSegmentator model.
+    
+    Uses the persistent predictor from load_predictor() and runs entirely in
+    memory: the volume is passed to nnU-Net as a numpy array together with its
+    voxel spacing, and the label map comes back as an array.
+    
+    Returns:
+        Label map (z, y, x) uint8 aligned with series.volume, or None on failure
+    """
+    try:
+        predictor = await asyncio.to_thread(load_predictor)
+        if predictor is None:
+            return None
+        device = _predictor_device
         
-        # Convert DICOM to NIfTI
-        import SimpleITK as sitk
-        import pydicom
         import numpy as np
         
-        dcm_files = sorted(input_dir.glob("*.dcm")) or sorted(input_dir.iterdir())
-        slices = []
-        for f in dcm_files:
-            try:
-                ds = pydicom.dcmread(str(f))
-                if hasattr(ds, 'pixel_array'):
-                    slices.append((getattr(ds, 'SliceLocation', 0), ds.pixel_array))
-            except:
-                pass
-        
-        if not slices:
-            return False
-        
-        slices.sort(key=lambda x: x[0])
-        volume = np.stack([s[1] for s in slices], axis=0).astype(np.float32)
-        image = sitk.GetImageFromArray(volume)
+        volume = series.volume.astype(np.float32)[np.newaxis]
+        spacing = list(series.geometry["spacing"])
         
-        nnunet_input = output_dir / "input"
-        nnunet_input.mkdir(exist_ok=True)
-        nifti_path = nnunet_input / "volume_0000.nii.gz"
-        sitk.WriteImage(image, str(nifti_path))
-        
-        logger.info(f"Running inference on {device}...")
-        predictor.predict_from_files([[str(nifti_path)]], str(output_dir))
+        logger.info(f"Running inference on {device} (shape {series.volume.shape}, spacing {spacing})...")
+        seg_array = await asyncio.to_thread(
+            predictor.predict_single_npy_array,
+            volume,
+            {"spacing": spacing},
+            None,
+            None,
+            False
+        )
         
-        return bool(list(output_dir.glob("*.nii.gz")))
+        return np.asarray(seg_array, dtype=np.uint8)
         
     except Exception as e:
         logger.error(f"Inference failed: {e}")
-        return False
+        return None
 
 
 
-async def convert_segmentation_to_dicom_seg(
-    seg_nifti_path: Path,
-    original_dicom_dir: Path,
-    output_path: Path,
-    study_uid: str,
-    series_uid: str
-) -> Optional[str]:
-    """Convert NIfTI segmentation to DICOM SEG format and upload to Orthanc"""
+def create_dicom_seg(
+    seg_array,
+    series: DicomSeries,
+    series_uid: str,
+    encoding: str = "labelmap"
+) -> Optional[Tuple[BinaryIO, str]]:
+    """
+    Encode a label map as a DICOM SEG instance (CPU-bound, run in a thread).
+    
+    The SEG is written to a spooled temporary file (see
+    services.orthanc_upload.spool_file); the caller must close it.
+    
+    Args:
+        seg_array: Label map (z, y, x) aligned with series.volume
+        series: The decoded source series (headers, geometry)
+        series_uid: SeriesInstanceUID of the source series
+        encoding: One of SEG_ENCODINGS (see services.dicom_seg)
+        
+    Returns:
+        (DICOM file, SEG SeriesInstanceUID) or None on failure
+    """
     try:
-        import SimpleITK as sitk
-        import pydicom
         import highdicom as hd
         from highdicom.sr import CodedConcept
         from highdicom.seg import (
@@ -331,42 +536,23 @@ async def convert_segmentation_to_dicom_seg(
         )
         from highdicom.content import AlgorithmIdentificationSequence
         import numpy as np
-        from pydicom.uid import generate_uid
-        from io import BytesIO
-        import glob as glob_module
-        
-        # Load the segmentation
-        seg_image = sitk.ReadImage(str(seg_nifti_path))
-        seg_array = sitk.GetArrayFromImage(seg_image)
-        
-        # Get original DICOM files using glob (more robust than SimpleITK)
-        dicom_files = list(glob_module.glob(str(original_dicom_dir / "*.dcm")))
-        if not dicom_files:
-            # Try without extension
-            dicom_files = [str(f) for f in original_dicom_dir.iterdir() if f.is_file()]
-        
-        if not dicom_files:
-            logger.error("No DICOM files found in directory")
-            return None
-        
-        logger.info(f"Found {len(dicom_files)} DICOM files for SEG conversion")
+        from pydicom.uid import (
+            generate_uid,
+            ExplicitVRLittleEndian,
+            DeflatedExplicitVRLittleEndian,
+            RLELossless
+        )
+        binary = encoding == "binary"
+        transfer_syntax = {
+            "labelmap-rle": RLELossless,
+            "labelmap-deflate": DeflatedExplicitVRLittleEndian,
+        }.get(encoding, ExplicitVRLittleEndian)
         
-        source_datasets = []
-        for f in sorted(dicom_files):
-            try:
-                ds = pydicom.dcmread(f)
-                source_datasets.append(ds)
-            except Exception as e:
-                logger.warning(f"Could not read DICOM {f}: {e}")
+        source_datasets = series.datasets
+        geometry = series.geometry
         
-        if not source_datasets:
-            logger.error("No valid DICOM files could be read")
-            return None
-            
         # Check dimensions - handle multi-frame DICOM
-        expected_frames = len(source_datasets)
-        if hasattr(source_datasets[0], "NumberOfFrames") and expected_frames == 1:
-            expected_frames = int(source_datasets[0].NumberOfFrames)
+        expected_frames = series.num_frames
         
         # If dimensions don't match, try to adapt the mask
         if seg_array.shape[0] != expected_frames:
@@ -380,7 +566,9 @@ async def convert_segmentation_to_dicom_seg(
                 # Truncate
                 seg_array = seg_array[:expected_frames]
             
-        unique_labels = np.unique(seg_array)
+        # Label x frame occurrence, computed once for the whole volume
+        presence = label_presence(seg_array)
+        unique_labels = np.flatnonzero(presence.any(axis=0))
         unique_labels = unique_labels[unique_labels > 0]
         
         if len(unique_labels) == 0:
@@ -415,14 +603,17 @@ async def convert_segmentation_to_dicom_seg(
         
         # Try highdicom first, fallback to simple DICOM creation
         try:
-            logger.info(f"Creating DICOM SEG with highdicom. Seg array shape: {seg_array.shape}, Source datasets: {len(source_datasets)}")
+            logger.info(f"Creating {encoding} DICOM SEG with highdicom. Seg array shape: {seg_array.shape}, Source datasets: {len(source_datasets)}")
             
-            # Create highdicom Segmentation
+            # Create highdicom Segmentation. BINARY frames are bit-packed and
+            # empty ones left out; deflate is applied when writing the file.
             seg = Segmentation(
                 source_images=source_datasets,
                 pixel_array=seg_array.astype(np.uint8),
-                segmentation_type=SegmentationTypeValues.LABELMAP,
+                segmentation_type=SegmentationTypeValues.BINARY if binary else SegmentationTypeValues.LABELMAP,
                 segment_descriptions=descriptions,
+                transfer_syntax_uid=RLELossless if transfer_syntax == RLELossless else ExplicitVRLittleEndian,
+                omit_empty_frames=binary,
                 series_instance_uid=generate_uid(),
                 series_number=999,
                 sop_instance_uid=generate_uid(),
@@ -433,10 +624,12 @@ async def convert_segmentation_to_dicom_seg(
                 device_serial_number="1"
             )
             
-            # Save to memory buffer
-            buf = BytesIO()
+            if transfer_syntax == DeflatedExplicitVRLittleEndian:
+                seg.file_meta.TransferSyntaxUID = DeflatedExplicitVRLittleEndian
+            
+            # Serialize to a spooled temp file (moves to disk when large)
+            buf = spool_file()
             seg.save_as(buf)
-            buf.seek(0)
             seg_series_uid = str(seg.SeriesInstanceUID)
             
         except Exception as hd_error:
@@ -451,11 +644,11 @@ async def convert_segmentation_to_dicom_seg(
                 seg_series_uid = generate_uid()
                 sop_instance_uid = generate_uid()
                 
-                # Create file meta
+                # Create file meta (label maps use the Label Map Segmentation Storage SOP class)
                 file_meta = Dataset()
-                file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.66.4'  # Segmentation Storage
+                file_meta.MediaStorageSOPClassUID = SEGMENTATION_STORAGE if binary else LABEL_MAP_SEGMENTATION_STORAGE
                 file_meta.MediaStorageSOPInstanceUID = sop_instance_uid
-                file_meta.TransferSyntaxUID = '1.2.840.10008.1.2.1'  # Explicit VR Little Endian
+                file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
                 file_meta.ImplementationClassUID = '1.2.826.0.1.3680043.8.498.1'
                 file_meta.ImplementationVersionName = 'Voxel3Di'
                 
@@ -515,14 +708,22 @@ async def convert_segmentation_to_dicom_seg(
                 ds.PhotometricInterpretation = 'MONOCHROME2'
                 ds.Rows = seg_array.shape[1]
                 ds.Columns = seg_array.shape[2]
-                ds.BitsAllocated = 8
-                ds.BitsStored = 8
-                ds.HighBit = 7
                 ds.PixelRepresentation = 0
-                ds.NumberOfFrames = seg_array.shape[0]
+                if binary:
+                    # One 1-bit frame per (segment, slice) containing that segment
+                    binary_frames = binary_frame_index(presence)
+                    ds.BitsAllocated = 1
+                    ds.BitsStored = 1
+                    ds.HighBit = 0
+                    ds.NumberOfFrames = len(binary_frames)
+                else:
+                    ds.BitsAllocated = 8
+                    ds.BitsStored = 8
+                    ds.HighBit = 7
+                    ds.NumberOfFrames = seg_array.shape[0]
                 
                 # Segmentation Image Module
-                ds.SegmentationType = 'BINARY'
+                ds.SegmentationType = 'BINARY' if binary else 'LABELMAP'
                 ds.ContentLabel = 'SEGMENTATION'
                 ds.ContentDescription = 'AI Dental Anatomy Segmentation'
                 ds.ContentCreatorName = 'DentalSegmentator AI'
@@ -532,12 +733,12 @@ async def convert_segmentation_to_dicom_seg(
                 ref_series_seq.SeriesInstanceUID = series_uid  # Original CT series
                 
                 # Create ReferencedInstanceSequence for all source instances
+                # (for multi-frame sources this is the single instance)
                 ref_instance_seq = []
-                if src:
-                    # For multi-frame, reference the single instance
+                for source_ds in source_datasets:
                     ref_inst = Dataset()
-                    ref_inst.ReferencedSOPClassUID = getattr(src, 'SOPClassUID', '1.2.840.10008.5.1.4.1.1.2')
-                    ref_inst.ReferencedSOPInstanceUID = getattr(src, 'SOPInstanceUID', generate_uid())
+                    ref_inst.ReferencedSOPClassUID = getattr(source_ds, 'SOPClassUID', '1.2.840.10008.5.1.4.1.1.2')
+                    ref_inst.ReferencedSOPInstanceUID = getattr(source_ds, 'SOPInstanceUID', generate_uid())
                     ref_instance_seq.append(ref_inst)
                 
                 ref_series_seq.ReferencedInstanceSequence = Sequence(ref_instance_seq)
@@ -609,50 +810,24 @@ async def convert_segmentation_to_dicom_seg(
                 ds.SharedFunctionalGroupsSequence = Sequence([shared_fg])
                 
                 # === PerFrameFunctionalGroupsSequence ===
-                per_frame_fg = []
-                num_frames = seg_array.shape[0]
-                
-                # Get starting position if available
-                if src and hasattr(src, 'ImagePositionPatient'):
-                    start_pos = list(src.ImagePositionPatient)
+                if binary:
+                    # Per-frame source references (single-frame sources only)
+                    source_instances = None
+                    if len(source_datasets) == seg_array.shape[0]:
+                        source_instances = [(src_ds.SOPClassUID, src_ds.SOPInstanceUID) for src_ds in source_datasets]
+                    ds.PerFrameFunctionalGroupsSequence = build_binary_per_frame_functional_groups(
+                        binary_frames,
+                        geometry["origin"],
+                        geometry["spacing"][0],
+                        source_instances
+                    )
                 else:
-                    start_pos = [0.0, 0.0, 0.0]
-                
-                slice_spacing = float(pixel_measures.SpacingBetweenSlices)
-                
-                for frame_idx in range(num_frames):
-                    frame_item = Dataset()
-                    
-                    # Frame Content Sequence
-                    frame_content = Dataset()
-                    frame_content.DimensionIndexValues = [1, frame_idx + 1]
-                    frame_item.FrameContentSequence = Sequence([frame_content])
-                    
-                    # Plane Position Sequence
-                    plane_pos = Dataset()
-                    # Calculate position for this frame
-                    frame_pos = [
-                        start_pos[0],
-                        start_pos[1],
-                        start_pos[2] + frame_idx * slice_spacing
-                    ]
-                    plane_pos.ImagePositionPatient = frame_pos
-                    frame_item.PlanePositionSequence = Sequence([plane_pos])
-                    
-                    # Segment Identification Sequence
-                    # For labelmap, we reference all segments that appear in this frame
-                    frame_data = seg_array[frame_idx]
-                    frame_segments = np.unique(frame_data)
-                    frame_segments = frame_segments[frame_segments > 0]
-                    
-                    if len(frame_segments) > 0:
-                        seg_id = Dataset()
-                        seg_id.ReferencedSegmentNumber = int(frame_segments[0])  # Primary segment
-                        frame_item.SegmentIdentificationSequence = Sequence([seg_id])
-                    
-                    per_frame_fg.append(frame_item)
-                
-                ds.PerFrameFunctionalGroupsSequence = Sequence(per_frame_fg)
+                    ds.PerFrameFunctionalGroupsSequence = build_per_frame_functional_groups(
+                        seg_array,
+                        geometry["origin"],
+                        geometry["spacing"][0],
+                        presence
+                    )
                 
                 # Dimension Organization
                 dim_org = Dataset()
@@ -662,19 +837,27 @@ async def convert_segmentation_to_dicom_seg(
                 dim_idx = Dataset()
                 dim_idx.DimensionOrganizationUID = dim_org.DimensionOrganizationUID
                 dim_idx.DimensionIndexPointer = 0x00620004  # Segment Number
-                ds.DimensionIndexSequence = Sequence([dim_idx])
+                dim_idx.FunctionalGroupPointer = 0x0062000A  # Segment Identification Sequence
                 
-                # Set pixel data
-                ds.PixelData = seg_array.astype(np.uint8).tobytes()
+                dim_pos = Dataset()
+                dim_pos.DimensionOrganizationUID = dim_org.DimensionOrganizationUID
+                dim_pos.DimensionIndexPointer = 0x00200032  # Image Position (Patient)
+                dim_pos.FunctionalGroupPointer = 0x00209113  # Plane Position Sequence
+                ds.DimensionIndexSequence = Sequence([dim_idx, dim_pos])
                 
-                ds.is_little_endian = True
-                ds.is_implicit_VR = False
+                # Set pixel data
+                if binary:
+                    ds.PixelData = pack_binary_frames(seg_array, binary_frames)
+                elif transfer_syntax == RLELossless:
+                    ds.compress(RLELossless, seg_array.astype(np.uint8))
+                else:
+                    ds.PixelData = seg_array.astype(np.uint8).tobytes()
+                    ds.file_meta.TransferSyntaxUID = transfer_syntax
                 
-                buf = BytesIO()
-                ds.save_as(buf)
-                buf.seek(0)
+                buf = spool_file()
+                ds.save_as(buf, enforce_file_format=True)
                 
-                logger.info(f"Created OHIF-compatible DICOM SEG with SeriesUID: {seg_series_uid}")
+                logger.info(f"Created OHIF-compatible {encoding} DICOM SEG with SeriesUID: {seg_series_uid}")
                 
             except Exception as fallback_error:
                 logger.error(f"Fallback DICOM creation also failed: {fallback_error}")
@@ -682,24 +865,8 @@ async def convert_segmentation_to_dicom_seg(
                 traceback.print_exc()
                 return None
         
-        # Upload to Orthanc
-        orthanc_url = ORTHANC_URL.rstrip('/')
-        logger.info(f"Uploading SEG to Orthanc: {orthanc_url}")
+        return buf, seg_series_uid
         
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"{orthanc_url}/instances",
-                content=buf.read(),
-                headers={"Content-Type": "application/dicom"}
-            )
-            
-            if resp.status_code != 200:
-                logger.error(f"Orthanc upload failed: {resp.status_code} {resp.text}")
-                return None
-                
-            logger.info(f"Successfully uploaded SEG series: {seg_series_uid}")
-            return seg_series_uid
-            
     except Exception as e:
         logger.error(f"Error converting to DICOM SEG: {e}")
         import traceback
@@ -707,219 +874,192 @@ async def convert_segmentation_to_dicom_seg(
         return None
 
 
-async def run_segmentation_job(job_id: str, study_uid: str, series_uid: str):
+async def convert_segmentation_to_dicom_seg(
+    seg_array,
+    series: DicomSeries,
+    study_uid: str,
+    series_uid: str,
+    seg_encoding: str = "labelmap"
+) -> Optional[str]:
+    """
+    Convert a label map to DICOM SEG format and upload to Orthanc.
+    
+    Args:
+        seg_array: Label map (z, y, x) aligned with series.volume
+        series: The decoded source series (headers, geometry)
+        study_uid: StudyInstanceUID of the source series
+        series_uid: SeriesInstanceUID of the source series
+        seg_encoding: One of SEG_ENCODINGS
+    """
+    result = await asyncio.to_thread(create_dicom_seg, seg_array, series, series_uid, seg_encoding)
+    if result is None:
+        return None
+    seg_file, seg_series_uid = result
+    
+    try:
+        # Stream the SEG to Orthanc in chunks (retried on transient errors)
+        logger.info(f"Uploading SEG to Orthanc: {ORTHANC_URL}")
+        
+        if await upload_instance(seg_file, f"SEG {seg_series_uid}") is None:
+            return None
+            
+        logger.info(f"Successfully uploaded SEG series: {seg_series_uid}")
+        return seg_series_uid
+        
+    except Exception as e:
+        logger.error(f"Error uploading DICOM SEG: {e}")
+        return None
+    
+    finally:
+        seg_file.close()
+
+
+def create_demo_segmentation(img_array):
+    """Build the demonstration label map used when nnU-Net is unavailable (CPU-bound)"""
+    import numpy as np
+    
+    logger.info(f"Final volume shape: {img_array.shape}")
+    
+    # Ensure we have at least some depth
+    if img_array.shape[0] < 10:
+        # Repeat slices to get a reasonable volume
+        repeats = max(10 // img_array.shape[0], 1) + 1
+        img_array = np.tile(img_array, (repeats, 1, 1))[:100]
+        logger.info(f"Expanded volume to shape: {img_array.shape}")
+    
+    # Create segmentation mask with anatomically-placed regions
+    mask_arr = np.zeros(img_array.shape, dtype=np.uint8)
+    
+    z, y, x = mask_arr.shape
+    logger.info(f"Creating demo segmentation for volume of size: {z}x{y}x{x}")
+    
+    # Create simple geometric segments representing dental structures
+    # These should span the FULL Z-DEPTH of the volume
+    def safe_range(start_pct, end_pct, size):
+        s = max(0, int(size * start_pct))
+        e = max(s + 1, int(size * end_pct))
+        return s, min(e, size)
+    
+    # ALL segments should span the full Z depth (0 to 100%)
+    z1, z2 = safe_range(0.0, 1.0, z)  # Full volume depth
+    logger.info(f"Z range for all segments: {z1} to {z2} (full depth)")
+    
+    # Maxilla (label 1) - upper region (top half of Y)
+    y1, y2 = safe_range(0.1, 0.4, y)
+    x1, x2 = safe_range(0.2, 0.8, x)
+    mask_arr[z1:z2, y1:y2, x1:x2] = 1
+    logger.info(f"Maxilla: z={z1}:{z2}, y={y1}:{y2}, x={x1}:{x2}")
+    
+    # Mandible (label 2) - lower region (bottom half of Y)
+    y1, y2 = safe_range(0.6, 0.9, y)
+    x1, x2 = safe_range(0.2, 0.8, x)
+    mask_arr[z1:z2, y1:y2, x1:x2] = 2
+    logger.info(f"Mandible: z={z1}:{z2}, y={y1}:{y2}, x={x1}:{x2}")
+    
+    # Upper teeth (label 3) - middle upper
+    y1, y2 = safe_range(0.35, 0.5, y)
+    x1, x2 = safe_range(0.3, 0.7, x)
+    mask_arr[z1:z2, y1:y2, x1:x2] = 3
+    logger.info(f"Upper Teeth: z={z1}:{z2}, y={y1}:{y2}, x={x1}:{x2}")
+    
+    # Lower teeth (label 4) - middle lower
+    y1, y2 = safe_range(0.5, 0.65, y)
+    x1, x2 = safe_range(0.3, 0.7, x)
+    mask_arr[z1:z2, y1:y2, x1:x2] = 4
+    logger.info(f"Lower Teeth: z={z1}:{z2}, y={y1}:{y2}, x={x1}:{x2}")
+    
+    # Mandibular canal (label 5) - thin tubes on sides (lower region)
+    y1, y2 = safe_range(0.7, 0.85, y)
+    x1_l, x2_l = safe_range(0.15, 0.3, x)
+    x1_r, x2_r = safe_range(0.7, 0.85, x)
+    mask_arr[z1:z2, y1:y2, x1_l:x2_l] = 5
+    mask_arr[z1:z2, y1:y2, x1_r:x2_r] = 5
+    logger.info(f"Mandibular Canal: z={z1}:{z2}, y={y1}:{y2}, x_left={x1_l}:{x2_l}, x_right={x1_r}:{x2_r}")
+    
+    logger.info(f"Demo mask unique values: {np.unique(mask_arr).tolist()}")
+    return mask_arr
+
+
+def segmentation_key(series_uid: str, seg_encoding: str = "labelmap") -> str:
+    """Claim key of a segmentation request; identical requests share one job"""
+    return f"{series_uid}:{seg_encoding}"
+
+
+async def run_segmentation_job(job_id: str, study_uid: str, series_uid: str, seg_encoding: str = "labelmap"):
     """Background task to run the full segmentation pipeline"""
     print(f"[SEGMENTATION] Starting job {job_id} for study={study_uid}, series={series_uid}")
     dicom_dir = None
-    output_dir = None
     work_dir = None
     
     try:
-        segmentation_jobs[job_id]["status"] = "running"
-        segmentation_jobs[job_id]["progress"] = "Downloading DICOM..."
+        segmentation_jobs.update(job_id, status="running", progress="Downloading DICOM...", percent=0)
         print(f"[SEGMENTATION] Job {job_id}: Downloading DICOM...")
         
+        # Version of the source series, recorded with the result (see find_cached_segmentation)
+        source_entry = await series_index.resolve(series_uid)
+        
         # Create working directory
         work_dir = Path(tempfile.mkdtemp(prefix="dental_seg_"))
         dicom_dir = work_dir / "dicom"
-        output_dir = work_dir / "output"
-        output_dir.mkdir(exist_ok=True)
         
-        # Step 1: Download DICOM from Orthanc
-        if not await fetch_dicom_from_orthanc(series_uid, dicom_dir):
-            raise Exception("Failed to fetch DICOM from Orthanc")
+        # Step 1: Download and decode the series (or reuse it from the volume cache)
+        series = await load_source_series(series_uid, dicom_dir, job_id)
         
-        segmentation_jobs[job_id]["progress"] = "Running AI segmentation..."
+        segmentation_jobs.update(job_id, progress="Running AI segmentation...", percent=45)
         
         # Step 2: Try to run nnU-Net inference (may fail due to memory)
-        nnunet_success = False
+        seg_array = None
         try:
             # Ensure model is downloaded first
             await download_model_if_needed()
-            nnunet_success = await run_nnunet_inference(dicom_dir, output_dir)
+            seg_array = await run_nnunet_inference(series)
         except Exception as inf_e:
             logger.warning(f"nnU-Net inference error: {inf_e}")
-            nnunet_success = False
         
-        # Step 3: Check for nnU-Net output or create fallback
-        seg_files = list(output_dir.glob("*.nii.gz"))
+        nnunet_success = seg_array is not None
         
-        if not nnunet_success or not seg_files:
+        # Step 3: Use the nnU-Net output or create fallback
+        if not nnunet_success:
             logger.info("Creating fallback demonstration segmentation...")
-            segmentation_jobs[job_id]["progress"] = "Creating demo segmentation..."
-            
-            # Create fallback segmentation using pydicom (more robust)
-            import pydicom
-            import numpy as np
-            import glob
-            
-            # Find DICOM files in the directory
-            dcm_files = list(glob.glob(str(dicom_dir / "*.dcm")))
-            if not dcm_files:
-                # Try without extension
-                dcm_files = [f for f in dicom_dir.iterdir() if f.is_file()]
-            
-            if not dcm_files:
-                raise Exception("No DICOM files found in directory")
-            
-            logger.info(f"Found {len(dcm_files)} DICOM files for demo segmentation")
-            
-            # Read DICOM files with pydicom
-            datasets = []
-            for f in sorted(dcm_files):
-                try:
-                    ds = pydicom.dcmread(str(f))
-                    if hasattr(ds, 'PixelData'):
-                        datasets.append(ds)
-                except Exception as e:
-                    logger.warning(f"Could not read {f}: {e}")
-            
-            if not datasets:
-                raise Exception("No valid DICOM files with pixel data found")
-            
-            # Create 3D volume from datasets
-            slices = []
-            for ds in datasets:
-                arr = ds.pixel_array
-                logger.info(f"Pixel array shape: {arr.shape}, ndim: {arr.ndim}")
-                
-                if arr.ndim == 2:
-                    slices.append(arr)
-                elif arr.ndim == 3:
-                    # Could be multi-frame (frames, rows, cols) or RGB (rows, cols, 3)
-                    if arr.shape[2] == 3:
-                        # RGB image - convert to grayscale
-                        gray = arr[:, :, 0]  # Just take first channel
-                        slices.append(gray)
-                    else:
-                        # Multi-frame DICOM: (frames, rows, cols)
-                        for i in range(arr.shape[0]):
-                            slices.append(arr[i])
-                elif arr.ndim == 4:
-                    # Enhanced DICOM: could be (1, frames, rows, cols) or (frames, rows, cols, channels)
-                    if arr.shape[0] == 1:
-                        # Shape is (1, frames, rows, cols) - squeeze first dimension
-                        arr = arr[0]
-                        for i in range(arr.shape[0]):
-                            slices.append(arr[i])
-                    elif arr.shape[3] == 3:
-                        # Shape is (frames, rows, cols, 3) - RGB frames
-                        for i in range(arr.shape[0]):
-                            slices.append(arr[i, :, :, 0])  # Take first channel
-                    else:
-                        # Try to squeeze any dimension of size 1
-                        arr = np.squeeze(arr)
-                        if arr.ndim == 3:
-                            for i in range(arr.shape[0]):
-                                slices.append(arr[i])
-                        elif arr.ndim == 2:
-                            slices.append(arr)
-            
-            if not slices:
-                # Create a dummy array if no pixel data available
-                logger.warning("No pixel data found, creating dummy volume")
-                img_array = np.zeros((100, 128, 128), dtype=np.float32)
-            else:
-                img_array = np.stack(slices, axis=0).astype(np.float32)
-            
-            logger.info(f"Final volume shape: {img_array.shape}")
-            
-            # Ensure we have at least some depth
-            if img_array.shape[0] < 10:
-                # Repeat slices to get a reasonable volume
-                repeats = max(10 // img_array.shape[0], 1) + 1
-                img_array = np.tile(img_array, (repeats, 1, 1))[:100]
-                logger.info(f"Expanded volume to shape: {img_array.shape}")
-            
-            # For SimpleITK image creation (needed for later)
-            import SimpleITK as sitk
-            image = sitk.GetImageFromArray(img_array)
-            
-            # Create segmentation mask with anatomically-placed regions
-            img_array = sitk.GetArrayFromImage(image)
-            mask_arr = np.zeros(img_array.shape, dtype=np.uint8)
-            
-            z, y, x = mask_arr.shape
-            logger.info(f"Creating demo segmentation for volume of size: {z}x{y}x{x}")
-            
-            # Create simple geometric segments representing dental structures
-            # These should span the FULL Z-DEPTH of the volume
-            def safe_range(start_pct, end_pct, size):
-                s = max(0, int(size * start_pct))
-                e = max(s + 1, int(size * end_pct))
-                return s, min(e, size)
-            
-            # ALL segments should span the full Z depth (0 to 100%)
-            z1, z2 = safe_range(0.0, 1.0, z)  # Full volume depth
-            logger.info(f"Z range for all segments: {z1} to {z2} (full depth)")
+            segmentation_jobs.update(job_id, progress="Creating demo segmentation...", percent=60)
             
-            # Maxilla (label 1) - upper region (top half of Y)
-            y1, y2 = safe_range(0.1, 0.4, y)
-            x1, x2 = safe_range(0.2, 0.8, x)
-            mask_arr[z1:z2, y1:y2, x1:x2] = 1
-            logger.info(f"Maxilla: z={z1}:{z2}, y={y1}:{y2}, x={x1}:{x2}")
-            
-            # Mandible (label 2) - lower region (bottom half of Y)
-            y1, y2 = safe_range(0.6, 0.9, y)
-            x1, x2 = safe_range(0.2, 0.8, x)
-            mask_arr[z1:z2, y1:y2, x1:x2] = 2
-            logger.info(f"Mandible: z={z1}:{z2}, y={y1}:{y2}, x={x1}:{x2}")
-            
-            # Upper teeth (label 3) - middle upper
-            y1, y2 = safe_range(0.35, 0.5, y)
-            x1, x2 = safe_range(0.3, 0.7, x)
-            mask_arr[z1:z2, y1:y2, x1:x2] = 3
-            logger.info(f"Upper Teeth: z={z1}:{z2}, y={y1}:{y2}, x={x1}:{x2}")
-            
-            # Lower teeth (label 4) - middle lower
-            y1, y2 = safe_range(0.5, 0.65, y)
-            x1, x2 = safe_range(0.3, 0.7, x)
-            mask_arr[z1:z2, y1:y2, x1:x2] = 4
-            logger.info(f"Lower Teeth: z={z1}:{z2}, y={y1}:{y2}, x={x1}:{x2}")
-            
-            # Mandibular canal (label 5) - thin tubes on sides (lower region)
-            y1, y2 = safe_range(0.7, 0.85, y)
-            x1_l, x2_l = safe_range(0.15, 0.3, x)
-            x1_r, x2_r = safe_range(0.7, 0.85, x)
-            mask_arr[z1:z2, y1:y2, x1_l:x2_l] = 5
-            mask_arr[z1:z2, y1:y2, x1_r:x2_r] = 5
-            logger.info(f"Mandibular Canal: z={z1}:{z2}, y={y1}:{y2}, x_left={x1_l}:{x2_l}, x_right={x1_r}:{x2_r}")
-            
-            logger.info(f"Demo mask unique values: {np.unique(mask_arr).tolist()}")
-            
-            # Create SimpleITK image from mask
-            mask_img = sitk.GetImageFromArray(mask_arr)
-            mask_img.CopyInformation(image)
-            
-            # Write fallback segmentation
-            fallback_path = output_dir / "volume_0000.nii.gz"
-            sitk.WriteImage(mask_img, str(fallback_path))
-            seg_files = [fallback_path]
-            logger.info(f"Created fallback segmentation at {fallback_path}")
+            seg_array = await asyncio.to_thread(create_demo_segmentation, series.volume)
         
-        segmentation_jobs[job_id]["progress"] = "Converting to DICOM..."
+        segmentation_jobs.update(job_id, progress="Converting to DICOM...", percent=85)
         
         # Step 4: Convert to DICOM SEG
         seg_uid = await convert_segmentation_to_dicom_seg(
-            seg_files[0],
-            dicom_dir,
-            output_dir,
+            seg_array,
+            series,
             study_uid,
-            series_uid
+            series_uid,
+            seg_encoding
         )
         
         if not seg_uid:
             raise Exception("Failed to convert segmentation to DICOM SEG")
         
+        # Remember real (non-demo) results so the series is not segmented again
+        if nnunet_success and source_entry is not None and _predictor_fingerprint:
+            await asyncio.to_thread(
+                segmentation_results.put,
+                series_uid,
+                _predictor_fingerprint,
+                result_params(seg_encoding),
+                series_version(source_entry),
+                seg_uid
+            )
+        
         # Complete
         is_fallback = not nnunet_success
-        segmentation_jobs[job_id]["status"] = "completed"
-        segmentation_jobs[job_id]["progress"] = "Done" + (" (Demo Mode)" if is_fallback else "")
-        segmentation_jobs[job_id]["segmentation_uid"] = seg_uid
-        segmentation_jobs[job_id]["segments"] = [
-            {"label": k, **v} for k, v in SEGMENT_INFO.items()
-        ]
-        segmentation_jobs[job_id]["output_path"] = str(output_dir)
+        segmentation_jobs.update(
+            job_id,
+            status="completed",
+            progress="Done" + (" (Demo Mode)" if is_fallback else ""),
+            percent=100,
+            segmentation_uid=seg_uid,
+            segments=[{"label": k, **v} for k, v in SEGMENT_INFO.items()]
+        )
         
         logger.info(f"Segmentation job {job_id} completed successfully" + (" (fallback)" if is_fallback else ""))
             
@@ -928,16 +1068,28 @@ async def run_segmentation_job(job_id: str, study_uid: str, series_uid: str):
         import traceback
         traceback.print_exc()
         
-        segmentation_jobs[job_id]["status"] = "failed"
-        segmentation_jobs[job_id]["error"] = str(e)
-        segmentation_jobs[job_id]["progress"] = f"Failed: {str(e)}"
+        segmentation_jobs.update(
+            job_id,
+            status="failed",
+            error=str(e),
+            progress=f"Failed: {str(e)}"
+        )
+    
+    finally:
+        segmentation_jobs.release(segmentation_key(series_uid, seg_encoding), job_id)
+
+
+# Runs run_segmentation_job for queued jobs, SEGMENTATION_WORKERS at a time
+segmentation_queue = JobQueue(
+    "segmentation",
+    run_segmentation_job,
+    workers=SEGMENTATION_WORKERS,
+    max_size=SEGMENTATION_QUEUE_SIZE
+)
 
 
 @router.post("/segment", response_model=SegmentationResponse)
-async def trigger_segmentation(
-    req: SegmentationRequest,
-    background_tasks: BackgroundTasks
-):
+async def trigger_segmentation(req: SegmentationRequest):
     """
     Trigger dental CBCT segmentation using DentalSegmentator
     
@@ -953,65 +1105,125 @@ async def trigger_segmentation(
     Returns:
         SegmentationResponse with job ID
     """
+    if req.segEncoding not in SEG_ENCODINGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown segEncoding '{req.segEncoding}', expected one of: {', '.join(SEG_ENCODINGS)}"
+        )
+    
     try:
         job_id = str(uuid.uuid4())
         
-        # Initialize job tracking
-        segmentation_jobs[job_id] = {
-            "status": "queued",
-            "progress": "Waiting to start...",
-            "study_uid": req.studyInstanceUID,
-            "series_uid": req.seriesInstanceUID,
-            "segmentation_uid": None,
-            "segments": None,
-            "error": None
-        }
+        # Reuse the SEG of an earlier run on the same, unchanged series
+        cached_uid = None if req.recompute else await find_cached_segmentation(req.seriesInstanceUID, req.segEncoding)
+        if cached_uid:
+            logger.info(f"Using cached segmentation {cached_uid} for series {req.seriesInstanceUID}")
+            segmentation_jobs.create(
+                job_id,
+                status="completed",
+                progress="Done (cached)",
+                percent=100,
+                study_uid=req.studyInstanceUID,
+                series_uid=req.seriesInstanceUID,
+                seg_encoding=req.segEncoding,
+                segmentation_uid=cached_uid,
+                segments=[{"label": k, **v} for k, v in SEGMENT_INFO.items()],
+                error=None
+            )
+            return _job_response(job_id, segmentation_jobs.get(job_id))
         
-        # Start background task
-        print(f"[SEGMENTATION] Scheduling background task for job {job_id}")
-        background_tasks.add_task(
-            run_segmentation_job,
+        # Initialize job tracking
+        segmentation_jobs.create(
             job_id,
-            req.studyInstanceUID,
-            req.seriesInstanceUID
+            status="queued",
+            progress="Waiting to start...",
+            percent=0,
+            study_uid=req.studyInstanceUID,
+            series_uid=req.seriesInstanceUID,
+            seg_encoding=req.segEncoding,
+            segmentation_uid=None,
+            segments=None,
+            error=None
         )
-        print(f"[SEGMENTATION] Background task scheduled for job {job_id}")
         
-        logger.info(f"Segmentation job {job_id} queued for series {req.seriesInstanceUID}")
+        # Attach to a queued/running job for the same series instead of starting another
+        key = segmentation_key(req.seriesInstanceUID, req.segEncoding)
+        holder = segmentation_jobs.claim(key, job_id)
+        existing = segmentation_jobs.get(holder) if holder != job_id else None
+        if existing is not None:
+            segmentation_jobs.delete(job_id)
+            logger.info(f"Segmentation request for series {req.seriesInstanceUID} attached to job {holder}")
+            response = _job_response(holder, existing)
+            response.message = "Attached to an existing segmentation job for this series. " + response.message
+            return response
+        
+        # Hand the job to the worker pool
+        try:
+            position = segmentation_queue.submit(job_id, req.studyInstanceUID, req.seriesInstanceUID, req.segEncoding)
+        except QueueFullError as e:
+            segmentation_jobs.release(key, job_id)
+            segmentation_jobs.delete(job_id)
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+        
+        logger.info(f"Segmentation job {job_id} queued for series {req.seriesInstanceUID} (position {position})")
         
         return SegmentationResponse(
             status="queued",
             message="Segmentation job started. Use /status/{job_id} to check progress.",
-            job_id=job_id
+            job_id=job_id,
+            queue_position=position
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to start segmentation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _job_response(job_id: str, job: Dict[str, Any]) -> SegmentationResponse:
+    return SegmentationResponse(
+        status=job["status"],
+        message=job.get("progress", ""),
+        job_id=job_id,
+        segmentation_uid=job.get("segmentation_uid"),
+        segments=job.get("segments"),
+        queue_position=segmentation_queue.position(job_id) if job["status"] == "queued" else None,
+        percent=job.get("percent"),
+        version=job.get("version")
+    )
+
+
 @router.get("/status/{job_id}", response_model=SegmentationResponse)
-async def get_segmentation_status(job_id: str):
+async def get_segmentation_status(job_id: str, since: Optional[int] = None, wait: float = 0):
     """
     Get status of a segmentation job
     
     Args:
         job_id: The job ID returned from /segment
+        since: Long-poll: the `version` of the last status the client saw
+        wait: Long-poll: seconds to wait for a newer version (capped)
         
     Returns:
         Current status and results if completed
     """
-    if job_id not in segmentation_jobs:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
-    job = segmentation_jobs[job_id]
+    job = await wait_for_job(segmentation_jobs, job_id, since, wait)
+    return _job_response(job_id, job)
+
+
+@router.get("/events/{job_id}")
+async def stream_segmentation_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Stream progress of a segmentation job as Server-Sent Events
     
-    return SegmentationResponse(
-        status=job["status"],
-        message=job.get("progress", ""),
-        job_id=job_id,
-        segmentation_uid=job.get("segmentation_uid"),
-        segments=job.get("segments")
+    Emits a "progress" event (same body as /status) on every update and
+    closes once the job has completed or failed.
+    """
+    return job_event_response(
+        segmentation_jobs,
+        job_id,
+        lambda jid, job: _job_response(jid, job).dict(),
+        last_event_id
     )
 
 
@@ -1045,10 +1257,42 @@ async def health_check():
         "service": "dental-segmentator",
         "model_available": model_available,
         "model_path": MODEL_DIR,
-        "active_jobs": len([j for j in segmentation_jobs.values() if j["status"] == "running"])
+        "model_loaded": _predictor is not None,
+        "model_device": _predictor_device,
+        "model_fingerprint": _predictor_fingerprint,
+        "indexed_series": len(series_index),
+        "active_jobs": segmentation_jobs.count("running"),
+        "job_queue": segmentation_queue.stats(),
+        "result_cache": segmentation_results.stats()
     }
 
 
+@router.post("/reload-model")
+async def reload_model(force: bool = False):
+    """
+    Reload the nnU-Net predictor after the model files changed
+    
+    Args:
+        force: Reload even if the checkpoint files look unchanged
+        
+    Returns:
+        Whether the model was reloaded, with its fingerprint and device
+    """
+    model_folder = find_model_folder()
+    if model_folder is None:
+        raise HTTPException(status_code=404, detail=f"Model not found at {MODEL_DIR}")
+    
+    fingerprint = await asyncio.to_thread(model_fingerprint, model_folder)
+    if not force and _predictor is not None and fingerprint == _predictor_fingerprint:
+        return {"status": "unchanged", "model_fingerprint": fingerprint, "model_device": _predictor_device}
+    
+    predictor = await asyncio.to_thread(load_predictor, True)
+    if predictor is None:
+        raise HTTPException(status_code=500, detail="Failed to load nnU-Net model")
+    
+    return {"status": "reloaded", "model_fingerprint": _predictor_fingerprint, "model_device": _predictor_device}
+
+
 @router.get("/download/{series_uid}")
 async def download_segmentation(series_uid: str):
     """
@@ -1063,39 +1307,31 @@ async def download_segmentation(series_uid: str):
     from fastapi.responses import Response
     
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            # Find the series in Orthanc by SeriesInstanceUID
-            response = await client.post(
-                f"{ORTHANC_URL}/tools/find",
-                json={
-                    "Level": "Series",
-                    "Query": {"SeriesInstanceUID": series_uid},
-                    "Expand": False
-                }
-            )
-            
-            if response.status_code != 200 or not response.json():
-                raise HTTPException(status_code=404, detail="Segmentation not found in Orthanc")
-            
-            orthanc_series_id = response.json()[0]
-            
-            # Get the series archive (all instances as zip)
-            archive_resp = await client.get(
-                f"{ORTHANC_URL}/series/{orthanc_series_id}/archive"
-            )
-            
-            if archive_resp.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to download from Orthanc")
-            
-            # Return as downloadable zip
-            return Response(
-                content=archive_resp.content,
-                media_type="application/zip",
-                headers={
-                    "Content-Disposition": f'attachment; filename="segmentation_{series_uid[:20]}.zip"'
-                }
-            )
-            
+        client = get_orthanc_client()
+# Find the series in Orthanc by SeriesInstanceUID
+        entry = await series_index.resolve(series_uid)
+        if not entry:
+            raise HTTPException(status_code=404, detail="Segmentation not found in Orthanc")
+        
+        orthanc_series_id = entry["orthanc_id"]
+        
+        # Get the series archive (all instances as zip)
+        archive_resp = await client.get(
+            f"/series/{orthanc_series_id}/archive"
+        )
+        
+        if archive_resp.status_code != 200:
+            raise HTTPException(status_code=500, detail="Failed to download from Orthanc")
+        
+        # Return as downloadable zip
+        return Response(
+            content=archive_resp.content,
+            media_type="application/zip",
+            headers={
+                "Content-Disposition": f'attachment; filename="segmentation_{series_uid[:20]}.zip"'
+            }
+        )
+        
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Orthanc connection error: {str(e)}")
 
@@ -1109,155 +1345,213 @@ async def list_available_segmentations():
         List of available segmentation series
     """
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(f"{ORTHANC_URL}/series")
-            if response.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to query Orthanc")
-            
-            all_series = response.json()
-            seg_series = []
-            
-            for series_id in all_series:
-                series_info = await client.get(f"{ORTHANC_URL}/series/{series_id}")
-                if series_info.status_code == 200:
-                    info = series_info.json()
-                    modality = info.get("MainDicomTags", {}).get("Modality", "")
-                    if modality == "SEG":
-                        series_uid = info.get("MainDicomTags", {}).get("SeriesInstanceUID", "")
-                        seg_series.append({
-                            "orthanc_id": series_id,
-                            "series_uid": series_uid,
-                            "instances": len(info.get("Instances", []))
-                        })
-            
-            return {"segmentations": seg_series, "count": len(seg_series)}
-            
-    except httpx.RequestError as e:
+        seg_series = [
+            {
+                "orthanc_id": entry["orthanc_id"],
+                "series_uid": entry["series_uid"],
+                "instances": entry["instances"]
+            }
+            for entry in await series_index.list_series(modality="SEG")
+        ]
+        
+        return {"segmentations": seg_series, "count": len(seg_series)}
+        
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Orthanc error: {str(e)}")
 
 
+def labelmap_etag(entry: Dict[str, Any], *variant: str) -> str:
+    """
+    ETag of a representation of a SEG series' label map.
+    
+    Derived from the SEG series version, so it can be checked against
+    If-None-Match before anything is downloaded or decoded. `variant` tells
+    representations of the same SEG apart (endpoint, encoding, ...).
+    """
+    token = "|".join([entry["series_uid"], series_version(entry), *variant])
+    return '"' + hashlib.sha1(token.encode("utf-8")).hexdigest()[:24] + '"'
+
+
+def not_modified(etag: str):
+    """304 response for a matching If-None-Match"""
+    from fastapi.responses import Response
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": LABELMAP_CACHE_CONTROL})
+
+
+async def resolve_seg_series(series_uid: str) -> Dict[str, Any]:
+    """Series index entry of a SEG series (404 if Orthanc does not have it)"""
+    entry = await series_index.resolve(series_uid)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Segmentation not found")
+    return entry
+
+
+async def load_seg_labelmap(
+    series_uid: str,
+    entry: Optional[Dict[str, Any]] = None
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Decoded label map of a DICOM SEG series.
+    
+    Served from the in-memory or on-disk label map cache while the SEG is
+    unchanged in Orthanc; otherwise the SEG is downloaded, decoded once and
+    cached. The returned array may be shared and is read-only.
+    
+    Args:
+        series_uid: SeriesInstanceUID of the segmentation
+        entry: Its series index entry, if already resolved
+    
+    Returns:
+        (label map (z, y, x) uint8, geometry) as from seg_dataset_to_labelmap
+    
+    Raises:
+        HTTPException: 404 if the SEG is not in Orthanc, 400 if it has no
+            pixel data, 500 if it cannot be downloaded
+    """
+    import pydicom
+    from io import BytesIO
+    
+    if entry is None:
+        entry = await resolve_seg_series(series_uid)
+    version = series_version(entry)
+    
+    hot = hot_labelmap_cache.get(series_uid, version)
+    if hot is not None:
+        return hot
+    
+    cached = await asyncio.to_thread(labelmap_cache.get, series_uid, version)
+    if cached is not None:
+        labelmap, geometry = cached
+        logger.info(f"Labelmap cache hit for {series_uid}")
+        hot_labelmap_cache.put(series_uid, version, labelmap, geometry)
+        return labelmap, geometry
+    
+    client = get_orthanc_client()
+    orthanc_series_id = entry["orthanc_id"]
+    
+    # Get instances in this series
+    instances_resp = await client.get(f"/series/{orthanc_series_id}/instances")
+    if instances_resp.status_code != 200:
+        raise HTTPException(status_code=500, detail="Failed to get instances")
+    
+    instances = instances_resp.json()
+    if not instances:
+        raise HTTPException(status_code=404, detail="No instances in series")
+    
+    # Download the first (and usually only) DICOM file
+    instance_id = instances[0]["ID"]
+    dicom_resp = await client.get(f"/instances/{instance_id}/file")
+    
+    if dicom_resp.status_code != 200:
+        raise HTTPException(status_code=500, detail="Failed to download DICOM")
+    
+    def decode():
+        ds = pydicom.dcmread(BytesIO(dicom_resp.content))
+        if "PixelData" not in ds:
+            raise HTTPException(status_code=400, detail="No PixelData in DICOM SEG")
+        labelmap, geometry = seg_dataset_to_labelmap(ds)
+        geometry = {
+            "spacing": [float(v) for v in geometry["spacing"]],
+            "origin": [float(v) for v in geometry["origin"]]
+        }
+        labelmap_cache.put(series_uid, version, labelmap, geometry)
+        return labelmap, geometry
+    
+    labelmap, geometry = await asyncio.to_thread(decode)
+    hot_labelmap_cache.put(series_uid, version, labelmap, geometry)
+    logger.info(f"Decoded and cached labelmap {labelmap.shape} for {series_uid}")
+    return labelmap, geometry
+
+
+def labelmap_segments(labelmap: np.ndarray) -> list:
+    """Segment info (label, name, RGB color) of the labels present in a label map"""
+    present = np.flatnonzero(np.bincount(labelmap.ravel(), minlength=1))
+    segments = []
+    for label in present[present > 0].tolist():
+        info = SEGMENT_INFO.get(int(label), {"name": f"Segment {label}", "color": [128, 128, 128]})
+        segments.append({
+            "label": int(label),
+            "name": info["name"],
+            "color": info.get("color", [128, 128, 128])[:3]  # RGB only
+        })
+    return segments
+
+
 @router.get("/download-nifti/{series_uid}")
-async def download_segmentation_as_nifti(series_uid: str):
+async def download_segmentation_as_nifti(series_uid: str, if_none_match: Optional[str] = Header(None)):
     """
     Download segmentation as NIfTI file (converting from DICOM SEG)
     
     Args:
         series_uid: The SeriesInstanceUID of the segmentation
-        
+    
     Returns:
-        NIfTI file as binary download
+        NIfTI file as binary download (304 if If-None-Match matches its ETag)
     """
     from fastapi.responses import Response
     import tempfile
     
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            # Find the series in Orthanc
-            response = await client.post(
-                f"{ORTHANC_URL}/tools/find",
-                json={
-                    "Level": "Series",
-                    "Query": {"SeriesInstanceUID": series_uid},
-                    "Expand": False
-                }
-            )
-            
-            if response.status_code != 200 or not response.json():
-                raise HTTPException(status_code=404, detail="Segmentation not found")
-            
-            orthanc_series_id = response.json()[0]
-            
-            # Get instances
-            instances_resp = await client.get(f"{ORTHANC_URL}/series/{orthanc_series_id}/instances")
-            if instances_resp.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to get instances")
-            
-            instances = instances_resp.json()
-            if not instances:
-                raise HTTPException(status_code=404, detail="No instances in series")
-            
-            # Download the DICOM SEG file
-            instance_id = instances[0]["ID"]
-            dcm_resp = await client.get(f"{ORTHANC_URL}/instances/{instance_id}/file")
-            
-            if dcm_resp.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to download DICOM")
+        entry = await resolve_seg_series(series_uid)
+        etag = labelmap_etag(entry, "nifti")
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        # Label map (z, y, x), whichever SEG encoding was used
+        seg_array, geometry = await load_seg_labelmap(series_uid, entry)
+        cache_headers = {"ETag": etag, "Cache-Control": LABELMAP_CACHE_CONTROL}
+        
+        # Convert to NIfTI
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Try to use SimpleITK for proper NIfTI creation
+            try:
+                import SimpleITK as sitk
+                
+                # Create NIfTI from the segmentation array
+                sitk_image = sitk.GetImageFromArray(seg_array)
+                sitk_image.SetSpacing([float(v) for v in reversed(geometry["spacing"])])
+                sitk_image.SetOrigin([float(v) for v in geometry["origin"]])
+                
+                nifti_path = Path(tmpdir) / "segmentation.nii.gz"
+                sitk.WriteImage(sitk_image, str(nifti_path))
+                
+                with open(nifti_path, "rb") as f:
+                    nifti_content = f.read()
+                
+                return Response(
+                    content=nifti_content,
+                    media_type="application/gzip",
+                    headers={
+                        "Content-Disposition": f'attachment; filename="segmentation.nii.gz"',
+                        **cache_headers
+                    }
+                )
             
-            # Convert DICOM SEG to NIfTI
-            with tempfile.TemporaryDirectory() as tmpdir:
-                import pydicom
-                import numpy as np
+            except Exception as e:
+                logger.warning(f"SimpleITK conversion failed: {e}, returning raw numpy")
                 
-                dcm_path = Path(tmpdir) / "seg.dcm"
-                with open(dcm_path, "wb") as f:
-                    f.write(dcm_resp.content)
+                # Fallback: return as numpy .npz file
+                npz_path = Path(tmpdir) / "segmentation.npz"
+                np.savez_compressed(npz_path, segmentation=seg_array)
                 
-                ds = pydicom.dcmread(dcm_path)
+                with open(npz_path, "rb") as f:
+                    npz_content = f.read()
                 
-                # Extract pixel data from SEG
-                if hasattr(ds, 'PixelData'):
-                    pixel_array = ds.pixel_array
-                    
-                    # Try to use SimpleITK for proper NIfTI creation
-                    try:
-                        import SimpleITK as sitk
-                        
-                        # Create NIfTI from the segmentation array
-                        if len(pixel_array.shape) == 4:
-                            # Multi-segment: take argmax or first segment
-                            seg_array = np.argmax(pixel_array, axis=0).astype(np.uint8)
-                        elif len(pixel_array.shape) == 3:
-                            seg_array = pixel_array.astype(np.uint8)
-                        else:
-                            seg_array = pixel_array.astype(np.uint8)
-                        
-                        sitk_image = sitk.GetImageFromArray(seg_array)
-                        
-                        # Set spacing if available
-                        if hasattr(ds, 'PixelSpacing'):
-                            spacing = list(ds.PixelSpacing) + [float(ds.SliceThickness) if hasattr(ds, 'SliceThickness') else 1.0]
-                            sitk_image.SetSpacing(spacing)
-                        
-                        nifti_path = Path(tmpdir) / "segmentation.nii.gz"
-                        sitk.WriteImage(sitk_image, str(nifti_path))
-                        
-                        with open(nifti_path, "rb") as f:
-                            nifti_content = f.read()
-                        
-                        return Response(
-                            content=nifti_content,
-                            media_type="application/gzip",
-                            headers={
-                                "Content-Disposition": f'attachment; filename="segmentation.nii.gz"'
-                            }
-                        )
-                        
-                    except Exception as e:
-                        logger.warning(f"SimpleITK conversion failed: {e}, returning raw numpy")
-                        
-                        # Fallback: return as numpy .npz file
-                        npz_path = Path(tmpdir) / "segmentation.npz"
-                        np.savez_compressed(npz_path, segmentation=pixel_array)
-                        
-                        with open(npz_path, "rb") as f:
-                            npz_content = f.read()
-                        
-                        return Response(
-                            content=npz_content,
-                            media_type="application/octet-stream",
-                            headers={
-                                "Content-Disposition": f'attachment; filename="segmentation.npz"'
-                            }
-                        )
-                else:
-                    raise HTTPException(status_code=400, detail="No PixelData in DICOM SEG")
-                    
+                return Response(
+                    content=npz_content,
+                    media_type="application/octet-stream",
+                    headers={
+                        "Content-Disposition": f'attachment; filename="segmentation.npz"',
+                        **cache_headers
+                    }
+                )
+    
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Orthanc error: {str(e)}")
 
 
 @router.get("/get-labelmap/{series_uid}")
-async def get_labelmap_data(series_uid: str):
+async def get_labelmap_data(series_uid: str, response: Response, if_none_match: Optional[str] = Header(None)):
     """
     Get raw labelmap data for direct Cornerstone integration.
     
@@ -1268,117 +1562,47 @@ async def get_labelmap_data(series_uid: str):
     - spacing: [x, y, z] pixel spacing
     
     This allows the frontend to directly create a labelmap in Cornerstone
-    without needing to parse DICOM SEG format.
+    without needing to parse DICOM SEG format. For large volumes prefer
+    /get-labelmap/{series_uid}/header and /binary, which avoid base64.
+    Responses carry an ETag; a matching If-None-Match gets a 304.
     """
     import base64
-    import tempfile
-    from pathlib import Path
     
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            # Find the SEG series in Orthanc
-            response = await client.post(
-                f"{ORTHANC_URL}/tools/find",
-                json={
-                    "Level": "Series",
-                    "Query": {"SeriesInstanceUID": series_uid},
-                    "Expand": False
-                }
-            )
-            
-            if response.status_code != 200 or not response.json():
-                raise HTTPException(status_code=404, detail="Segmentation not found")
-            
-            orthanc_series_id = response.json()[0]
-            
-            # Get instances in this series
-            instances_resp = await client.get(f"{ORTHANC_URL}/series/{orthanc_series_id}/instances")
-            if instances_resp.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to get instances")
-            
-            instances = instances_resp.json()
-            if not instances:
-                raise HTTPException(status_code=404, detail="No instances in series")
-            
-            # Download the first (and usually only) DICOM file
-            instance_id = instances[0]["ID"]
-            dicom_resp = await client.get(f"{ORTHANC_URL}/instances/{instance_id}/file")
-            
-            if dicom_resp.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to download DICOM")
-            
-            # Parse DICOM and extract pixel data
-            with tempfile.NamedTemporaryFile(suffix=".dcm", delete=False) as tmp:
-                tmp.write(dicom_resp.content)
-                tmp_path = tmp.name
+        entry = await resolve_seg_series(series_uid)
+        etag = labelmap_etag(entry, "json")
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        pixel_array, geometry = await load_seg_labelmap(series_uid, entry)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = LABELMAP_CACHE_CONTROL
+        
+        logger.info(f"Labelmap pixel array shape: {pixel_array.shape}")
+        
+        # Extract dimensions
+        depth, height, width = pixel_array.shape
+        
+        # Spacing: [PixelSpacing row, PixelSpacing column, slice]
+        slice_spacing, row_spacing, col_spacing = geometry["spacing"]
+        spacing = [float(row_spacing), float(col_spacing), float(slice_spacing)]
+        
+        # Encode frames as base64
+        frames = []
+        for i in range(depth):
+            frame_data = pixel_array[i].tobytes()
+            frames.append(base64.b64encode(frame_data).decode('ascii'))
+        
+        return {
+            "success": True,
+            "dimensions": [width, height, depth],
+            "spacing": spacing,
+            "segments": labelmap_segments(pixel_array),
+            "frames": frames,  # Array of base64-encoded frame data
+            "dtype": "uint8",
+            "totalVoxels": width * height * depth
+        }
             
-            try:
-                import pydicom
-                import numpy as np
-                
-                ds = pydicom.dcmread(tmp_path)
-                pixel_array = ds.pixel_array
-                
-                logger.info(f"Labelmap pixel array shape: {pixel_array.shape}")
-                
-                # Handle different array shapes
-                if pixel_array.ndim == 2:
-                    # Single frame - add depth dimension
-                    pixel_array = pixel_array[np.newaxis, :, :]
-                elif pixel_array.ndim == 4:
-                    # Multi-segment format (segments, frames, rows, cols)
-                    # Convert to single labelmap by taking argmax or combining
-                    pixel_array = np.argmax(pixel_array, axis=0).astype(np.uint8)
-                
-                # Ensure uint8
-                pixel_array = pixel_array.astype(np.uint8)
-                
-                # Extract dimensions
-                depth, height, width = pixel_array.shape
-                
-                # Get spacing
-                spacing = [1.0, 1.0, 1.0]
-                if hasattr(ds, 'PixelSpacing'):
-                    spacing[0] = float(ds.PixelSpacing[0])
-                    spacing[1] = float(ds.PixelSpacing[1])
-                if hasattr(ds, 'SliceThickness'):
-                    spacing[2] = float(ds.SliceThickness)
-                elif hasattr(ds, 'SpacingBetweenSlices'):
-                    spacing[2] = float(ds.SpacingBetweenSlices)
-                
-                # Encode frames as base64
-                frames = []
-                for i in range(depth):
-                    frame_data = pixel_array[i].tobytes()
-                    frames.append(base64.b64encode(frame_data).decode('ascii'))
-                
-                # Get unique labels
-                unique_labels = np.unique(pixel_array)
-                unique_labels = unique_labels[unique_labels > 0].tolist()
-                
-                # Build segment info
-                segments = []
-                for label in unique_labels:
-                    info = SEGMENT_INFO.get(int(label), {"name": f"Segment {label}", "color": [128, 128, 128]})
-                    segments.append({
-                        "label": int(label),
-                        "name": info["name"],
-                        "color": info.get("color", [128, 128, 128])[:3]  # RGB only
-                    })
-                
-                return {
-                    "success": True,
-                    "dimensions": [width, height, depth],
-                    "spacing": spacing,
-                    "segments": segments,
-                    "frames": frames,  # Array of base64-encoded frame data
-                    "dtype": "uint8",
-                    "totalVoxels": width * height * depth
-                }
-                
-            finally:
-                Path(tmp_path).unlink(missing_ok=True)
-                
     except HTTPException:
         raise
     except Exception as e:
@@ -1388,237 +1612,371 @@ async def get_labelmap_data(series_uid: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/get-labelmap/{series_uid}/header")
+async def get_labelmap_header(series_uid: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    """
+    Metadata for the binary labelmap endpoint.
+    
+    Returns dimensions [width, height, depth], spacing, origin, segments, the
+    decoding contract of each voxel encoding and the compressions the server
+    offers (see services.labelmap_transport).
+    """
+    try:
+        entry = await resolve_seg_series(series_uid)
+        etag = labelmap_etag(entry, "header")
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        labelmap, geometry = await load_seg_labelmap(series_uid, entry)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = LABELMAP_CACHE_CONTROL
+        return labelmap_header(labelmap, geometry, labelmap_segments(labelmap))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting labelmap header: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/get-labelmap/{series_uid}/binary")
+async def get_labelmap_binary(
+    series_uid: str,
+    encoding: str = "raw",
+    compression: Optional[str] = None,
+    slices: Optional[str] = None,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Stream the labelmap voxels.
+    
+    Args:
+        series_uid: SeriesInstanceUID of the segmentation
+        encoding: "raw" (uint8 voxels, frame after frame), "rle" (per-frame
+            run-length) or "bbox" (bit masks of each segment's bounding box);
+            the contracts are listed in the /header response
+        compression: "gzip", "zstd" or "none"; negotiated from
+            Accept-Encoding when omitted. Sent as Content-Encoding.
+        slices: Optional "start:end" frame range (a slab of the volume)
+        
+    Raw, uncompressed responses honour a single byte Range (206 Partial
+    Content), relative to the selected frames. X-Labelmap-Encoding and
+    X-Labelmap-Slices report what was sent. Each representation has its own
+    ETag; a matching If-None-Match gets a 304.
+    """
+    from fastapi.responses import StreamingResponse
+    
+    if encoding not in LABELMAP_ENCODINGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown encoding '{encoding}', expected one of: {', '.join(LABELMAP_ENCODINGS)}"
+        )
+    
+    # Byte ranges address the raw, uncompressed stream
+    ranged = bool(range_header) and encoding == "raw"
+    try:
+        content_encoding = IDENTITY if ranged else negotiate_compression(compression, accept_encoding)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        entry = await resolve_seg_series(series_uid)
+        etag = labelmap_etag(entry, "binary", encoding, content_encoding, slices or "")
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        labelmap, geometry = await load_seg_labelmap(series_uid, entry)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting labelmap: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    try:
+        start, end = parse_slices(slices, labelmap.shape[0])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    slab = labelmap[start:end]
+    depth, height, width = slab.shape
+    headers = {
+        "ETag": etag,
+        "Cache-Control": LABELMAP_CACHE_CONTROL,
+        "Accept-Ranges": "bytes" if encoding == "raw" else "none",
+        "Vary": "Accept-Encoding",
+        "X-Labelmap-Dimensions": f"{width},{height},{labelmap.shape[0]}",
+        "X-Labelmap-Encoding": encoding,
+        "X-Labelmap-Slices": f"{start}:{end}",
+    }
+    
+    if content_encoding != IDENTITY or encoding != "raw":
+        if content_encoding != IDENTITY:
+            headers["Content-Encoding"] = content_encoding
+        return StreamingResponse(
+            iter_compressed(iter_encoded(slab, encoding), content_encoding),
+            media_type="application/octet-stream",
+            headers=headers
+        )
+    
+    size = slab.nbytes
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError as e:
+        raise HTTPException(status_code=416, detail=str(e), headers={"Content-Range": f"bytes */{size}"})
+    
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_bytes(slab), media_type="application/octet-stream", headers=headers)
+    
+    first, last = byte_range
+    headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    headers["Content-Length"] = str(last - first + 1)
+    return StreamingResponse(
+        iter_bytes(slab, first, last + 1),
+        status_code=206,
+        media_type="application/octet-stream",
+        headers=headers
+    )
+
+
+def mesh_ratios(
+    faces: Optional[int],
+    ratio: Optional[float],
+    lods: Optional[str],
+    smoothing: str,
+    iterations: int
+) -> List[float]:
+    """Validate mesh export parameters (400 on bad input) and return the detail levels"""
+    if smoothing not in SMOOTHING_METHODS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown smoothing '{smoothing}', expected one of: {', '.join(SMOOTHING_METHODS)}"
+        )
+    if faces is not None and faces < 4:
+        raise HTTPException(status_code=400, detail="faces must be at least 4")
+    if not 0 <= iterations <= MAX_SMOOTHING_ITERATIONS:
+        raise HTTPException(status_code=400, detail=f"iterations must be between 0 and {MAX_SMOOTHING_ITERATIONS}")
+    if ratio is not None and lods:
+        raise HTTPException(status_code=400, detail="Use either ratio or lods")
+    try:
+        return parse_lods(lods if lods else (str(ratio) if ratio is not None else None))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def cached_mesh_export(
+    series_uid: str,
+    entry: Dict[str, Any],
+    variant: Tuple[str, ...],
+    build: Callable[[], Awaitable[bytes]]
+) -> bytes:
+    """
+    Exported mesh file for a SEG series and set of mesh parameters.
+
+    Served from the mesh cache while the SEG is unchanged in Orthanc; otherwise
+    built by `build` and cached.
+    """
+    key = "|".join([series_uid, *variant])
+    version = series_version(entry)
+
+    cached = await asyncio.to_thread(mesh_cache.get, key, version)
+    if cached is not None:
+        logger.info(f"Mesh cache hit for {key}")
+        return cached[0].tobytes()
+
+    content = await build()
+    await asyncio.to_thread(mesh_cache.put, key, version, np.frombuffer(content, dtype=np.uint8), {})
+    return content
+
+
+async def mesh_segments(
+    series_uid: str,
+    entry: Dict[str, Any],
+    **options
+) -> Tuple[List[Tuple[int, List[Tuple[np.ndarray, np.ndarray]]]], Dict[str, Any]]:
+    """Meshes of all segments of a SEG series (see mesh_labelmap) and its geometry"""
+    # Label map (z, y, x), whichever SEG encoding was used
+    seg_array, geometry = await load_seg_labelmap(series_uid, entry)
+    
+    # Spacing per array axis (z, y, x), as marching cubes expects
+    spacing = [float(v) for v in geometry["spacing"]]
+    logger.info(f"Segmentation array shape: {seg_array.shape}, spacing: {spacing}")
+    
+    if not seg_array.any():
+        raise HTTPException(status_code=400, detail="No segments found in segmentation")
+    
+    # Mesh all segments concurrently, each on its bounding-box crop
+    meshes = await mesh_labelmap(seg_array, spacing, **options)
+    if not meshes:
+        raise HTTPException(status_code=400, detail="Failed to generate any meshes")
+    return meshes, geometry
+
+
+def segment_file_name(label: int) -> str:
+    """SEGMENT_INFO name of a label, usable in file names"""
+    return SEGMENT_INFO.get(label, {"name": f"Segment_{label}"})["name"].replace(" ", "_")
+
+
 @router.get("/download-stl/{series_uid}")
-async def download_segmentation_as_stl(series_uid: str):
+async def download_segmentation_as_stl(
+    series_uid: str,
+    faces: Optional[int] = None,
+    ratio: Optional[float] = None,
+    lods: Optional[str] = None,
+    smoothing: str = "none",
+    iterations: int = 10,
+    if_none_match: Optional[str] = Header(None)
+):
     """
     Download segmentation as STL mesh files (one per segment)
     
-    Uses marching cubes algorithm to convert each segment label to a 3D mesh.
+    Uses marching cubes algorithm to convert each segment label to a 3D mesh;
+    segments are meshed in parallel worker processes (see services.mesh_export).
     Returns a ZIP file containing individual STL files for each anatomical structure.
+    Results are cached per SEG and parameters.
     
     Args:
         series_uid: The SeriesInstanceUID of the segmentation
+        faces: Triangle budget per segment; larger meshes are quadric-decimated
+        ratio: Fraction (0, 1] of the triangles to keep
+        lods: Comma-separated fractions, e.g. "1,0.25,0.05", for several levels
+            of detail per segment ("<segment>_lod<i>.stl"); replaces ratio
+        smoothing: "none", "laplacian" or "taubin" (applied before decimation)
+        iterations: Smoothing passes
         
     Returns:
-        ZIP file containing STL files for each segment
+        ZIP file containing STL files for each segment (304 if If-None-Match matches its ETag)
     """
     from fastapi.responses import Response
-    import tempfile
     import zipfile
     
+    ratios = mesh_ratios(faces, ratio, lods, smoothing, iterations)
+    variant = ("stl", MESH_FORMAT_VERSION, str(faces), ",".join(map(str, ratios)), smoothing, str(iterations))
+    
+    async def build() -> bytes:
+        meshes, _ = await mesh_segments(
+            series_uid, entry,
+            smoothing=smoothing, iterations=iterations, max_faces=faces, ratios=ratios
+        )
+        
+        def write_zip() -> bytes:
+            buffer = BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+                for label, levels in meshes:
+                    segment_name = segment_file_name(label)
+                    for lod, (verts, lod_faces) in enumerate(levels):
+                        # Binary STL, written straight from verts[faces]
+                        stl_filename = f"{segment_name}_lod{lod}.stl" if len(levels) > 1 else f"{segment_name}.stl"
+                        with zf.open(stl_filename, "w") as f:
+                            write_binary_stl(f, verts, lod_faces, segment_name)
+                        logger.info(f"Saved STL: {stl_filename} ({len(lod_faces)} faces)")
+            return buffer.getvalue()
+        
+        return await asyncio.to_thread(write_zip)
+    
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            # Find the series in Orthanc
-            response = await client.post(
-                f"{ORTHANC_URL}/tools/find",
-                json={
-                    "Level": "Series",
-                    "Query": {"SeriesInstanceUID": series_uid},
-                    "Expand": False
-                }
-            )
-            
-            if response.status_code != 200 or not response.json():
-                raise HTTPException(status_code=404, detail="Segmentation not found")
-            
-            orthanc_series_id = response.json()[0]
-            
-            # Get instances
-            instances_resp = await client.get(f"{ORTHANC_URL}/series/{orthanc_series_id}/instances")
-            if instances_resp.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to get instances")
-            
-            instances = instances_resp.json()
-            if not instances:
-                raise HTTPException(status_code=404, detail="No instances in series")
-            
-            # Download the DICOM SEG file
-            instance_id = instances[0]["ID"]
-            dcm_resp = await client.get(f"{ORTHANC_URL}/instances/{instance_id}/file")
-            
-            if dcm_resp.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to download DICOM")
-            
-            # Convert DICOM SEG to STL meshes
-            with tempfile.TemporaryDirectory() as tmpdir:
-                import pydicom
-                import numpy as np
-                
-                dcm_path = Path(tmpdir) / "seg.dcm"
-                with open(dcm_path, "wb") as f:
-                    f.write(dcm_resp.content)
-                
-                ds = pydicom.dcmread(dcm_path)
-                
-                if not hasattr(ds, 'PixelData'):
-                    raise HTTPException(status_code=400, detail="No PixelData in DICOM SEG")
-                
-                pixel_array = ds.pixel_array
-                
-                # Handle different array shapes
-                if len(pixel_array.shape) == 4:
-                    # Multi-segment format: take argmax to get label map
-                    seg_array = np.argmax(pixel_array, axis=0).astype(np.uint8)
-                elif len(pixel_array.shape) == 3:
-                    seg_array = pixel_array.astype(np.uint8)
-                else:
-                    seg_array = pixel_array.astype(np.uint8)
-                
-                # Get spacing from DICOM
-                spacing = [1.0, 1.0, 1.0]  # Default spacing
-                if hasattr(ds, 'PixelSpacing'):
-                    spacing[0:2] = list(ds.PixelSpacing)
-                if hasattr(ds, 'SliceThickness'):
-                    spacing[2] = float(ds.SliceThickness)
-                elif hasattr(ds, 'SpacingBetweenSlices'):
-                    spacing[2] = float(ds.SpacingBetweenSlices)
-                
-                logger.info(f"Segmentation array shape: {seg_array.shape}, spacing: {spacing}")
-                
-                # Generate STL for each segment using marching cubes
-                # Try multiple libraries for compatibility
-                marching_cubes_func = None
-                stl_mesh = None
-                
-                try:
-                    from stl import mesh as stl_mesh
-                except ImportError:
-                    logger.error("numpy-stl not installed")
-                    raise HTTPException(
-                        status_code=500, 
-                        detail="STL generation requires numpy-stl. Install with: pip install numpy-stl"
-                    )
-                
-                # Try scipy first (usually available), then skimage as fallback
-                try:
-                    from scipy.ndimage import binary_erosion, generate_binary_structure
-                    # Use a simple surface extraction approach with scipy
-                    def marching_cubes_scipy(volume, level=0.5, spacing=(1.0, 1.0, 1.0)):
-                        """Simple surface mesh generation using scipy"""
-                        from scipy.spatial import Delaunay
-                        
-                        # Find surface voxels (voxels that are different from their neighbors)
-                        struct = generate_binary_structure(3, 1)
-                        eroded = binary_erosion(volume, struct)
-                        surface = volume.astype(bool) & ~eroded
-                        
-                        # Get surface voxel coordinates
-                        coords = np.argwhere(surface)
-                        if len(coords) < 4:
-                            return np.array([]), np.array([]), None, None
-                        
-                        # Scale by spacing
-                        coords = coords.astype(float)
-                        coords[:, 0] *= spacing[0]
-                        coords[:, 1] *= spacing[1]
-                        coords[:, 2] *= spacing[2]
-                        
-                        # Create simple triangulated surface using convex hull
-                        from scipy.spatial import ConvexHull
-                        try:
-                            hull = ConvexHull(coords)
-                            verts = coords
-                            faces = hull.simplices
-                            return verts, faces, None, None
-                        except Exception:
-                            return np.array([]), np.array([]), None, None
-                    
-                    marching_cubes_func = marching_cubes_scipy
-                    logger.info("Using scipy-based surface extraction")
-                except ImportError:
-                    pass
-                
-                # Try skimage if scipy method didn't work
-                if marching_cubes_func is None:
-                    try:
-                        from skimage import measure
-                        marching_cubes_func = lambda vol, level, spacing: measure.marching_cubes(vol, level=level, spacing=spacing)
-                        logger.info("Using skimage marching_cubes")
-                    except ImportError:
-                        pass
-                
-                if marching_cubes_func is None:
-                    raise HTTPException(
-                        status_code=500, 
-                        detail="No mesh generation library available. Install scipy or scikit-image."
-                    )
-                
-                unique_labels = np.unique(seg_array)
-                unique_labels = unique_labels[unique_labels > 0]  # Skip background
-                
-                if len(unique_labels) == 0:
-                    raise HTTPException(status_code=400, detail="No segments found in segmentation")
-                
-                stl_files = []
-                
-                for label in unique_labels:
-                    label_int = int(label)
-                    info = SEGMENT_INFO.get(label_int, {"name": f"Segment_{label_int}"})
-                    segment_name = info["name"].replace(" ", "_")
-                    
-                    logger.info(f"Generating STL for segment {label_int}: {segment_name}")
-                    
-                    # Create binary mask for this segment
-                    binary_mask = (seg_array == label).astype(np.uint8)
-                    
-                    # Check if mask has enough voxels
-                    if np.sum(binary_mask) < 10:
-                        logger.warning(f"Segment {label_int} has too few voxels, skipping")
-                        continue
-                    
-                    try:
-                        # Apply marching cubes to generate mesh
-                        result = marching_cubes_func(binary_mask, level=0.5, spacing=tuple(spacing))
-                        verts = result[0]
-                        faces = result[1]
-                        
-                        logger.info(f"Generated mesh with {len(verts)} vertices and {len(faces)} faces")
-                        
-                        if len(faces) == 0:
-                            logger.warning(f"No faces generated for segment {label_int}, skipping")
-                            continue
-                        
-                        # Create STL mesh
-                        stl_data = stl_mesh.Mesh(np.zeros(faces.shape[0], dtype=stl_mesh.Mesh.dtype))
-                        
-                        for i, face in enumerate(faces):
-                            for j in range(3):
-                                stl_data.vectors[i][j] = verts[face[j], :]
-                        
-                        # Save STL file
-                        stl_filename = f"{segment_name}.stl"
-                        stl_path = Path(tmpdir) / stl_filename
-                        stl_data.save(str(stl_path))
-                        stl_files.append((stl_filename, stl_path))
-                        
-                        logger.info(f"Saved STL: {stl_filename}")
-                        
-                    except Exception as mesh_error:
-                        logger.warning(f"Failed to generate mesh for segment {label_int}: {mesh_error}")
-                        continue
-                
-                if not stl_files:
-                    raise HTTPException(status_code=400, detail="Failed to generate any STL meshes")
-                
-                # Create ZIP archive with all STL files
-                zip_path = Path(tmpdir) / "segmentation_stl.zip"
-                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-                    for filename, filepath in stl_files:
-                        zf.write(filepath, filename)
-                
-                # Read ZIP and return
-                with open(zip_path, "rb") as f:
-                    zip_content = f.read()
+        entry = await resolve_seg_series(series_uid)
+        etag = labelmap_etag(entry, *variant)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        zip_content = await cached_mesh_export(series_uid, entry, variant, build)
+        
+        return Response(
+            content=zip_content,
+            media_type="application/zip",
+            headers={
+                "Content-Disposition": f'attachment; filename="dental_segmentation_stl.zip"',
+                "ETag": etag,
+                "Cache-Control": LABELMAP_CACHE_CONTROL
+            }
+        )
                 
-                return Response(
-                    content=zip_content,
-                    media_type="application/zip",
-                    headers={
-                        "Content-Disposition": f'attachment; filename="dental_segmentation_stl.zip"'
-                    }
-                )
-                    
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Orthanc error: {str(e)}")
 
 
+@router.get("/download-glb/{series_uid}")
+async def download_segmentation_as_glb(
+    series_uid: str,
+    faces: Optional[int] = None,
+    ratio: Optional[float] = None,
+    smoothing: str = "none",
+    iterations: int = 10,
+    compression: Optional[str] = None,
+    accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Download all segments as one binary glTF (GLB) model
+    
+    Segments are meshed as for /download-stl and written to a single indexed
+    GLB with shared vertex buffers, quantized positions and normals
+    (KHR_mesh_quantization) and one node and material per segment, coloured
+    from SEGMENT_INFO. Coordinates are x, y, z in mm from the label map origin
+    (patient coordinates for axial series). Results are cached per SEG and
+    parameters.
+    
+    Args:
+        series_uid: The SeriesInstanceUID of the segmentation
+        faces: Triangle budget per segment; larger meshes are quadric-decimated
+        ratio: Fraction (0, 1] of the triangles to keep
+        smoothing: "none", "laplacian" or "taubin" (applied before decimation)
+        iterations: Smoothing passes
+        compression: "gzip", "zstd" or "none"; negotiated from Accept-Encoding
+            when omitted. Sent as Content-Encoding.
+        
+    Returns:
+        model/gltf-binary file (304 if If-None-Match matches its ETag)
+    """
+    from fastapi.responses import Response
+    
+    ratios = mesh_ratios(faces, ratio, None, smoothing, iterations)
+    try:
+        content_encoding = negotiate_compression(compression, accept_encoding)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    variant = ("glb", MESH_FORMAT_VERSION, str(faces), ",".join(map(str, ratios)), smoothing, str(iterations), content_encoding)
+    
+    async def build() -> bytes:
+        meshes, geometry = await mesh_segments(
+            series_uid, entry,
+            smoothing=smoothing, iterations=iterations, max_faces=faces, ratios=ratios
+        )
+        
+        def write_model() -> bytes:
+            segments = []
+            for label, levels in meshes:
+                verts, mesh_faces = levels[0]
+                info = SEGMENT_INFO.get(label, {"name": f"Segment {label}", "color": [200, 200, 200, 255]})
+                segments.append((info["name"], info["color"], *mesh_to_xyz(verts, mesh_faces)))
+            buffer = BytesIO()
+            write_glb(buffer, segments, translation=geometry["origin"])
+            return b"".join(iter_compressed(iter([buffer.getvalue()]), content_encoding))
+        
+        return await asyncio.to_thread(write_model)
+    
+    try:
+        entry = await resolve_seg_series(series_uid)
+        etag = labelmap_etag(entry, *variant)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        
+        glb_content = await cached_mesh_export(series_uid, entry, variant, build)
+        
+        headers = {
+            "Content-Disposition": f'attachment; filename="dental_segmentation.glb"',
+            "ETag": etag,
+            "Cache-Control": LABELMAP_CACHE_CONTROL,
+            "Vary": "Accept-Encoding"
+        }
+        if content_encoding != IDENTITY:
+            headers["Content-Encoding"] = content_encoding
+        return Response(content=glb_content, media_type="model/gltf-binary", headers=headers)
+    
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=500, detail=f"Orthanc error: {str(e)}")
+
+
+
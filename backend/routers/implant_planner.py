@@ -20,6 +20,8 @@ import math
 from pathlib import Path
 from typing import Optional, Dict, Any, List, Tuple
 import asyncio
+from services.http_clients import ORTHANC_URL
+from services.job_store import job_store
 
 router = APIRouter()
 
@@ -28,9 +30,6 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-# Configuration
-ORTHANC_URL = os.getenv("ORTHANC_URL", "http://127.0.0.1:8042")
-
 # Default safety margin from nerve (mm)
 DEFAULT_SAFETY_MARGIN = 2.0
 
@@ -59,8 +58,8 @@ IMPLANT_LIBRARY = {
     },
 }
 
-# Job tracking
-planning_jobs: Dict[str, Dict[str, Any]] = {}
+# Job tracking (shared between workers, see services.job_store)
+planning_jobs = job_store.table("implant-planning")
 
 
 class ImplantPosition(BaseModel):
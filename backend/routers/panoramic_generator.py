@@ -10,28 +10,31 @@ Endpoints:
 - POST /generate: Generate panoramic image along detected arch
 - GET /status/{job_id}: Check job status
 """
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Header
 from pydantic import BaseModel
 from typing import Optional, List, Tuple
-import httpx
 import os
 import logging
 import uuid
+import asyncio
 import numpy as np
 from pathlib import Path
 import base64
 from io import BytesIO
+from services.http_clients import get_orthanc_client, ORTHANC_URL
+from services.orthanc_fetch import fetch_series
+from services.series_index import series_index
+from services.volume_cache import volume_cache, hot_volume_cache, series_version
+from services.job_store import job_store
+from services.job_events import wait_for_job, job_event_response
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Orthanc configuration
-ORTHANC_URL = os.getenv("ORTHANC_URL", "http://localhost:8042")
-ORTHANC_USER = os.getenv("ORTHANC_USER", "orthanc")
-ORTHANC_PASS = os.getenv("ORTHANC_PASS", "orthanc")
-
-# Job storage (in production, use Redis or database)
-jobs = {}
+# Job storage (shared between workers, see services.job_store)
+jobs = job_store.table("panoramic")
+# Merged into jobs that will never finish because their server process stopped or died
+ABANDONED_JOB_FIELDS = {"progress": 0, "message": "The server stopped before the job finished", "result": None}
 
 # ==================== Request/Response Models ====================
 
@@ -82,42 +85,32 @@ async def fetch_series_instances(series_uid: str) -> List[dict]:
     Returns:
         List of instance metadata
     """
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        # Find series by UID
-        response = await client.post(
-            f"{ORTHANC_URL}/tools/find",
-            json={
-                "Level": "Series",
-                "Query": {"SeriesInstanceUID": series_uid}
-            },
-            auth=(ORTHANC_USER, ORTHANC_PASS)
-        )
-        
-        if response.status_code != 200 or not response.json():
-            raise HTTPException(status_code=404, detail=f"Series not found: {series_uid}")
-        
-        orthanc_id = response.json()[0]
-        
-        # Get instances for this series
-        response = await client.get(
-            f"{ORTHANC_URL}/series/{orthanc_id}/instances",
-            auth=(ORTHANC_USER, ORTHANC_PASS)
-        )
+    client = get_orthanc_client()
+    
+    # Find series by UID
+    entry = await series_index.resolve(series_uid)
+    if not entry:
+        raise HTTPException(status_code=404, detail=f"Series not found: {series_uid}")
+    
+    orthanc_id = entry["orthanc_id"]
+    
+    # Get instances for this series
+    response = await client.get(f"/series/{orthanc_id}/instances")
+    
+    if response.status_code != 200:
+        raise HTTPException(status_code=500, detail="Failed to fetch instances")
         
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to fetch instances")
-            
-        return response.json()
+    return response.json()
 
-async def load_cbct_volume(series_uid: str) -> Tuple[np.ndarray, dict]:
+async def read_cbct_stack(series_uid: str) -> Tuple[np.ndarray, dict]:
     """
-    Load CBCT volume from Orthanc
+    Download and decode a CBCT series from Orthanc
     
     Args:
         series_uid: DICOM Series Instance UID
         
     Returns:
-        Tuple of (3D numpy array, metadata dict)
+        (slice stack of shape (slices, rows, cols) in native dtype, metadata dict)
     """
     try:
         import pydicom
@@ -135,19 +128,25 @@ async def load_cbct_volume(series_uid: str) -> Tuple[np.ndarray, dict]:
     
     logger.info(f"Loading {len(instances)} DICOM instances")
     
-    slices = []
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        for inst in instances:
-            inst_id = inst.get("ID")
-            response = await client.get(
-                f"{ORTHANC_URL}/instances/{inst_id}/file",
-                auth=(ORTHANC_USER, ORTHANC_PASS)
-            )
-            
-            if response.status_code == 200:
-                ds = pydicom.dcmread(BytesIO(response.content))
-                if hasattr(ds, 'SliceLocation') and hasattr(ds, 'pixel_array'):
-                    slices.append(ds)
+    # Decode instances as they stream in (keyed by index, see fetch_series)
+    datasets = {}
+    
+    def decode_instance(index: int, data: bytes):
+        try:
+            ds = pydicom.dcmread(BytesIO(data))
+        except Exception as e:
+            logger.warning(f"Could not parse DICOM instance {index}: {e}")
+            return
+        if hasattr(ds, 'SliceLocation') and hasattr(ds, 'PixelData'):
+            datasets[index] = ds
+    
+    await fetch_series(
+        instances[0]["ParentSeries"],
+        [inst["ID"] for inst in instances],
+        decode_instance,
+        on_reset=datasets.clear
+    )
+    slices = list(datasets.values())
     
     if not slices:
         raise HTTPException(status_code=500, detail="No valid slices found")
@@ -165,12 +164,46 @@ async def load_cbct_volume(series_uid: str) -> Tuple[np.ndarray, dict]:
         'num_slices': len(slices),
         'rows': int(slices[0].Rows),
         'cols': int(slices[0].Columns),
+        'slice_locations': [float(s.SliceLocation) for s in slices],
     }
     
+    stack = np.stack([s.pixel_array for s in slices], axis=0)
+    return stack, metadata
+
+
+async def load_cbct_volume(series_uid: str) -> Tuple[np.ndarray, dict]:
+    """
+    Load CBCT volume, from the in-memory or on-disk volume cache when the series is unchanged
+    
+    The returned volume may be shared with other jobs and is read-only.
+    
+    Args:
+        series_uid: DICOM Series Instance UID
+        
+    Returns:
+        Tuple of (3D numpy array (rows, cols, slices), metadata dict)
+    """
+    entry = await series_index.resolve(series_uid)
+    if not entry:
+        raise HTTPException(status_code=404, detail=f"Series not found: {series_uid}")
+    version = series_version(entry)
+    
+    hot = hot_volume_cache.get(series_uid, version)
+    if hot is not None:
+        logger.info(f"Hot volume cache hit for {series_uid}")
+        return hot
+    
+    cached = volume_cache.get(series_uid, version)
+    if cached is not None:
+        stack, metadata = cached
+        logger.info(f"Volume cache hit for {series_uid}")
+    else:
+        stack, metadata = await read_cbct_stack(series_uid)
+        await asyncio.to_thread(volume_cache.put, series_uid, version, stack, metadata)
+    
     # Build 3D volume
-    volume = np.zeros((metadata['rows'], metadata['cols'], len(slices)), dtype=np.float32)
-    for i, s in enumerate(slices):
-        volume[:, :, i] = s.pixel_array.astype(np.float32)
+    volume = await asyncio.to_thread(lambda: np.transpose(stack, (1, 2, 0)).astype(np.float32))
+    hot_volume_cache.put(series_uid, version, volume, metadata)
     
     logger.info(f"Loaded volume: {volume.shape}")
     return volume, metadata
@@ -498,22 +531,19 @@ def image_to_base64(img: np.ndarray, normalize: bool = True) -> str:
 async def run_arch_detection_job(job_id: str, study_uid: str, series_uid: str):
     """Background task to run dental arch detection"""
     try:
-        jobs[job_id] = {"status": "running", "progress": 0, "message": "Loading volume..."}
+        jobs.update(job_id, status="running", progress=0, message="Loading volume...")
         
         # Load CBCT volume
         volume, metadata = await load_cbct_volume(series_uid)
-        jobs[job_id]["progress"] = 30
-        jobs[job_id]["message"] = "Finding optimal slice..."
+        jobs.update(job_id, progress=30, message="Finding optimal slice...")
         
         # Find optimal dental arch slice
         optimal_idx, slice_img = detect_dental_arch_slice(volume)
-        jobs[job_id]["progress"] = 50
-        jobs[job_id]["message"] = "Fitting dental arch curve..."
+        jobs.update(job_id, progress=50, message="Fitting dental arch curve...")
         
         # Fit polynomial arch curve
         arch_points, coeffs = fit_polynomial_arch(slice_img)
-        jobs[job_id]["progress"] = 80
-        jobs[job_id]["message"] = "Generating result..."
+        jobs.update(job_id, progress=80, message="Generating result...")
         
         # Calculate thickness based on volume size
         thickness_mm = metadata['slice_thickness'] * 25
@@ -528,21 +558,23 @@ async def run_arch_detection_job(job_id: str, study_uid: str, series_uid: str):
             thickness_mm=float(thickness_mm)
         )
         
-        jobs[job_id] = {
-            "status": "completed",
-            "progress": 100,
-            "message": "Arch detection completed",
-            "result": arch_curve.dict()
-        }
+        jobs.update(
+            job_id,
+            status="completed",
+            progress=100,
+            message="Arch detection completed",
+            result=arch_curve.dict()
+        )
         
     except Exception as e:
         logger.error(f"Arch detection job {job_id} failed: {e}")
-        jobs[job_id] = {
-            "status": "failed",
-            "progress": 0,
-            "message": str(e),
-            "result": None
-        }
+        jobs.update(
+            job_id,
+            status="failed",
+            progress=0,
+            message=str(e),
+            result=None
+        )
 
 async def run_panoramic_generation_job(
     job_id: str, 
@@ -552,24 +584,24 @@ async def run_panoramic_generation_job(
 ):
     """Background task to run panoramic generation"""
     try:
-        jobs[job_id] = {"status": "running", "progress": 0, "message": "Loading volume..."}
+        jobs.update(job_id, status="running", progress=0, message="Loading volume...")
         
         # Load CBCT volume
         volume, metadata = await load_cbct_volume(series_uid)
-        jobs[job_id]["progress"] = 20
+        jobs.update(job_id, progress=20)
         
         # Detect arch if not provided
         if arch_curve is None:
-            jobs[job_id]["message"] = "Detecting dental arch..."
+            jobs.update(job_id, message="Detecting dental arch...")
             optimal_idx, slice_img = detect_dental_arch_slice(volume)
             arch_points, coeffs = fit_polynomial_arch(slice_img)
-            jobs[job_id]["progress"] = 50
+            jobs.update(job_id, progress=50)
         else:
             arch_points = np.array(arch_curve.points)
             optimal_idx = arch_curve.optimal_slice_index
-            jobs[job_id]["progress"] = 40
+            jobs.update(job_id, progress=40)
         
-        jobs[job_id]["message"] = "Generating panoramic image..."
+        jobs.update(job_id, message="Generating panoramic image...")
         
         # Generate panoramic
         panoramic = generate_panoramic_image(
@@ -578,32 +610,34 @@ async def run_panoramic_generation_job(
             thickness=25,
             optimal_slice=optimal_idx
         )
-        jobs[job_id]["progress"] = 80
+        jobs.update(job_id, progress=80)
         
         # Convert to base64
         pan_b64 = image_to_base64(panoramic)
         
-        jobs[job_id] = {
-            "status": "completed",
-            "progress": 100,
-            "message": "Panoramic generation completed",
-            "result": {
+        jobs.update(
+            job_id,
+            status="completed",
+            progress=100,
+            message="Panoramic generation completed",
+            result={
                 "panoramic_image": pan_b64,
                 "dimensions": {
                     "width": panoramic.shape[1],
                     "height": panoramic.shape[0]
                 }
             }
-        }
+        )
         
     except Exception as e:
         logger.error(f"Panoramic generation job {job_id} failed: {e}")
-        jobs[job_id] = {
-            "status": "failed",
-            "progress": 0,
-            "message": str(e),
-            "result": None
-        }
+        jobs.update(
+            job_id,
+            status="failed",
+            progress=0,
+            message=str(e),
+            result=None
+        )
 
 # ==================== API Endpoints ====================
 
@@ -624,6 +658,7 @@ async def detect_arch(req: ArchDetectionRequest, background_tasks: BackgroundTas
     logger.info(f"Arch detection requested for series: {req.seriesInstanceUID}")
     
     job_id = str(uuid.uuid4())
+    jobs.create(job_id, status="queued", progress=0, message="Waiting to start...")
     
     # Start background job
     background_tasks.add_task(
@@ -656,6 +691,7 @@ async def generate_panoramic(req: PanoramicRequest, background_tasks: Background
     logger.info(f"Panoramic generation requested for series: {req.seriesInstanceUID}")
     
     job_id = str(uuid.uuid4())
+    jobs.create(job_id, status="queued", progress=0, message="Waiting to start...")
     
     # Start background job
     background_tasks.add_task(
@@ -673,20 +709,29 @@ async def generate_panoramic(req: PanoramicRequest, background_tasks: Background
     )
 
 @router.get("/status/{job_id}")
-async def get_job_status(job_id: str):
+async def get_job_status(job_id: str, since: Optional[int] = None, wait: float = 0):
     """
     Get status of an arch detection or panoramic generation job
     
     Args:
         job_id: The job ID returned from /detect-arch or /generate
+        since: Long-poll: the `version` of the last status the client saw
+        wait: Long-poll: seconds to wait for a newer version (capped)
         
     Returns:
         Current status, progress, and results if completed
     """
-    if job_id not in jobs:
-        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return await wait_for_job(jobs, job_id, since, wait)
+
+@router.get("/events/{job_id}")
+async def stream_job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Stream progress of an arch detection or panoramic generation job as Server-Sent Events
     
-    return jobs[job_id]
+    Emits a "progress" event (same body as /status) on every update and
+    closes once the job has completed or failed.
+    """
+    return job_event_response(jobs, job_id, lambda jid, job: job, last_event_id)
 
 @router.get("/health")
 async def health_check():
@@ -703,5 +748,7 @@ async def health_check():
             "orthanc": ORTHANC_URL,
             "scipy": True,
             "numpy": True
-        }
+        },
+        "volume_cache": volume_cache.stats(),
+        "hot_volume_cache": hot_volume_cache.stats()
     }
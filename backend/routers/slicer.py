@@ -7,6 +7,7 @@ from pydantic import BaseModel
 import httpx
 import os
 import logging
+from services.http_clients import get_slicer_client
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -48,14 +49,14 @@ async def trigger_segmentation(req: SlicerJobRequest):
     try:
         logger.info(f"Segmentation requested for series: {req.seriesInstanceUID}")
         
-        async with httpx.AsyncClient(timeout=600.0) as client:
-            response = await client.post(
-                f"{SLICER_URL}/segment",
-                json={
-                    "studyInstanceUID": req.studyInstanceUID,
-                    "seriesInstanceUID": req.seriesInstanceUID
-                }
-            )
+        client = get_slicer_client()
+        response = await client.post(
+            f"{SLICER_URL}/segment",
+            json={
+                "studyInstanceUID": req.studyInstanceUID,
+                "seriesInstanceUID": req.seriesInstanceUID
+            }
+        )
         
         if response.status_code != 200:
             error_detail = response.text
@@ -107,14 +108,14 @@ async def generate_3d_model(req: SlicerJobRequest):
     try:
         logger.info(f"3D model generation requested for series: {req.seriesInstanceUID}")
         
-        async with httpx.AsyncClient(timeout=600.0) as client:
-            response = await client.post(
-                f"{SLICER_URL}/model",
-                json={
-                    "studyInstanceUID": req.studyInstanceUID,
-                    "seriesInstanceUID": req.seriesInstanceUID
-                }
-            )
+        client = get_slicer_client()
+        response = await client.post(
+            f"{SLICER_URL}/model",
+            json={
+                "studyInstanceUID": req.studyInstanceUID,
+                "seriesInstanceUID": req.seriesInstanceUID
+            }
+        )
         
         if response.status_code != 200:
             error_detail = response.text
@@ -166,14 +167,14 @@ async def generate_panoramic(req: SlicerJobRequest):
     try:
         logger.info(f"Panoramic reconstruction requested for series: {req.seriesInstanceUID}")
         
-        async with httpx.AsyncClient(timeout=600.0) as client:
-            response = await client.post(
-                f"{SLICER_URL}/panoramic",
-                json={
-                    "studyInstanceUID": req.studyInstanceUID,
-                    "seriesInstanceUID": req.seriesInstanceUID
-                }
-            )
+        client = get_slicer_client()
+        response = await client.post(
+            f"{SLICER_URL}/panoramic",
+            json={
+                "studyInstanceUID": req.studyInstanceUID,
+                "seriesInstanceUID": req.seriesInstanceUID
+            }
+        )
         
         if response.status_code != 200:
             error_detail = response.text
@@ -214,8 +215,8 @@ async def slicer_health():
         Health status of Slicer server
     """
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{SLICER_URL}/health")
+        client = get_slicer_client()
+        response = await client.get(f"{SLICER_URL}/health", timeout=5.0)
         
         if response.status_code == 200:
             return response.json()
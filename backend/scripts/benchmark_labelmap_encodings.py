@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark labelmap encodings for viewer delivery.
+
+Builds a synthetic dental label map at typical CBCT size (maxilla/mandible
+arches, teeth and mandibular canals on a mostly empty background) and reports,
+for every encoding of services.labelmap_transport with and without
+compression, the payload size, encode time and reference decode time. The
+legacy JSON response (base64 per frame) is included for comparison.
+
+Usage (from backend/):
+    python scripts/benchmark_labelmap_encodings.py --size 512 --depth 448
+"""
+import sys
+import time
+import base64
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from services.labelmap_transport import (  # noqa: E402
+    LABELMAP_ENCODINGS,
+    IDENTITY,
+    available_compressions,
+    iter_encoded,
+    iter_compressed,
+    decode_rle,
+    decode_bbox,
+)
+
+
+def make_dental_labelmap(size: int, depth: int, seed: int = 0) -> np.ndarray:
+    """
+    Arch-shaped jaws with teeth and canals, roughly where DentalSegmentator puts them.
+
+    The arches change size from slice to slice and their edges are ragged,
+    so neighbouring frames differ as in a real segmentation.
+    """
+    rng = np.random.default_rng(seed)
+    seg = np.zeros((depth, size, size), dtype=np.uint8)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+    cy, cx = size * 0.62, size * 0.5
+    angle = np.arctan2(yy - cy, xx - cx)
+    front = yy < cy + size * 0.05
+
+    # Smooth per-pixel noise (upsampled coarse grid) for ragged boundaries
+    coarse = rng.standard_normal((depth // 8 + 2, size // 16 + 2, size // 16 + 2)).astype(np.float32)
+
+    def noise(k):
+        grid = coarse[k // 8, :size // 16 + 1, :size // 16 + 1]
+        return np.kron(grid, np.ones((16, 16), np.float32))[:size, :size] * 0.012
+
+    def ring(k, radius_x, radius_y):
+        return np.sqrt(((xx - cx) / radius_x) ** 2 + ((yy - cy) / radius_y) ** 2) - 1.0 + noise(k)
+
+    def band(lo, hi):
+        return range(int(depth * lo), int(depth * hi))
+
+    for k in band(0.20, 0.38):  # Maxilla, widening towards the teeth
+        t = (k - depth * 0.20) / (depth * 0.18)
+        seg[k][(np.abs(ring(k, size * 0.27 + size * 0.04 * t, size * 0.31 + size * 0.04 * t)) < 0.06 + 0.05 * t) & front] = 1
+    for k in band(0.60, 0.85):  # Mandible, narrowing downwards
+        t = (k - depth * 0.60) / (depth * 0.25)
+        seg[k][(np.abs(ring(k, size * 0.33 - size * 0.03 * t, size * 0.37 - size * 0.03 * t)) < 0.10 - 0.04 * t) & front] = 2
+
+    # Teeth: tapered crowns/roots in 16 sectors per jaw
+    sector = ((angle + np.pi) / (np.pi / 16)).astype(int)
+    for label, (lo, hi) in ((3, (0.36, 0.50)), (4, (0.48, 0.62))):
+        for k in band(lo, hi):
+            t = (k - depth * lo) / (depth * (hi - lo))
+            width = 0.02 + 0.03 * np.sin(np.pi * t)
+            teeth = (np.abs(ring(k, size * 0.28, size * 0.32)) < width) & front & (sector % 2 == 0)
+            seg[k][teeth] = label
+
+    for k in band(0.66, 0.74):  # Mandibular canals
+        canal = (np.abs(ring(k, size * 0.32, size * 0.36)) < 0.012) & (np.abs(xx - cx) > size * 0.12) & (yy < cy)
+        seg[k][canal] = 5
+
+    return seg
+
+
+def legacy_json_bytes(seg: np.ndarray) -> int:
+    """Size of the base64 frames in the JSON /get-labelmap response"""
+    return sum(len(base64.b64encode(frame.tobytes())) + 3 for frame in seg)
+
+
+def decode(data: bytes, encoding: str, shape) -> np.ndarray:
+    if encoding == "rle":
+        return decode_rle(data, shape)
+    if encoding == "bbox":
+        return decode_bbox(data, shape)
+    return np.frombuffer(data, np.uint8).reshape(shape)
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        import gzip
+        return gzip.decompress(data)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark labelmap encodings")
+    parser.add_argument("--size", type=int, default=512, help="Rows/columns of the label map")
+    parser.add_argument("--depth", type=int, default=448, help="Slices of the label map")
+    args = parser.parse_args()
+
+    seg = make_dental_labelmap(args.size, args.depth)
+    raw_size = seg.nbytes
+    background = 100.0 * np.count_nonzero(seg == 0) / seg.size
+    print(f"Label map: {seg.shape} uint8 ({raw_size / 1e6:.1f} MB, {background:.1f}% background)")
+
+    print(f"{'encoding':<22} {'size':>12} {'of raw':>8} {'encode':>10} {'decode':>10}")
+    start = time.perf_counter()
+    json_size = legacy_json_bytes(seg)
+    print(f"{'json (base64)':<22} {json_size / 1e6:9.2f} MB {100.0 * json_size / raw_size:7.2f}% "
+          f"{time.perf_counter() - start:8.2f} s")
+
+    for encoding in LABELMAP_ENCODINGS:
+        for compression in available_compressions()[::-1]:
+            start = time.perf_counter()
+            payload = b"".join(iter_compressed(iter_encoded(seg, encoding), compression))
+            encode_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            decoded = decode(decompress(payload, compression), encoding, seg.shape)
+            decode_time = time.perf_counter() - start
+            assert np.array_equal(decoded, seg), f"{encoding}/{compression} does not round-trip"
+
+            name = encoding if compression == IDENTITY else f"{encoding} + {compression}"
+            print(f"{name:<22} {len(payload) / 1e6:9.2f} MB {100.0 * len(payload) / raw_size:7.2f}% "
+                  f"{encode_time:8.2f} s {decode_time:8.2f} s")
+
+    print("All encodings round-trip")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark STL assembly for /download-stl.
+
+Meshes a synthetic full-resolution mandible mask (horseshoe-shaped arch at
+typical CBCT size) with skimage marching cubes, then compares the previous
+per-face/per-vertex loop into numpy-stl's Mesh with
+services.mesh_export.write_binary_stl, which gathers verts[faces] once and
+writes the records array directly, and checks that both contain the same
+triangles. The comparison needs numpy-stl (pip install numpy-stl), which the
+backend itself no longer uses; pass --skip-loop without it.
+
+Usage (from backend/):
+    python scripts/benchmark_stl_export.py --size 512 --depth 448
+"""
+import io
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from services.mesh_export import STL_HEADER_BYTES, STL_RECORD_DTYPE, write_binary_stl  # noqa: E402
+
+
+def make_mandible_mask(size: int, depth: int) -> np.ndarray:
+    """Horseshoe arch narrowing towards the chin, over the lower half of the volume"""
+    mask = np.zeros((depth, size, size), dtype=bool)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+    cy, cx = size * 0.62, size * 0.5
+    front = yy < cy + size * 0.05
+    for k in range(int(depth * 0.55), int(depth * 0.9)):
+        t = (k - depth * 0.55) / (depth * 0.35)
+        radius = np.sqrt(((xx - cx) / (size * (0.34 - 0.05 * t))) ** 2 + ((yy - cy) / (size * (0.38 - 0.05 * t))) ** 2)
+        mask[k] = (np.abs(radius - 1.0) < 0.09 - 0.04 * t) & front
+    return mask
+
+
+def stl_loop(verts: np.ndarray, faces: np.ndarray) -> bytes:
+    """The previous implementation, kept here for comparison"""
+    from stl import mesh as stl_mesh
+
+    stl_data = stl_mesh.Mesh(np.zeros(faces.shape[0], dtype=stl_mesh.Mesh.dtype))
+    for i, face in enumerate(faces):
+        for j in range(3):
+            stl_data.vectors[i][j] = verts[face[j], :]
+
+    out = io.BytesIO()
+    stl_data.save("mandible.stl", fh=out)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark STL assembly")
+    parser.add_argument("--size", type=int, default=512, help="Rows/columns of the mask")
+    parser.add_argument("--depth", type=int, default=448, help="Slices of the mask")
+    parser.add_argument("--skip-loop", action="store_true", help="Only time the vectorized writer")
+    args = parser.parse_args()
+
+    from skimage import measure
+
+    mask = make_mandible_mask(args.size, args.depth)
+    print(f"Mask: {mask.shape}, {np.count_nonzero(mask)} voxels")
+
+    start = time.perf_counter()
+    verts, faces, _, _ = measure.marching_cubes(mask.astype(np.uint8), level=0.5, spacing=(0.3, 0.3, 0.3))
+    print(f"Marching cubes: {len(verts)} vertices, {len(faces)} faces in {time.perf_counter() - start:.2f} s")
+
+    start = time.perf_counter()
+    out = io.BytesIO()
+    write_binary_stl(out, verts, faces, "mandible")
+    vectorized = out.getvalue()
+    vectorized_time = time.perf_counter() - start
+    print(f"Vectorized: {vectorized_time:.3f} s ({len(vectorized) / 1e6:.1f} MB)")
+
+    if args.skip_loop:
+        return
+
+    start = time.perf_counter()
+    looped = stl_loop(verts, faces)
+    loop_time = time.perf_counter() - start
+    print(f"Loop:       {loop_time:.3f} s ({len(looped) / 1e6:.1f} MB)")
+    print(f"Speedup:    {loop_time / vectorized_time:.0f}x")
+
+    # Same triangles (numpy-stl stores unnormalized normals, so those are not compared)
+    new = np.frombuffer(vectorized[STL_HEADER_BYTES + 4:], STL_RECORD_DTYPE)
+    old = np.frombuffer(looped[STL_HEADER_BYTES + 4:], STL_RECORD_DTYPE)
+    assert np.array_equal(new["vectors"], old["vectors"]), "Triangles differ"
+    print("Triangles identical")
+
+
+if __name__ == "__main__":
+    main()
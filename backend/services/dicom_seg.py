@@ -0,0 +1,330 @@
+"""
+DICOM SEG Helpers
+Array-level building blocks for writing and reading DICOM SEG label maps.
+
+These work on whole label maps at once instead of frame by frame, which
+matters for CBCT volumes with several hundred frames.
+
+Output encodings (SEG_ENCODINGS, selectable per segmentation request):
+- "labelmap":         LABELMAP SEG, one 8-bit frame per slice, uncompressed
+- "labelmap-rle":     as above, RLE Lossless transfer syntax
+- "labelmap-deflate": as above, Deflated Explicit VR Little Endian
+- "binary":           BINARY SEG, one 1-bit frame per (segment, slice) that
+                      contains the segment, bit-packed
+"""
+import logging
+from typing import Any, Dict, List, Optional, Sequence as SequenceType, Tuple
+
+import numpy as np
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+
+logger = logging.getLogger(__name__)
+
+SEG_ENCODINGS = ("labelmap", "labelmap-rle", "labelmap-deflate", "binary")
+
+SEGMENTATION_STORAGE = "1.2.840.10008.5.1.4.1.1.66.4"
+LABEL_MAP_SEGMENTATION_STORAGE = "1.2.840.10008.5.1.4.1.1.66.7"
+
+# Frames packed per np.packbits call; a multiple of 8 keeps every chunk byte-aligned
+_PACK_CHUNK_FRAMES = 64
+
+# Voxels processed per pass in label_presence (keeps temporaries cache-sized)
+_PRESENCE_CHUNK_VOXELS = 4 * 1024 * 1024
+
+# Above this many labels a single bincount beats one comparison pass per label
+_PRESENCE_COMPARE_MAX_LABELS = 32
+
+
+def label_presence(seg_array: np.ndarray, num_labels: int = 0) -> np.ndarray:
+    """
+    Which labels occur in which frame of a label map.
+
+    Works through the volume in chunks of frames. For the usual handful of
+    labels each chunk is compared against every label (cheap, vectorized
+    uint8 comparisons); for many labels a bincount over (frame, label) pairs
+    is used instead.
+
+    Args:
+        seg_array: Label map (frames, rows, cols) of non-negative integers
+        num_labels: Size of the label axis (default: max label + 1)
+
+    Returns:
+        Boolean matrix (frames, num_labels); [f, l] is True if label l occurs in frame f
+    """
+    frames = seg_array.shape[0]
+    flat = seg_array.reshape(frames, -1)
+    labels = max(num_labels, int(flat.max(initial=0)) + 1)
+    frames_per_chunk = max(1, _PRESENCE_CHUNK_VOXELS // max(1, flat.shape[1]))
+
+    presence = np.zeros((frames, labels), dtype=bool)
+    for start in range(0, frames, frames_per_chunk):
+        block = flat[start:start + frames_per_chunk]
+        n = block.shape[0]
+
+        if labels <= _PRESENCE_COMPARE_MAX_LABELS:
+            for label in range(labels):
+                presence[start:start + n, label] = (block == label).any(axis=1)
+        else:
+            offsets = (np.arange(n, dtype=np.int64) * labels)[:, np.newaxis]
+            counts = np.bincount((block.astype(np.int64) + offsets).ravel(), minlength=n * labels)
+            presence[start:start + n] = counts.reshape(n, labels) > 0
+
+    return presence
+
+
+def build_per_frame_functional_groups(
+    seg_array: np.ndarray,
+    origin: SequenceType[float],
+    slice_spacing: float,
+    presence: Optional[np.ndarray] = None
+) -> Sequence:
+    """
+    PerFrameFunctionalGroupsSequence for a label map stored one frame per slice.
+
+    Each item has the frame's FrameContent (dimension index), PlanePosition
+    (origin advanced slice_spacing per frame along z) and, if the frame is
+    not empty, a SegmentIdentification referencing its lowest label.
+    `presence` may be passed if label_presence was already computed.
+    """
+    frames = seg_array.shape[0]
+    if presence is None:
+        presence = label_presence(seg_array)
+
+    # Lowest non-zero label per frame (0 = empty frame)
+    segment_presence = presence[:, 1:]
+    primary = np.where(segment_presence.any(axis=1), segment_presence.argmax(axis=1) + 1, 0).tolist()
+
+    positions = np.tile(np.asarray(origin, dtype=np.float64), (frames, 1))
+    positions[:, 2] += np.arange(frames) * float(slice_spacing)
+    positions = positions.tolist()
+
+    items = []
+    for frame_idx in range(frames):
+        frame_item = Dataset()
+
+        frame_content = Dataset()
+        frame_content.DimensionIndexValues = [1, frame_idx + 1]
+        frame_item.FrameContentSequence = Sequence([frame_content])
+
+        plane_pos = Dataset()
+        plane_pos.ImagePositionPatient = positions[frame_idx]
+        frame_item.PlanePositionSequence = Sequence([plane_pos])
+
+        if primary[frame_idx]:
+            seg_id = Dataset()
+            seg_id.ReferencedSegmentNumber = primary[frame_idx]
+            frame_item.SegmentIdentificationSequence = Sequence([seg_id])
+
+        items.append(frame_item)
+
+    return Sequence(items)
+
+
+def binary_frame_index(presence: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Frames of a BINARY SEG: (segment number, slice index) for every slice
+    that contains the segment, ordered by segment then slice.
+    """
+    return [
+        (int(segment), int(slice_idx))
+        for segment in range(1, presence.shape[1])
+        for slice_idx in np.flatnonzero(presence[:, segment])
+    ]
+
+
+def pack_binary_frames(seg_array: np.ndarray, frames: List[Tuple[int, int]]) -> bytes:
+    """
+    PixelData of a BINARY SEG: one bit per pixel, frames packed back to back.
+
+    DICOM packs 1-bit pixel data continuously across frame boundaries, least
+    significant bit first; packing a multiple of 8 frames per call keeps each
+    chunk byte-aligned whatever the frame size.
+    """
+    chunks = []
+    for start in range(0, len(frames), _PACK_CHUNK_FRAMES):
+        group = frames[start:start + _PACK_CHUNK_FRAMES]
+        masks = np.stack([seg_array[slice_idx] == segment for segment, slice_idx in group])
+        chunks.append(np.packbits(masks, axis=None, bitorder="little").tobytes())
+    data = b"".join(chunks)
+
+    # Pixel Data must have even length
+    if len(data) % 2:
+        data += b"\0"
+    return data
+
+
+def _derivation_item(sop_class_uid: str, sop_instance_uid: str) -> Dataset:
+    """DerivationImageSequence item referencing the source image of a frame"""
+    purpose = Dataset()
+    purpose.CodeValue = "121322"
+    purpose.CodingSchemeDesignator = "DCM"
+    purpose.CodeMeaning = "Source image for image processing operation"
+
+    source = Dataset()
+    source.ReferencedSOPClassUID = sop_class_uid
+    source.ReferencedSOPInstanceUID = sop_instance_uid
+    source.PurposeOfReferenceCodeSequence = Sequence([purpose])
+
+    derivation_code = Dataset()
+    derivation_code.CodeValue = "113076"
+    derivation_code.CodingSchemeDesignator = "DCM"
+    derivation_code.CodeMeaning = "Segmentation"
+
+    derivation = Dataset()
+    derivation.DerivationCodeSequence = Sequence([derivation_code])
+    derivation.SourceImageSequence = Sequence([source])
+    return derivation
+
+
+def build_binary_per_frame_functional_groups(
+    frames: List[Tuple[int, int]],
+    origin: SequenceType[float],
+    slice_spacing: float,
+    source_instances: Optional[List[Tuple[str, str]]] = None
+) -> Sequence:
+    """
+    PerFrameFunctionalGroupsSequence for BINARY SEG frames from binary_frame_index.
+
+    `source_instances` ((SOPClassUID, SOPInstanceUID) per slice, for
+    single-frame sources) adds a DerivationImageSequence to each frame, which
+    lets readers place frames when empty ones were left out.
+    """
+    origin = [float(v) for v in origin]
+    items = []
+    for segment, slice_idx in frames:
+        frame_item = Dataset()
+
+        if source_instances is not None:
+            frame_item.DerivationImageSequence = Sequence([_derivation_item(*source_instances[slice_idx])])
+
+        frame_content = Dataset()
+        frame_content.DimensionIndexValues = [segment, slice_idx + 1]
+        frame_item.FrameContentSequence = Sequence([frame_content])
+
+        plane_pos = Dataset()
+        plane_pos.ImagePositionPatient = [origin[0], origin[1], origin[2] + slice_idx * float(slice_spacing)]
+        frame_item.PlanePositionSequence = Sequence([plane_pos])
+
+        seg_id = Dataset()
+        seg_id.ReferencedSegmentNumber = segment
+        frame_item.SegmentIdentificationSequence = Sequence([seg_id])
+
+        items.append(frame_item)
+
+    return Sequence(items)
+
+
+def _first_item(ds: Dataset, keyword: str) -> Optional[Dataset]:
+    seq = ds.get(keyword)
+    return seq[0] if seq else None
+
+
+def _source_slice_indices(ds: Dataset, per_frame: Sequence) -> Optional[np.ndarray]:
+    """
+    Index of each frame's source image among the referenced source instances.
+
+    Writers list the referenced instances in source series order, so for a
+    single-frame source series this is the frame's slice index in the source.
+    None if a frame has no single source image reference.
+    """
+    referenced = [
+        str(item.ReferencedSOPInstanceUID)
+        for series in ds.get("ReferencedSeriesSequence", [])
+        for item in series.get("ReferencedInstanceSequence", [])
+    ]
+    order = {uid: index for index, uid in enumerate(referenced)}
+
+    indices = []
+    for item in per_frame:
+        derivation = _first_item(item, "DerivationImageSequence")
+        source = _first_item(derivation, "SourceImageSequence") if derivation is not None else None
+        uid = str(getattr(source, "ReferencedSOPInstanceUID", "")) if source is not None else ""
+        if uid not in order:
+            return None
+        indices.append(order[uid])
+    return np.asarray(indices)
+
+
+def seg_dataset_to_labelmap(ds: Dataset) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Decode a DICOM SEG into a label map, whatever encoding wrote it.
+
+    Handles LABELMAP and BINARY SEGs (bit-packed or not, any transfer syntax
+    pydicom can decode) and SEGs that omit empty frames: frames are placed by
+    their plane position, and BINARY frames are painted with their
+    referenced segment number. Empty slices a writer left out are restored
+    from the frames' source image references (leading slices) and the number
+    of referenced source instances (trailing slices), so the label map lines
+    up with the source series.
+
+    Returns:
+        (label map (slices, rows, cols) uint8, {"spacing": (z, y, x), "origin": [x, y, z]})
+    """
+    pixels = ds.pixel_array
+    if pixels.ndim == 2:
+        pixels = pixels[np.newaxis]
+    num_frames, rows, cols = pixels.shape[:3]
+
+    shared = _first_item(ds, "SharedFunctionalGroupsSequence") or Dataset()
+    measures = _first_item(shared, "PixelMeasuresSequence") or ds
+    orientation = _first_item(shared, "PlaneOrientationSequence") or ds
+
+    row_spacing, col_spacing = [float(v) for v in getattr(measures, "PixelSpacing", [1.0, 1.0])]
+    slice_spacing = float(
+        getattr(measures, "SpacingBetweenSlices", 0) or getattr(measures, "SliceThickness", 0) or 0
+    )
+
+    binary = getattr(ds, "SegmentationType", "") in ("BINARY", "FRACTIONAL")
+    per_frame = ds.get("PerFrameFunctionalGroupsSequence")
+
+    positions = None
+    if per_frame is not None and len(per_frame) == num_frames:
+        items = [_first_item(item, "PlanePositionSequence") for item in per_frame]
+        if all(item is not None and "ImagePositionPatient" in item for item in items):
+            positions = np.array([[float(v) for v in item.ImagePositionPatient] for item in items])
+
+    if positions is None:
+        # No geometry per frame: assume one frame per slice in order
+        slice_index = np.arange(num_frames)
+        origin = [float(v) for v in getattr(ds, "ImagePositionPatient", [0.0, 0.0, 0.0])]
+    else:
+        iop = np.asarray(getattr(orientation, "ImageOrientationPatient", [1, 0, 0, 0, 1, 0]), dtype=np.float64)
+        normal = np.cross(iop[:3], iop[3:])
+        distances = positions @ normal
+        unique = np.unique(np.round(distances, 4))
+        if not slice_spacing:
+            steps = np.diff(unique)
+            slice_spacing = float(steps.min()) if len(steps) else 1.0
+        slice_index = np.rint((distances - unique[0]) / slice_spacing).astype(int)
+        origin = positions[int(np.argmin(distances))]
+
+        # Offset of the first stored slice within the source series
+        source_index = _source_slice_indices(ds, per_frame)
+        if source_index is not None:
+            shift = np.unique(source_index - slice_index)
+            if len(shift) == 1 and shift[0] > 0:
+                slice_index = slice_index + int(shift[0])
+                origin = origin - int(shift[0]) * slice_spacing * normal
+        origin = origin.tolist()
+
+    # Trailing empty slices a writer left out: one slice per referenced
+    # single-frame source instance
+    referenced = sum(len(item.get("ReferencedInstanceSequence", [])) for item in ds.get("ReferencedSeriesSequence", []))
+    depth = int(slice_index.max()) + 1
+    if referenced > depth and positions is not None:
+        depth = referenced
+
+    labelmap = np.zeros((depth, rows, cols), dtype=np.uint8)
+    for frame_idx in range(num_frames):
+        target = slice_index[frame_idx]
+        if binary:
+            seg_id = _first_item(per_frame[frame_idx], "SegmentIdentificationSequence") if per_frame else None
+            segment = int(seg_id.ReferencedSegmentNumber) if seg_id is not None else 1
+            labelmap[target][pixels[frame_idx] > 0] = segment
+        else:
+            frame = pixels[frame_idx]
+            labelmap[target] = np.where(frame > 0, frame, labelmap[target])
+
+    geometry = {"spacing": (slice_spacing or 1.0, row_spacing, col_spacing), "origin": origin}
+    return labelmap, geometry
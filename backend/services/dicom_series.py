@@ -0,0 +1,174 @@
+"""
+DICOM Series Loading
+Decodes a CT/CBCT series once into a slice-sorted volume plus its headers.
+
+The resulting DicomSeries is handed through every stage of a job (inference,
+demo fallback, DICOM SEG creation), so the instances are parsed a single time.
+Once the volume is assembled the per-instance pixel data is dropped from the
+datasets; only the headers are kept for building derived objects.
+
+A DicomSeries can be cached as its volume plus JSON metadata (the headers in
+the DICOM JSON model, see DicomSeries.cache_metadata), so a series decoded
+once can be rebuilt without downloading or parsing it again.
+"""
+import io
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pydicom
+from pydicom.dataset import FileMetaDataset
+
+logger = logging.getLogger(__name__)
+
+DicomSource = Union[str, Path, bytes]
+
+
+@dataclass
+class DicomSeries:
+    """A decoded series: volume (z, y, x) in slice order and the matching datasets"""
+    volume: np.ndarray
+    datasets: List[pydicom.Dataset]
+    geometry: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def num_frames(self) -> int:
+        return self.volume.shape[0]
+
+    def cache_metadata(self) -> Dict[str, Any]:
+        """JSON-serializable headers and geometry, stored next to the volume (see from_cache)"""
+        return {
+            "geometry": self.geometry,
+            "datasets": [ds.to_json_dict(suppress_invalid_tags=True) for ds in self.datasets],
+            "file_meta": [_file_meta_json(ds) for ds in self.datasets],
+        }
+
+    @classmethod
+    def from_cache(cls, volume: np.ndarray, metadata: Dict[str, Any]) -> "DicomSeries":
+        """Rebuild a series from its volume and cache_metadata()"""
+        datasets = []
+        for header, file_meta in zip(metadata["datasets"], metadata["file_meta"]):
+            ds = pydicom.Dataset.from_json(header)
+            if file_meta is not None:
+                ds.file_meta = FileMetaDataset(pydicom.Dataset.from_json(file_meta))
+            datasets.append(ds)
+        geometry = dict(metadata["geometry"])
+        geometry["spacing"] = tuple(geometry["spacing"])
+        return cls(volume=volume, datasets=datasets, geometry=geometry)
+
+
+def _file_meta_json(ds: pydicom.Dataset) -> Optional[Dict[str, Any]]:
+    file_meta = getattr(ds, "file_meta", None)
+    return file_meta.to_json_dict(suppress_invalid_tags=True) if file_meta else None
+
+
+def _frames(arr: np.ndarray) -> List[np.ndarray]:
+    """Split a decoded pixel array into 2D grayscale frames"""
+    if arr.ndim == 2:
+        return [arr]
+    if arr.ndim == 3:
+        # Either RGB (rows, cols, 3) or multi-frame (frames, rows, cols)
+        if arr.shape[2] == 3:
+            return [arr[:, :, 0]]
+        return list(arr)
+    if arr.ndim == 4:
+        # (1, frames, rows, cols) or RGB frames (frames, rows, cols, 3)
+        if arr.shape[0] == 1:
+            return list(arr[0])
+        if arr.shape[3] == 3:
+            return list(arr[:, :, :, 0])
+        squeezed = np.squeeze(arr)
+        return _frames(squeezed) if squeezed.ndim < 4 else []
+    return []
+
+
+def _slice_position(ds: pydicom.Dataset) -> float:
+    """Position of a slice along the stack normal (falls back to SliceLocation / InstanceNumber)"""
+    if hasattr(ds, "ImagePositionPatient") and hasattr(ds, "ImageOrientationPatient"):
+        orientation = np.asarray(ds.ImageOrientationPatient, dtype=np.float64)
+        normal = np.cross(orientation[:3], orientation[3:])
+        return float(np.dot(normal, np.asarray(ds.ImagePositionPatient, dtype=np.float64)))
+    if hasattr(ds, "SliceLocation"):
+        return float(ds.SliceLocation)
+    return float(getattr(ds, "InstanceNumber", 0) or 0)
+
+
+def release_pixel_data(ds: pydicom.Dataset):
+    """Drop the encoded and decoded pixel data of a dataset, keeping its headers"""
+    if "PixelData" in ds:
+        del ds.PixelData
+    if getattr(ds, "_pixel_array", None) is not None:
+        ds._pixel_array = None
+
+
+def volume_geometry(datasets: List[pydicom.Dataset]) -> Dict[str, Any]:
+    """
+    Voxel spacing and origin of a slice-sorted DICOM series.
+
+    Returns:
+        {"spacing": (z, y, x) in mm, "origin": ImagePositionPatient of the first slice}
+    """
+    first = datasets[0]
+    row_spacing, col_spacing = [float(v) for v in getattr(first, "PixelSpacing", [1.0, 1.0])]
+
+    slice_spacing = float(getattr(first, "SpacingBetweenSlices", 0) or getattr(first, "SliceThickness", 0) or 1.0)
+    if len(datasets) > 1 and hasattr(first, "ImagePositionPatient") and hasattr(datasets[1], "ImagePositionPatient"):
+        p0 = np.asarray(first.ImagePositionPatient, dtype=np.float64)
+        p1 = np.asarray(datasets[1].ImagePositionPatient, dtype=np.float64)
+        distance = float(np.linalg.norm(p1 - p0))
+        if distance > 0:
+            slice_spacing = distance
+
+    origin = [float(v) for v in getattr(first, "ImagePositionPatient", [0.0, 0.0, 0.0])]
+    return {"spacing": (slice_spacing, row_spacing, col_spacing), "origin": origin}
+
+
+def load_dicom_series(sources: Iterable[DicomSource]) -> DicomSeries:
+    """
+    Parse a series once and assemble its volume.
+
+    Args:
+        sources: File paths or raw DICOM bytes, in any order
+
+    Returns:
+        DicomSeries with the volume in native pixel dtype and the datasets
+        sorted to match it (pixel data released)
+
+    Raises:
+        ValueError: if no instance with pixel data could be read
+    """
+    datasets = []
+    for source in sources:
+        try:
+            fp = io.BytesIO(source) if isinstance(source, bytes) else str(source)
+            ds = pydicom.dcmread(fp)
+        except Exception as e:
+            logger.warning(f"Could not read DICOM {source if not isinstance(source, bytes) else '<bytes>'}: {e}")
+            continue
+        if "PixelData" in ds:
+            datasets.append(ds)
+
+    if not datasets:
+        raise ValueError("No valid DICOM files with pixel data found")
+
+    datasets.sort(key=_slice_position)
+
+    frames = []
+    for ds in datasets:
+        frames.extend(_frames(ds.pixel_array))
+        release_pixel_data(ds)
+
+    if not frames:
+        raise ValueError("No decodable pixel data found")
+
+    volume = np.stack(frames, axis=0)
+    logger.info(f"Loaded DICOM series: {len(datasets)} instances, volume {volume.shape} {volume.dtype}")
+    return DicomSeries(volume=volume, datasets=datasets, geometry=volume_geometry(datasets))
+
+
+def load_dicom_dir(directory: Path) -> DicomSeries:
+    """Load every DICOM file in a directory (*.dcm, or all files if there are none)"""
+    files = sorted(directory.glob("*.dcm")) or sorted(f for f in directory.iterdir() if f.is_file())
+    return load_dicom_series(files)
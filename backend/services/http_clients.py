@@ -0,0 +1,95 @@
+"""
+Shared HTTP clients
+Application-scoped, connection-pooled httpx clients for Orthanc and the 3D Slicer server.
+
+The clients are opened in the FastAPI lifespan hook (see main.py) and closed on
+shutdown. Routers call get_orthanc_client() / get_slicer_client() instead of
+opening a new httpx.AsyncClient per request, so keep-alive connections are reused.
+"""
+import os
+import logging
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Orthanc configuration (shared by all routers)
+ORTHANC_URL = os.getenv("ORTHANC_URL", "http://127.0.0.1:8042").rstrip("/")
+ORTHANC_USER = os.getenv("ORTHANC_USER", "orthanc")
+ORTHANC_PASS = os.getenv("ORTHANC_PASS", "orthanc")
+ORTHANC_TIMEOUT = float(os.getenv("ORTHANC_TIMEOUT", "120"))
+ORTHANC_CONNECT_TIMEOUT = float(os.getenv("ORTHANC_CONNECT_TIMEOUT", "10"))
+ORTHANC_MAX_CONNECTIONS = int(os.getenv("ORTHANC_MAX_CONNECTIONS", "32"))
+ORTHANC_MAX_KEEPALIVE = int(os.getenv("ORTHANC_MAX_KEEPALIVE", "16"))
+ORTHANC_HTTP2 = os.getenv("ORTHANC_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# 3D Slicer server requests are long-running processing calls
+SLICER_TIMEOUT = float(os.getenv("SLICER_TIMEOUT", "600"))
+
+_orthanc_client: Optional[httpx.AsyncClient] = None
+_slicer_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2 support in httpx requires the optional 'h2' package"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_orthanc_client() -> httpx.AsyncClient:
+    """
+    Get the shared Orthanc client.
+    
+    Requests may use paths relative to ORTHANC_URL (e.g. "/tools/find").
+    The client is created lazily if the lifespan hook has not run (scripts, shells).
+    """
+    global _orthanc_client
+    
+    if _orthanc_client is None or _orthanc_client.is_closed:
+        http2 = ORTHANC_HTTP2
+        if http2 and not _http2_available():
+            logger.warning("ORTHANC_HTTP2 is enabled but 'h2' is not installed; using HTTP/1.1")
+            http2 = False
+        
+        auth = (ORTHANC_USER, ORTHANC_PASS) if ORTHANC_USER else None
+        _orthanc_client = httpx.AsyncClient(
+            base_url=ORTHANC_URL,
+            auth=auth,
+            http2=http2,
+            timeout=httpx.Timeout(ORTHANC_TIMEOUT, connect=ORTHANC_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=ORTHANC_MAX_CONNECTIONS,
+                max_keepalive_connections=ORTHANC_MAX_KEEPALIVE
+            )
+        )
+        logger.info(f"Opened Orthanc client for {ORTHANC_URL} (http2={http2})")
+    
+    return _orthanc_client
+
+
+def get_slicer_client() -> httpx.AsyncClient:
+    """Get the shared 3D Slicer server client (created lazily)"""
+    global _slicer_client
+    
+    if _slicer_client is None or _slicer_client.is_closed:
+        _slicer_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(SLICER_TIMEOUT, connect=ORTHANC_CONNECT_TIMEOUT)
+        )
+    
+    return _slicer_client
+
+
+async def close_clients():
+    """Close all shared clients (called on application shutdown)"""
+    global _orthanc_client, _slicer_client
+    
+    for client in (_orthanc_client, _slicer_client):
+        if client is not None and not client.is_closed:
+            await client.aclose()
+    
+    _orthanc_client = None
+    _slicer_client = None
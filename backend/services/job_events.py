@@ -0,0 +1,102 @@
+"""
+Job Progress Streaming
+Server-Sent Events and long-poll helpers on top of the job store.
+
+Instead of polling /status in a loop, a client can either
+- open GET /events/{job_id} and receive one SSE "progress" event per job
+  update until the job finishes, or
+- call GET /status/{job_id}?since=<version>&wait=<seconds>, which returns as
+  soon as the job's version exceeds `since` (or it finishes / times out).
+"""
+import os
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from services.job_store import JobTable, FINISHED_STATUSES
+
+# Upper bound for ?wait= on status endpoints
+JOB_LONG_POLL_MAX = float(os.getenv("JOB_LONG_POLL_MAX", "60"))
+
+# Seconds between SSE keep-alive comments while a job is quiet
+SSE_HEARTBEAT_INTERVAL = 15.0
+
+JobRenderer = Callable[[str, Dict[str, Any]], Any]
+
+
+async def wait_for_job(table: JobTable, job_id: str, since: Optional[int], wait: float) -> Dict[str, Any]:
+    """
+    Long-poll helper for status endpoints.
+
+    Returns the job immediately when `since` is None or `wait` is 0, otherwise
+    once its version exceeds `since`.
+
+    Raises:
+        HTTPException: 404 if the job is unknown
+    """
+    if since is None or wait <= 0:
+        job = table.get(job_id)
+    else:
+        job = await table.wait(job_id, since, min(wait, JOB_LONG_POLL_MAX))
+
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+
+async def job_event_stream(
+    table: JobTable,
+    job_id: str,
+    render: JobRenderer,
+    last_version: int = 0
+) -> AsyncIterator[str]:
+    """Yield SSE messages for each update of a job until it finishes"""
+    version = last_version
+    while True:
+        job = await table.wait(job_id, version, SSE_HEARTBEAT_INTERVAL)
+        if job is None:
+            yield f"event: error\ndata: {json.dumps({'detail': 'Job not found'})}\n\n"
+            return
+
+        if job.get("version", 0) > version:
+            version = job["version"]
+            payload = json.dumps(render(job_id, job), default=str)
+            yield f"id: {version}\nevent: progress\ndata: {payload}\n\n"
+        else:
+            yield ": keep-alive\n\n"
+
+        if job.get("status") in FINISHED_STATUSES:
+            return
+
+
+def job_event_response(
+    table: JobTable,
+    job_id: str,
+    render: JobRenderer,
+    last_event_id: Optional[str] = None
+) -> StreamingResponse:
+    """
+    SSE response streaming a job's progress.
+
+    Args:
+        last_event_id: Last-Event-ID header of a reconnecting client; events
+            up to that version are not sent again
+
+    Raises:
+        HTTPException: 404 if the job is unknown
+    """
+    if table.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    try:
+        last_version = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        last_version = 0
+
+    return StreamingResponse(
+        job_event_stream(table, job_id, render, last_version),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
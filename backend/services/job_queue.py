@@ -0,0 +1,112 @@
+"""
+Job Queue
+Bounded asyncio queue drained by a fixed pool of worker tasks.
+
+Replaces FastAPI BackgroundTasks for long-running jobs: at most `workers`
+jobs run at once, at most `max_size` wait, and callers get an error instead
+of silently piling up work when the queue is full. Job handlers are
+coroutines and are expected to push their CPU-bound stages to threads
+(asyncio.to_thread) so the event loop stays responsive.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[..., Awaitable[Any]]
+
+
+class QueueFullError(Exception):
+    """The queue is at capacity; the caller should retry later"""
+
+
+class JobQueue:
+    """FIFO job queue with a worker pool"""
+
+    def __init__(self, name: str, handler: JobHandler, workers: int = 1, max_size: int = 16):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_size = max_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: List[str] = []
+        self._running: List[str] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        """Start the worker tasks (idempotent; needs a running event loop)"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"{self.name}-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"Job queue '{self.name}' started with {self.workers} worker(s)")
+
+    async def stop(self):
+        """
+        Cancel the workers; queued jobs are dropped.
+
+        Their records are left as they were; callers fail them afterwards
+        (see JobTable.fail_abandoned).
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._pending.clear()
+        self._running.clear()
+
+    def submit(self, job_id: str, *args: Any) -> int:
+        """
+        Queue a job for handler(job_id, *args).
+
+        Returns:
+            1-based position in the queue
+
+        Raises:
+            QueueFullError: if max_size jobs are already waiting
+        """
+        self.start()
+        if len(self._pending) >= self.max_size:
+            raise QueueFullError(f"Job queue '{self.name}' is full ({self.max_size} jobs waiting)")
+
+        self._pending.append(job_id)
+        self._queue.put_nowait((job_id, args))
+        return len(self._pending)
+
+    def position(self, job_id: str) -> Optional[int]:
+        """1-based queue position of a waiting job, 0 if running, None if unknown"""
+        if job_id in self._running:
+            return 0
+        try:
+            return self._pending.index(job_id) + 1
+        except ValueError:
+            return None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "queued": len(self._pending),
+            "max_queued": self.max_size,
+        }
+
+    async def _worker(self, index: int):
+        while True:
+            job_id, args = await self._queue.get()
+            self._pending.remove(job_id)
+            self._running.append(job_id)
+            try:
+                await self.handler(job_id, *args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Handlers record their own failures; this only keeps the worker alive
+                logger.error(f"Job {job_id} in queue '{self.name}' raised: {e}")
+            finally:
+                self._running.remove(job_id)
+                self._queue.task_done()
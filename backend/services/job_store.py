@@ -0,0 +1,639 @@
+"""
+Job Store
+Shared, durable job state for the background-job routers.
+
+Job records are plain JSON-serializable dicts grouped by namespace (one per
+router). The default backend is a SQLite file, which every uvicorn worker on
+the host opens, so a status poll can be served by any worker and jobs
+survive a restart. JOB_STORE=memory keeps the old per-process behaviour.
+Another backend (e.g. Redis) only has to implement the JobStore methods.
+
+Finished jobs expire JOB_TTL_SECONDS after their last update; jobs that stop
+updating without finishing (e.g. their worker died) expire after
+JOB_STALE_SECONDS.
+
+Every record carries a "version" counter bumped on each update, which lets
+clients wait for the next change (JobTable.wait). Waiters in the process
+that made the update are woken immediately; updates made by other workers
+are picked up by polling the store every JOB_WATCH_INTERVAL seconds.
+
+Claims map a caller-defined key (e.g. the series being segmented) to the
+job working on it, so identical requests can attach to that job instead of
+starting another. A claim lapses when its job finishes, or when the job has
+not been updated for JOB_CLAIM_TIMEOUT seconds (its worker presumably died).
+
+Jobs that will never finish are failed explicitly: on shutdown a process
+fails its own unfinished jobs (JobTable.fail_abandoned), and on startup jobs
+left unfinished by a process that is gone, e.g. after a crash, are failed
+too (JobTable.fail_orphaned). Both drop the jobs' claims, so identical
+requests start a new job instead of attaching to one nobody runs. The SQLite
+store records the creating process (pid plus a random token, as pids are
+reused) on every job for this.
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+JOB_STORE = os.getenv("JOB_STORE", "sqlite").lower()
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "/tmp/voxel3di_jobs.sqlite3")
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "86400"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", str(7 * 86400)))
+JOB_WATCH_INTERVAL = float(os.getenv("JOB_WATCH_INTERVAL", "1.0"))
+JOB_CLAIM_TIMEOUT = float(os.getenv("JOB_CLAIM_TIMEOUT", "3600"))
+
+FINISHED_STATUSES = ("completed", "failed")
+
+# Minimum seconds between expiry sweeps
+_PURGE_INTERVAL = 60.0
+
+
+_process_owner: Optional[str] = None
+
+
+def process_owner() -> str:
+    """Id of this process in job records: pid plus a random token (new after a fork)"""
+    global _process_owner
+    if _process_owner is None or not _process_owner.startswith(f"{os.getpid()}:"):
+        _process_owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+    return _process_owner
+
+
+def _process_alive(pid: int) -> bool:
+    """Whether a process with this pid exists (assumed so where that cannot be checked)"""
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore(ABC):
+    """Interface of a job state backend"""
+
+    def __init__(self):
+        self._waiters: Dict[Tuple[str, str], List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._waiters_lock = threading.Lock()
+
+    @abstractmethod
+    def create(self, namespace: str, job_id: str, data: Dict[str, Any]):
+        """Insert (or replace) a job record"""
+
+    @abstractmethod
+    def get(self, namespace: str, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the job record, or None if unknown/expired"""
+
+    @abstractmethod
+    def update(self, namespace: str, job_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Merge fields into a job record atomically; returns the new record (None if unknown)"""
+
+    @abstractmethod
+    def delete(self, namespace: str, job_id: str):
+        """Remove a job record"""
+
+    @abstractmethod
+    def count(self, namespace: str, status: str) -> int:
+        """Number of jobs in a namespace with the given status"""
+
+    @abstractmethod
+    def purge_expired(self) -> int:
+        """Delete expired jobs; returns how many were removed"""
+
+    @abstractmethod
+    def claim(self, namespace: str, key: str, job_id: str) -> str:
+        """
+        Atomically claim a key for a job.
+
+        Returns:
+            job_id if the claim was taken, otherwise the id of the active job
+            already holding it
+        """
+
+    @abstractmethod
+    def release(self, namespace: str, key: str, job_id: str):
+        """Drop a claim, if it is still held by job_id"""
+
+    @abstractmethod
+    def fail_abandoned(self, namespace: str, fields: Dict[str, Any]) -> int:
+        """
+        Mark this process's unfinished jobs failed (merging in fields) and drop
+        their claims; for shutdown. Returns how many jobs were failed.
+        """
+
+    @abstractmethod
+    def fail_orphaned(self, namespace: str, fields: Dict[str, Any]) -> int:
+        """
+        Mark unfinished jobs of processes that are gone failed (merging in
+        fields) and drop their claims; for startup. Returns how many jobs were failed.
+        """
+
+    def table(self, namespace: str) -> "JobTable":
+        return JobTable(self, namespace)
+
+    def add_waiter(self, namespace: str, job_id: str) -> asyncio.Event:
+        """Event set on the next update of the job made by this process"""
+        event = asyncio.Event()
+        with self._waiters_lock:
+            self._waiters.setdefault((namespace, job_id), []).append((asyncio.get_running_loop(), event))
+        return event
+
+    def remove_waiter(self, namespace: str, job_id: str, event: asyncio.Event):
+        with self._waiters_lock:
+            waiters = self._waiters.get((namespace, job_id), [])
+            waiters[:] = [w for w in waiters if w[1] is not event]
+            if not waiters:
+                self._waiters.pop((namespace, job_id), None)
+
+    def notify(self, namespace: str, job_id: str):
+        """Wake waiters of a job (safe to call from any thread)"""
+        with self._waiters_lock:
+            waiters = self._waiters.pop((namespace, job_id), [])
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+
+class MemoryJobStore(JobStore):
+    """Process-local store (jobs are lost on restart and not shared between workers)"""
+
+    def __init__(self):
+        super().__init__()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._updated: Dict[str, float] = {}
+        self._claims: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    @staticmethod
+    def _key(namespace: str, job_id: str) -> str:
+        return f"{namespace}/{job_id}"
+
+    def create(self, namespace: str, job_id: str, data: Dict[str, Any]):
+        self._maybe_purge()
+        key = self._key(namespace, job_id)
+        with self._lock:
+            self._jobs[key] = {**data, "version": 1}
+            self._updated[key] = time.time()
+        self.notify(namespace, job_id)
+
+    def get(self, namespace: str, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(self._key(namespace, job_id))
+            return dict(job) if job is not None else None
+
+    def update(self, namespace: str, job_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = self._key(namespace, job_id)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                return None
+            job.update(fields)
+            job["version"] = job.get("version", 0) + 1
+            self._updated[key] = time.time()
+            job = dict(job)
+        self.notify(namespace, job_id)
+        return job
+
+    def delete(self, namespace: str, job_id: str):
+        key = self._key(namespace, job_id)
+        with self._lock:
+            self._jobs.pop(key, None)
+            self._updated.pop(key, None)
+
+    def count(self, namespace: str, status: str) -> int:
+        prefix = f"{namespace}/"
+        with self._lock:
+            return sum(
+                1 for key, job in self._jobs.items()
+                if key.startswith(prefix) and job.get("status") == status
+            )
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [
+                key for key, job in self._jobs.items()
+                if now - self._updated[key] > (
+                    JOB_TTL_SECONDS if job.get("status") in FINISHED_STATUSES else JOB_STALE_SECONDS
+                )
+            ]
+            for key in expired:
+                del self._jobs[key]
+                del self._updated[key]
+            for claim_key, job_id in list(self._claims.items()):
+                if self._key(claim_key.split("/", 1)[0], job_id) not in self._jobs:
+                    del self._claims[claim_key]
+        return len(expired)
+
+    def claim(self, namespace: str, key: str, job_id: str) -> str:
+        claim_key = self._key(namespace, key)
+        with self._lock:
+            holder = self._claims.get(claim_key)
+            if holder is not None:
+                job_key = self._key(namespace, holder)
+                job = self._jobs.get(job_key)
+                if (
+                    job is not None
+                    and job.get("status") not in FINISHED_STATUSES
+                    and time.time() - self._updated[job_key] < JOB_CLAIM_TIMEOUT
+                ):
+                    return holder
+            self._claims[claim_key] = job_id
+            return job_id
+
+    def release(self, namespace: str, key: str, job_id: str):
+        claim_key = self._key(namespace, key)
+        with self._lock:
+            if self._claims.get(claim_key) == job_id:
+                del self._claims[claim_key]
+
+    def fail_abandoned(self, namespace: str, fields: Dict[str, Any]) -> int:
+        # Every job here belongs to this process
+        prefix = f"{namespace}/"
+        with self._lock:
+            failed = [
+                key for key, job in self._jobs.items()
+                if key.startswith(prefix) and job.get("status") not in FINISHED_STATUSES
+            ]
+            for key in failed:
+                job = self._jobs[key]
+                job.update(fields, status="failed")
+                job["version"] = job.get("version", 0) + 1
+                self._updated[key] = time.time()
+            job_ids = {key[len(prefix):] for key in failed}
+            for claim_key, job_id in list(self._claims.items()):
+                if claim_key.startswith(prefix) and job_id in job_ids:
+                    del self._claims[claim_key]
+        for job_id in job_ids:
+            self.notify(namespace, job_id)
+        return len(failed)
+
+    def fail_orphaned(self, namespace: str, fields: Dict[str, Any]) -> int:
+        # Jobs live and die with this process
+        return 0
+
+    def _maybe_purge(self):
+        if time.monotonic() - self._last_purge >= _PURGE_INTERVAL:
+            self._last_purge = time.monotonic()
+            self.purge_expired()
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Job store in a SQLite database file.
+
+    Safe to share between processes: updates are read-modify-write inside an
+    IMMEDIATE transaction, and the database runs in WAL mode so readers do
+    not block the writer.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._last_purge = 0.0
+        self._registered_owner: Optional[str] = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    namespace TEXT NOT NULL,
+                    job_id TEXT NOT NULL,
+                    status TEXT,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    owner TEXT,
+                    PRIMARY KEY (namespace, job_id)
+                )
+                """
+            )
+            if "owner" not in [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                try:
+                    # Stores created before jobs recorded their process
+                    conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+                except sqlite3.OperationalError:
+                    # Another worker added it first
+                    pass
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated_at)")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job_claims (
+                    namespace TEXT NOT NULL,
+                    claim_key TEXT NOT NULL,
+                    job_id TEXT NOT NULL,
+                    PRIMARY KEY (namespace, claim_key)
+                )
+                """
+            )
+            # The process currently using each pid, to tell a live owner from a reused pid
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job_owners (
+                    pid INTEGER PRIMARY KEY,
+                    owner TEXT NOT NULL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread (and per process after a fork)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @property
+    def owner(self) -> str:
+        """
+        This process's id in job records (see process_owner).
+
+        Registered in job_owners on first use, so a process reusing the pid
+        of a dead one replaces its entry.
+        """
+        owner = process_owner()
+        if self._registered_owner != owner:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO job_owners (pid, owner) VALUES (?, ?)",
+                (os.getpid(), owner)
+            )
+            self._registered_owner = owner
+        return owner
+
+    def _owner_alive(self, owner: Optional[str], registered: Dict[int, str]) -> bool:
+        """Whether the process that recorded `owner` is still running"""
+        if owner is None:
+            # Written before jobs recorded their process
+            return False
+        if owner == self.owner:
+            return True
+        pid = int(owner.split(":", 1)[0])
+        if registered.get(pid) != owner:
+            # The pid was taken over by another process of this service
+            return False
+        return _process_alive(pid)
+
+    def create(self, namespace: str, job_id: str, data: Dict[str, Any]):
+        self._maybe_purge()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO jobs (namespace, job_id, status, data, updated_at, owner) VALUES (?, ?, ?, ?, ?, ?)",
+            (namespace, job_id, data.get("status"), json.dumps({**data, "version": 1}), time.time(), self.owner)
+        )
+        self.notify(namespace, job_id)
+
+    def get(self, namespace: str, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT data FROM jobs WHERE namespace = ? AND job_id = ?",
+            (namespace, job_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, namespace: str, job_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM jobs WHERE namespace = ? AND job_id = ?",
+                (namespace, job_id)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            job = json.loads(row[0])
+            job.update(fields)
+            job["version"] = job.get("version", 0) + 1
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ?, updated_at = ? WHERE namespace = ? AND job_id = ?",
+                (job.get("status"), json.dumps(job), time.time(), namespace, job_id)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self.notify(namespace, job_id)
+        return job
+
+    def delete(self, namespace: str, job_id: str):
+        self._connect().execute(
+            "DELETE FROM jobs WHERE namespace = ? AND job_id = ?",
+            (namespace, job_id)
+        )
+
+    def count(self, namespace: str, status: str) -> int:
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE namespace = ? AND status = ?",
+            (namespace, status)
+        ).fetchone()
+        return row[0]
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        cursor = self._connect().execute(
+            f"""
+            DELETE FROM jobs WHERE
+                (status IN ({placeholders}) AND updated_at < ?)
+                OR updated_at < ?
+            """,
+            (*FINISHED_STATUSES, now - JOB_TTL_SECONDS, now - JOB_STALE_SECONDS)
+        )
+        self._connect().execute(
+            """
+            DELETE FROM job_claims WHERE NOT EXISTS (
+                SELECT 1 FROM jobs WHERE jobs.namespace = job_claims.namespace AND jobs.job_id = job_claims.job_id
+            )
+            """
+        )
+        if cursor.rowcount:
+            logger.info(f"Expired {cursor.rowcount} jobs from the job store")
+        return cursor.rowcount
+
+    def claim(self, namespace: str, key: str, job_id: str) -> str:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """
+                SELECT c.job_id, j.status, j.updated_at FROM job_claims c
+                LEFT JOIN jobs j ON j.namespace = c.namespace AND j.job_id = c.job_id
+                WHERE c.namespace = ? AND c.claim_key = ?
+                """,
+                (namespace, key)
+            ).fetchone()
+            if row is not None:
+                holder, status, updated_at = row
+                if (
+                    status is not None
+                    and status not in FINISHED_STATUSES
+                    and time.time() - updated_at < JOB_CLAIM_TIMEOUT
+                ):
+                    conn.execute("COMMIT")
+                    return holder
+
+            conn.execute(
+                "INSERT OR REPLACE INTO job_claims (namespace, claim_key, job_id) VALUES (?, ?, ?)",
+                (namespace, key, job_id)
+            )
+            conn.execute("COMMIT")
+            return job_id
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, namespace: str, key: str, job_id: str):
+        self._connect().execute(
+            "DELETE FROM job_claims WHERE namespace = ? AND claim_key = ? AND job_id = ?",
+            (namespace, key, job_id)
+        )
+
+    def fail_abandoned(self, namespace: str, fields: Dict[str, Any]) -> int:
+        owner = self.owner
+        return self._fail_unfinished(namespace, fields, lambda job_owner: job_owner == owner)
+
+    def fail_orphaned(self, namespace: str, fields: Dict[str, Any]) -> int:
+        self.owner  # Registers this process first, so a dead process with the same pid counts as gone
+        registered = dict(self._connect().execute("SELECT pid, owner FROM job_owners").fetchall())
+        return self._fail_unfinished(namespace, fields, lambda job_owner: not self._owner_alive(job_owner, registered))
+
+    def _fail_unfinished(self, namespace: str, fields: Dict[str, Any], selected: Callable[[Optional[str]], bool]) -> int:
+        """Fail the unfinished jobs of a namespace whose owner is selected, and drop their claims"""
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"""
+                SELECT job_id, data, owner FROM jobs
+                WHERE namespace = ? AND (status IS NULL OR status NOT IN ({placeholders}))
+                """,
+                (namespace, *FINISHED_STATUSES)
+            ).fetchall()
+            failed = []
+            for job_id, data, owner in rows:
+                if not selected(owner):
+                    continue
+                job = json.loads(data)
+                job.update(fields, status="failed")
+                job["version"] = job.get("version", 0) + 1
+                conn.execute(
+                    "UPDATE jobs SET status = ?, data = ?, updated_at = ? WHERE namespace = ? AND job_id = ?",
+                    ("failed", json.dumps(job), time.time(), namespace, job_id)
+                )
+                conn.execute(
+                    "DELETE FROM job_claims WHERE namespace = ? AND job_id = ?",
+                    (namespace, job_id)
+                )
+                failed.append(job_id)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        for job_id in failed:
+            self.notify(namespace, job_id)
+        if failed:
+            logger.info(f"Failed {len(failed)} unfinished '{namespace}' jobs")
+        return len(failed)
+
+    def _maybe_purge(self):
+        if time.monotonic() - self._last_purge >= _PURGE_INTERVAL:
+            self._last_purge = time.monotonic()
+            self.purge_expired()
+
+
+class JobTable:
+    """The jobs of one router: a JobStore bound to a namespace"""
+
+    def __init__(self, store: JobStore, namespace: str):
+        self.store = store
+        self.namespace = namespace
+
+    def create(self, job_id: str, **data: Any):
+        self.store.create(self.namespace, job_id, data)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(self.namespace, job_id)
+
+    def update(self, job_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        return self.store.update(self.namespace, job_id, fields)
+
+    def delete(self, job_id: str):
+        self.store.delete(self.namespace, job_id)
+
+    def count(self, status: str) -> int:
+        return self.store.count(self.namespace, status)
+
+    def claim(self, key: str, job_id: str) -> str:
+        return self.store.claim(self.namespace, key, job_id)
+
+    def release(self, key: str, job_id: str):
+        self.store.release(self.namespace, key, job_id)
+
+    def fail_abandoned(self, **fields: Any) -> int:
+        return self.store.fail_abandoned(self.namespace, fields)
+
+    def fail_orphaned(self, **fields: Any) -> int:
+        return self.store.fail_orphaned(self.namespace, fields)
+
+    def __contains__(self, job_id: str) -> bool:
+        return self.get(job_id) is not None
+
+    async def wait(self, job_id: str, since: int, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Wait until the job's version exceeds `since`, it finishes, or timeout passes.
+
+        Returns:
+            The current job record (None if unknown)
+        """
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            event = self.store.add_waiter(self.namespace, job_id)
+            try:
+                job = self.get(job_id)
+                remaining = deadline - time.monotonic()
+                if (
+                    job is None
+                    or job.get("version", 0) > since
+                    or job.get("status") in FINISHED_STATUSES
+                    or remaining <= 0
+                ):
+                    return job
+                try:
+                    # Woken by local updates; the interval covers other workers
+                    await asyncio.wait_for(event.wait(), min(remaining, JOB_WATCH_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                self.store.remove_waiter(self.namespace, job_id, event)
+
+
+def create_job_store() -> JobStore:
+    """Build the backend selected by JOB_STORE ("sqlite" or "memory")"""
+    if JOB_STORE == "memory":
+        return MemoryJobStore()
+    try:
+        return SQLiteJobStore(JOB_STORE_PATH)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Could not open job store at {JOB_STORE_PATH} ({e}), keeping jobs in memory")
+        return MemoryJobStore()
+
+
+# Shared application-wide job store
+job_store = create_job_store()
@@ -0,0 +1,319 @@
+"""
+Labelmap Transport
+Binary delivery of decoded segmentation label maps to the viewer.
+
+Metadata (dimensions, spacing, segments) is served separately as a small
+JSON header (see labelmap_header). The voxels are sent in one of these
+encodings (ENCODING_CONTRACTS, repeated in the header); all integers are
+little-endian and every record starts on a 4-byte boundary, so a JavaScript
+client can view the buffer through typed arrays without copying:
+
+- "raw":  uint8 voxels frame after frame (C order of the (slices, rows,
+          columns) array); frame k of a W x H map starts at byte k * W * H.
+- "rle":  per frame, in order: uint32 N, N x uint32 run lengths, N x uint8
+          run values, zero padding to a multiple of 4 bytes. Runs cover the
+          frame in row-major order and their lengths sum to W * H.
+- "bbox": per segment present: uint32 label, 6 x uint32 bounding box
+          [z0, y0, x0, z1, y1, x1) (z relative to the first frame sent),
+          then a bit mask of the box in C order, 1 bit per voxel, least
+          significant bit first, zero padded to a multiple of 4 bytes.
+          Voxels whose bit is set have that label, all others are 0.
+
+Dental label maps are mostly background, so "rle" and "bbox" are a small
+fraction of "raw" (see scripts/benchmark_labelmap_encodings.py).
+
+The body can be compressed with gzip or, if the optional `zstandard` package
+is installed, zstd; compression is applied as Content-Encoding so browsers
+decode it transparently. Uncompressed responses support single byte-range
+requests (Range: bytes=a-b), and any encoding can be limited to a slab of
+frames, so a viewer can fetch the volume progressively.
+"""
+import zlib
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from scipy import ndimage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+# Bytes per chunk of a streamed response
+TRANSPORT_CHUNK_BYTES = 1024 * 1024
+
+IDENTITY = "identity"
+
+# Frames encoded per "rle" chunk (bounds temporaries for large volumes)
+_RLE_CHUNK_FRAMES = 32
+
+ENCODING_CONTRACTS = {
+    "raw": "uint8 voxels frame after frame; frame k of a WxH map starts at byte k*W*H",
+    "rle": (
+        "per frame: uint32 N, N x uint32 run lengths, N x uint8 run values, zero padding to "
+        "a multiple of 4 bytes; runs cover the frame row-major and sum to W*H"
+    ),
+    "bbox": (
+        "per segment: uint32 label, 6 x uint32 box [z0,y0,x0,z1,y1,x1) with z relative to the "
+        "first frame sent, then the box as a C-order bit mask (LSB first), zero padded to a "
+        "multiple of 4 bytes; set bits have the label, all other voxels are 0"
+    ),
+}
+LABELMAP_ENCODINGS = tuple(ENCODING_CONTRACTS)
+
+
+def available_compressions() -> List[str]:
+    """Content-Encodings the server can produce, preferred first"""
+    return (["zstd"] if zstandard is not None else []) + ["gzip", IDENTITY]
+
+
+def _accept_encoding_qualities(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """Coding -> q-value of an Accept-Encoding header (q defaults to 1, malformed q counts as 0)"""
+    qualities = {}
+    for token in (accept_encoding or "").split(","):
+        coding, *params = [part.strip() for part in token.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding.lower()] = q
+    return qualities
+
+
+def negotiate_compression(requested: Optional[str], accept_encoding: Optional[str]) -> str:
+    """
+    Pick the response Content-Encoding.
+
+    An explicit `requested` value wins ("none" means identity); otherwise the
+    available compression with the highest q-value in the client's
+    Accept-Encoding is used (ties go to the server's preference). Codings
+    with q=0 are refused, including through "*;q=0".
+
+    Raises:
+        ValueError: If `requested` is not available
+    """
+    available = available_compressions()
+    if requested:
+        requested = IDENTITY if requested == "none" else requested
+        if requested not in available:
+            raise ValueError(f"Unsupported compression '{requested}', available: {', '.join(available)}")
+        return requested
+
+    qualities = _accept_encoding_qualities(accept_encoding)
+    best, best_q = IDENTITY, 0.0
+    for compression in available:
+        if compression == IDENTITY:
+            continue
+        q = qualities.get(compression, qualities.get("*", 0.0))
+        if q > best_q:
+            best, best_q = compression, q
+    return best
+
+
+def parse_slices(slices: Optional[str], depth: int) -> Tuple[int, int]:
+    """
+    Frame range [start, end) from a "start:end" query value (either side may be empty).
+
+    Raises:
+        ValueError: If the value is malformed or the range is empty
+    """
+    if not slices:
+        return 0, depth
+    try:
+        start_text, end_text = slices.split(":")
+        start = int(start_text) if start_text else 0
+        end = int(end_text) if end_text else depth
+    except ValueError:
+        raise ValueError(f"Invalid slices '{slices}', expected start:end")
+
+    start, end = max(0, start), min(depth, end)
+    if start >= end:
+        raise ValueError(f"Empty slice range {slices} for {depth} slices")
+    return start, end
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Byte range [start, end] (inclusive) of a single-range Range header.
+
+    Returns None when there is no usable Range header (absent, not bytes, or
+    several ranges), in which case the whole body is sent.
+
+    Raises:
+        ValueError: If the range cannot be satisfied (416)
+    """
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+
+    start_text, _, end_text = spec.partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, size - int(end_text))
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise ValueError(f"Range {spec} not satisfiable for {size} bytes")
+    return start, min(end, size - 1)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches an ETag (weak comparison)"""
+    if not if_none_match:
+        return False
+    candidates = [token.strip() for token in if_none_match.split(",")]
+    return "*" in candidates or etag in [c[2:] if c.startswith("W/") else c for c in candidates]
+
+
+def iter_bytes(data: np.ndarray, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """Chunks of the raw bytes [start, end) of an array, without copying it whole"""
+    view = memoryview(np.ascontiguousarray(data)).cast("B")
+    end = len(view) if end is None else end
+    for offset in range(start, end, TRANSPORT_CHUNK_BYTES):
+        yield bytes(view[offset:min(end, offset + TRANSPORT_CHUNK_BYTES)])
+
+
+def _pad4(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 4)
+
+
+def iter_rle(labelmap: np.ndarray) -> Iterator[bytes]:
+    """Encode frames as "rle" records, a chunk of frames at a time"""
+    depth = labelmap.shape[0]
+    frame_size = int(np.prod(labelmap.shape[1:]))
+
+    for start in range(0, depth, _RLE_CHUNK_FRAMES):
+        block = np.ascontiguousarray(labelmap[start:start + _RLE_CHUNK_FRAMES])
+        frames = block.shape[0]
+        flat = block.ravel()
+
+        # Runs start where the value changes or a new frame begins
+        boundaries = np.zeros(flat.size, dtype=bool)
+        boundaries[0] = True
+        boundaries[1:] = flat[1:] != flat[:-1]
+        boundaries[::frame_size] = True
+        run_starts = np.flatnonzero(boundaries)
+        run_lengths = np.diff(np.append(run_starts, flat.size)).astype("<u4")
+        run_values = flat[run_starts]
+        runs_per_frame = np.bincount(run_starts // frame_size, minlength=frames)
+
+        out = []
+        offset = 0
+        for count in runs_per_frame.tolist():
+            out.append(np.uint32(count).astype("<u4").tobytes())
+            out.append(run_lengths[offset:offset + count].tobytes())
+            out.append(_pad4(run_values[offset:offset + count].tobytes()))
+            offset += count
+        yield b"".join(out)
+
+
+def iter_bbox(labelmap: np.ndarray) -> Iterator[bytes]:
+    """Encode a label map as "bbox" records, one per segment present"""
+    for index, box in enumerate(ndimage.find_objects(labelmap)):
+        if box is None:
+            continue
+        label = index + 1
+        mask = labelmap[box] == label
+        corners = [s.start for s in box] + [s.stop for s in box]
+        header = np.asarray([label] + corners, dtype="<u4").tobytes()
+        yield header + _pad4(np.packbits(mask, axis=None, bitorder="little").tobytes())
+
+
+def iter_encoded(labelmap: np.ndarray, encoding: str) -> Iterator[bytes]:
+    """Chunks of a label map in one of LABELMAP_ENCODINGS"""
+    if encoding == "rle":
+        return iter_rle(labelmap)
+    if encoding == "bbox":
+        return iter_bbox(labelmap)
+    return iter_bytes(labelmap)
+
+
+def decode_rle(data: bytes, shape: Tuple[int, int, int]) -> np.ndarray:
+    """Reference decoder for "rle" (the viewer implements the same contract)"""
+    depth, height, width = shape
+    out = np.empty(shape, dtype=np.uint8)
+    offset = 0
+    for k in range(depth):
+        count = int(np.frombuffer(data, "<u4", 1, offset)[0])
+        lengths = np.frombuffer(data, "<u4", count, offset + 4)
+        values = np.frombuffer(data, np.uint8, count, offset + 4 + 4 * count)
+        out[k] = np.repeat(values, lengths).reshape(height, width)
+        offset += 4 + 4 * count + count + (-count % 4)
+    return out
+
+
+def decode_bbox(data: bytes, shape: Tuple[int, int, int]) -> np.ndarray:
+    """Reference decoder for "bbox" (the viewer implements the same contract)"""
+    out = np.zeros(shape, dtype=np.uint8)
+    offset = 0
+    while offset < len(data):
+        label, z0, y0, x0, z1, y1, x1 = np.frombuffer(data, "<u4", 7, offset).tolist()
+        box_shape = (z1 - z0, y1 - y0, x1 - x0)
+        voxels = box_shape[0] * box_shape[1] * box_shape[2]
+        packed = np.frombuffer(data, np.uint8, (voxels + 7) // 8, offset + 28)
+        mask = np.unpackbits(packed, count=voxels, bitorder="little").astype(bool).reshape(box_shape)
+        out[z0:z1, y0:y1, x0:x1][mask] = label
+        offset += 28 + len(packed) + (-len(packed) % 4)
+    return out
+
+
+def iter_compressed(chunks: Iterator[bytes], compression: str) -> Iterator[bytes]:
+    """Compress a stream of chunks incrementally (identity passes them through)"""
+    if compression == IDENTITY:
+        yield from chunks
+        return
+
+    if compression == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    else:
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def labelmap_header(
+    labelmap: np.ndarray,
+    geometry: Dict[str, Any],
+    segments: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    JSON header describing a label map sent by the binary endpoint,
+    including the decoding contract of each encoding.
+
+    `spacing` is [PixelSpacing row, PixelSpacing column, slice], as in the
+    JSON /get-labelmap response.
+    """
+    depth, height, width = labelmap.shape
+    slice_spacing, row_spacing, col_spacing = geometry["spacing"]
+    return {
+        "dimensions": [width, height, depth],
+        "spacing": [float(row_spacing), float(col_spacing), float(slice_spacing)],
+        "origin": [float(v) for v in geometry["origin"]],
+        "segments": segments,
+        "dtype": "uint8",
+        "frameBytes": width * height,
+        "totalBytes": width * height * depth,
+        "encodings": ENCODING_CONTRACTS,
+        "compressions": available_compressions(),
+    }
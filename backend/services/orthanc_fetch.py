@@ -0,0 +1,317 @@
+"""
+Orthanc Series Fetching
+Downloads the instances of a series from Orthanc, either in bulk or per instance.
+
+Bulk mode streams GET /series/{id}/archive (one ZIP for the whole series) and
+decodes the ZIP members incrementally as the bytes arrive, so nothing has to be
+written to disk and there is one request per series instead of one per slice.
+If the archive cannot be used, the instances are fetched one by one with
+bounded concurrency and per-instance retries.
+"""
+import os
+import struct
+import zlib
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+import httpx
+
+from services.http_clients import get_orthanc_client
+
+logger = logging.getLogger(__name__)
+
+# Fetch tuning
+ORTHANC_BULK_FETCH = os.getenv("ORTHANC_BULK_FETCH", "true").lower() in ("1", "true", "yes")
+ORTHANC_FETCH_CONCURRENCY = int(os.getenv("ORTHANC_FETCH_CONCURRENCY", "8"))
+ORTHANC_FETCH_RETRIES = int(os.getenv("ORTHANC_FETCH_RETRIES", "3"))
+ORTHANC_FETCH_BACKOFF = float(os.getenv("ORTHANC_FETCH_BACKOFF", "0.5"))  # seconds, doubled per retry
+
+# ZIP record signatures
+_LOCAL_HEADER_SIG = b"PK\x03\x04"
+_DATA_DESCRIPTOR_SIG = b"PK\x07\x08"
+_END_SIGS = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06", b"PK\x06\x07")
+_ZIP64_EXTRA_ID = 0x0001
+
+# Called with (index, instance bytes). Indices run from 0 to N-1
+InstanceCallback = Callable[[int, bytes], None]
+ProgressCallback = Callable[[int, int], None]
+# Called to discard everything delivered so far (before a fallback fetch)
+ResetCallback = Callable[[], None]
+
+
+class ArchiveFormatError(Exception):
+    """The archive stream could not be decoded incrementally"""
+
+
+class _StreamReader:
+    """Buffered reader over an async iterator of byte chunks"""
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks.__aiter__()
+        self._buf = bytearray()
+
+    async def _fill(self) -> bool:
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return False
+        self._buf += chunk
+        return True
+
+    async def read_exact(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            if not await self._fill():
+                raise ArchiveFormatError("Unexpected end of archive stream")
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+    async def read_chunk(self) -> bytes:
+        """Return whatever is buffered, or the next chunk from the stream"""
+        if not self._buf and not await self._fill():
+            raise ArchiveFormatError("Unexpected end of archive stream")
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+    def unread(self, data: bytes):
+        self._buf[:0] = data
+
+
+def _parse_zip64_extra(extra: bytes, csize: int, usize: int) -> Tuple[int, int, bool]:
+    """Read 64-bit sizes from the ZIP64 extra field, if present"""
+    pos = 0
+    while pos + 4 <= len(extra):
+        field_id, field_len = struct.unpack("<HH", extra[pos:pos + 4])
+        body = extra[pos + 4:pos + 4 + field_len]
+        if field_id == _ZIP64_EXTRA_ID:
+            values = [struct.unpack("<Q", body[i:i + 8])[0] for i in range(0, len(body) - 7, 8)]
+            if usize == 0xFFFFFFFF and values:
+                usize = values.pop(0)
+            if csize == 0xFFFFFFFF and values:
+                csize = values.pop(0)
+            return csize, usize, True
+        pos += 4 + field_len
+    return csize, usize, False
+
+
+async def iter_zip_members(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[str, bytes]]:
+    """
+    Decode a ZIP archive from a forward-only byte stream.
+
+    Walks the local file headers in order and yields (name, data) for each file
+    member as soon as it is complete, without needing the central directory.
+    Handles stored/deflated members, data descriptors and ZIP64 sizes.
+
+    Raises:
+        ArchiveFormatError: if the stream is truncated or corrupt, or uses an
+            unsupported feature
+    """
+    try:
+        async for member in _decode_zip_stream(chunks):
+            yield member
+    except (zlib.error, struct.error) as e:
+        # Corrupt deflate data or headers; callers only expect ArchiveFormatError
+        raise ArchiveFormatError(f"Corrupt ZIP archive: {e}") from e
+
+
+async def _decode_zip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[str, bytes]]:
+    """iter_zip_members without the wrapping of zlib/struct errors"""
+    reader = _StreamReader(chunks)
+
+    while True:
+        sig = await reader.read_exact(4)
+        if sig in _END_SIGS:
+            return
+        if sig != _LOCAL_HEADER_SIG:
+            raise ArchiveFormatError(f"Unexpected ZIP record signature {sig!r}")
+
+        (_, flags, method, _, _, crc, csize, usize, name_len, extra_len) = struct.unpack(
+            "<HHHHHIIIHH", await reader.read_exact(26)
+        )
+        name = (await reader.read_exact(name_len)).decode("utf-8", "replace")
+        extra = await reader.read_exact(extra_len)
+        csize, usize, zip64 = _parse_zip64_extra(extra, csize, usize)
+
+        if flags & 0x01:
+            raise ArchiveFormatError(f"Encrypted ZIP member: {name}")
+        if method not in (0, 8):
+            raise ArchiveFormatError(f"Unsupported ZIP compression method {method}: {name}")
+
+        if not flags & 0x08:
+            # Sizes are known up front
+            raw = await reader.read_exact(csize)
+            data = zlib.decompress(raw, -15) if method == 8 else raw
+        else:
+            # Sizes follow the data; only deflate streams are self-terminating
+            if method != 8:
+                raise ArchiveFormatError(f"Stored ZIP member with data descriptor: {name}")
+
+            decompressor = zlib.decompressobj(-15)
+            parts = []
+            consumed = 0
+            while not decompressor.eof:
+                chunk = await reader.read_chunk()
+                parts.append(decompressor.decompress(chunk))
+                if decompressor.eof:
+                    unused = decompressor.unused_data
+                    reader.unread(unused)
+                    consumed += len(chunk) - len(unused)
+                else:
+                    consumed += len(chunk)
+            data = b"".join(parts)
+
+            # Data descriptor: [signature] crc32, compressed size, uncompressed size
+            head = await reader.read_exact(4)
+            if head == _DATA_DESCRIPTOR_SIG:
+                head = await reader.read_exact(4)
+            crc = struct.unpack("<I", head)[0]
+
+            sizes = await reader.read_exact(8)
+            c32, u32 = struct.unpack("<II", sizes)
+            if zip64 or c32 != (consumed & 0xFFFFFFFF) or u32 != (len(data) & 0xFFFFFFFF):
+                # 64-bit sizes
+                sizes += await reader.read_exact(8)
+
+        if zlib.crc32(data) != crc:
+            raise ArchiveFormatError(f"CRC mismatch in ZIP member: {name}")
+
+        if not name.endswith("/"):
+            yield name, data
+
+
+async def iter_series_archive(orthanc_series_id: str) -> AsyncIterator[Tuple[str, bytes]]:
+    """Stream /series/{id}/archive from Orthanc and yield (name, data) per DICOM file"""
+    client = get_orthanc_client()
+
+    async with client.stream("GET", f"/series/{orthanc_series_id}/archive") as response:
+        if response.status_code != 200:
+            raise ArchiveFormatError(f"Archive request failed: {response.status_code}")
+
+        async for name, data in iter_zip_members(response.aiter_bytes()):
+            if name.upper().endswith("DICOMDIR"):
+                continue
+            yield name, data
+
+
+async def download_instance_with_retry(
+    client: httpx.AsyncClient,
+    instance_id: str
+) -> Optional[bytes]:
+    """
+    Download a single DICOM instance from Orthanc.
+
+    Retries connection errors, 429 and 5xx responses with exponential backoff.
+    Other HTTP errors (e.g. 404) fail immediately.
+
+    Returns:
+        The DICOM file bytes, or None if the instance could not be downloaded
+    """
+    for attempt in range(ORTHANC_FETCH_RETRIES + 1):
+        try:
+            resp = await client.get(f"/instances/{instance_id}/file")
+
+            if resp.status_code == 200:
+                return resp.content
+
+            if resp.status_code != 429 and resp.status_code < 500:
+                logger.warning(f"Failed to download instance {instance_id}: {resp.status_code}")
+                return None
+
+            logger.warning(f"Instance {instance_id} returned {resp.status_code} (attempt {attempt + 1})")
+        except httpx.RequestError as e:
+            logger.warning(f"Instance {instance_id} request error (attempt {attempt + 1}): {e}")
+
+        if attempt < ORTHANC_FETCH_RETRIES:
+            await asyncio.sleep(ORTHANC_FETCH_BACKOFF * (2 ** attempt))
+
+    logger.warning(f"Giving up on instance {instance_id} after {ORTHANC_FETCH_RETRIES + 1} attempts")
+    return None
+
+
+async def fetch_instances(
+    instance_ids: List[str],
+    on_instance: InstanceCallback,
+    on_progress: Optional[ProgressCallback] = None
+) -> int:
+    """
+    Download instances one by one, ORTHANC_FETCH_CONCURRENCY at a time.
+
+    Returns:
+        Number of instances downloaded successfully
+    """
+    client = get_orthanc_client()
+    total = len(instance_ids)
+    semaphore = asyncio.Semaphore(max(1, ORTHANC_FETCH_CONCURRENCY))
+    completed = 0
+
+    async def fetch_one(index: int, instance_id: str) -> bool:
+        nonlocal completed
+        async with semaphore:
+            data = await download_instance_with_retry(client, instance_id)
+        if data is not None:
+            on_instance(index, data)
+        completed += 1
+        if on_progress:
+            on_progress(completed, total)
+        return data is not None
+
+    logger.info(f"Downloading {total} DICOM instances ({ORTHANC_FETCH_CONCURRENCY} in flight)...")
+    results = await asyncio.gather(
+        *(fetch_one(i, instance_id) for i, instance_id in enumerate(instance_ids))
+    )
+
+    failed = results.count(False)
+    if failed:
+        logger.warning(f"{failed} of {total} instances could not be downloaded")
+    return total - failed
+
+
+async def fetch_series(
+    orthanc_series_id: str,
+    instance_ids: List[str],
+    on_instance: InstanceCallback,
+    on_progress: Optional[ProgressCallback] = None,
+    on_reset: Optional[ResetCallback] = None
+) -> int:
+    """
+    Download every instance of a series, preferring the bulk archive.
+
+    Archive members are numbered in archive order, which is not the order of
+    `instance_ids`, so when the archive fails part way the instances it
+    delivered are discarded through `on_reset` before the per-instance
+    fallback numbers them again.
+
+    Args:
+        orthanc_series_id: Orthanc ID of the series
+        instance_ids: Orthanc IDs of its instances (used for the per-instance fallback)
+        on_instance: Called with (index, bytes) for each instance
+        on_progress: Called with (done, total) as instances arrive
+        on_reset: Called before falling back if the archive delivered anything;
+            must discard everything on_instance stored
+
+    Returns:
+        Number of instances delivered
+    """
+    total = len(instance_ids)
+
+    if ORTHANC_BULK_FETCH:
+        count = 0
+        try:
+            async for _, data in iter_series_archive(orthanc_series_id):
+                on_instance(count, data)
+                count += 1
+                if on_progress:
+                    on_progress(count, max(total, count))
+
+            if count:
+                logger.info(f"Fetched {count} instances via series archive")
+                return count
+            logger.warning("Series archive was empty, falling back to per-instance fetch")
+        except (ArchiveFormatError, httpx.HTTPError) as e:
+            logger.warning(f"Series archive fetch failed after {count} files ({e}), falling back to per-instance fetch")
+            if count and on_reset:
+                on_reset()
+
+    return await fetch_instances(instance_ids, on_instance, on_progress)
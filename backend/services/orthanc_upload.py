@@ -0,0 +1,88 @@
+"""
+Orthanc Instance Upload
+Streams a DICOM file to Orthanc's POST /instances without loading it into memory.
+
+Writers serialize instances (e.g. a DICOM SEG) to a spooled temporary file
+(see spool_file); upload_instance then sends it in fixed-size chunks with an
+explicit Content-Length, so the upload stage holds one chunk at a time
+instead of extra full copies of the file. Connection errors, 429 and 5xx
+responses are retried with exponential backoff, restarting from the start of
+the file.
+"""
+import os
+import asyncio
+import logging
+import tempfile
+from typing import Any, AsyncIterator, BinaryIO, Dict, Optional
+
+import httpx
+
+from services.http_clients import get_orthanc_client
+
+logger = logging.getLogger(__name__)
+
+# Upload tuning
+ORTHANC_UPLOAD_CHUNK_SIZE = int(os.getenv("ORTHANC_UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+ORTHANC_UPLOAD_RETRIES = int(os.getenv("ORTHANC_UPLOAD_RETRIES", "3"))
+ORTHANC_UPLOAD_BACKOFF = float(os.getenv("ORTHANC_UPLOAD_BACKOFF", "0.5"))  # seconds, doubled per retry
+
+# Spooled files larger than this are moved from memory to a temp file on disk
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+def spool_file() -> BinaryIO:
+    """Temporary file to serialize an instance into (kept in memory while small)"""
+    return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES, prefix="voxel3di_upload_")
+
+
+def file_size(fileobj: BinaryIO) -> int:
+    """Size of a seekable file object (leaves it positioned at the end)"""
+    return fileobj.seek(0, os.SEEK_END)
+
+
+async def iter_file_chunks(fileobj: BinaryIO, chunk_size: int = ORTHANC_UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Read a file from its start in chunks; reads run in a thread once spooled to disk"""
+    fileobj.seek(0)
+    while True:
+        chunk = await asyncio.to_thread(fileobj.read, chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def upload_instance(fileobj: BinaryIO, description: str = "instance") -> Optional[Dict[str, Any]]:
+    """
+    Upload a DICOM file to Orthanc (POST /instances), streaming it in chunks.
+
+    Args:
+        fileobj: Seekable file object holding the DICOM file
+        description: Used in log messages
+
+    Returns:
+        Orthanc's response (ID, ParentSeries, ...), or None if the upload failed
+    """
+    client = get_orthanc_client()
+    size = file_size(fileobj)
+    headers = {"Content-Type": "application/dicom", "Content-Length": str(size)}
+
+    for attempt in range(ORTHANC_UPLOAD_RETRIES + 1):
+        try:
+            resp = await client.post("/instances", content=iter_file_chunks(fileobj), headers=headers)
+
+            if resp.status_code == 200:
+                logger.info(f"Uploaded {description} to Orthanc ({size / 1e6:.1f} MB)")
+                return resp.json()
+
+            if resp.status_code != 429 and resp.status_code < 500:
+                logger.error(f"Orthanc rejected {description}: {resp.status_code} {resp.text}")
+                return None
+
+            logger.warning(f"Upload of {description} returned {resp.status_code} (attempt {attempt + 1})")
+        except httpx.RequestError as e:
+            logger.warning(f"Upload of {description} failed (attempt {attempt + 1}): {e}")
+
+        if attempt < ORTHANC_UPLOAD_RETRIES:
+            await asyncio.sleep(ORTHANC_UPLOAD_BACKOFF * (2 ** attempt))
+
+    logger.error(f"Giving up on uploading {description} after {ORTHANC_UPLOAD_RETRIES + 1} attempts")
+    return None
@@ -0,0 +1,207 @@
+"""
+Segmentation Result Cache
+Persistent mapping from a segmentation request to the DICOM SEG it produced.
+
+Entries are keyed by (source SeriesInstanceUID, model fingerprint, inference
+parameters) and remember the source series version (see
+volume_cache.series_version) they were computed from. A lookup only hits if
+the source series is unchanged, so re-opening an old case returns the stored
+SEG instead of running nnU-Net again, while a modified series or a new model
+is segmented afresh.
+
+The cache is a SQLite file shared by all uvicorn workers. If it cannot be
+opened (e.g. RESULT_CACHE_PATH is not writable), results are kept in memory
+for the life of the process instead, as the job store does.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "/tmp/voxel3di_results.sqlite3")
+
+
+def params_key(params: Dict[str, Any]) -> str:
+    """Canonical string form of inference parameters"""
+    return json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+
+class SegmentationResultCache:
+    """SQLite-backed (source, model, params) -> SEG SeriesInstanceUID map"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().execute(
+            """
+            CREATE TABLE IF NOT EXISTS segmentation_results (
+                source_uid TEXT NOT NULL,
+                model_fingerprint TEXT NOT NULL,
+                params TEXT NOT NULL,
+                source_version TEXT NOT NULL,
+                seg_uid TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (source_uid, model_fingerprint, params)
+            )
+            """
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread (and per process after a fork)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(
+        self,
+        source_uid: str,
+        model_fingerprint: str,
+        params: Dict[str, Any],
+        source_version: str
+    ) -> Optional[str]:
+        """
+        Look up the SEG computed for a request.
+
+        Returns:
+            SEG SeriesInstanceUID, or None on a miss or if the source changed
+        """
+        row = self._connect().execute(
+            """
+            SELECT seg_uid, source_version FROM segmentation_results
+            WHERE source_uid = ? AND model_fingerprint = ? AND params = ?
+            """,
+            (source_uid, model_fingerprint, params_key(params))
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        seg_uid, cached_version = row
+        if cached_version != source_version:
+            logger.info(f"Cached segmentation of {source_uid} is stale (series changed), discarding")
+            self.invalidate(source_uid, model_fingerprint, params)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return seg_uid
+
+    def put(
+        self,
+        source_uid: str,
+        model_fingerprint: str,
+        params: Dict[str, Any],
+        source_version: str,
+        seg_uid: str
+    ):
+        self._connect().execute(
+            """
+            INSERT OR REPLACE INTO segmentation_results
+                (source_uid, model_fingerprint, params, source_version, seg_uid, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (source_uid, model_fingerprint, params_key(params), source_version, seg_uid, time.time())
+        )
+
+    def invalidate(self, source_uid: str, model_fingerprint: str, params: Dict[str, Any]):
+        self._connect().execute(
+            """
+            DELETE FROM segmentation_results
+            WHERE source_uid = ? AND model_fingerprint = ? AND params = ?
+            """,
+            (source_uid, model_fingerprint, params_key(params))
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        row = self._connect().execute("SELECT COUNT(*) FROM segmentation_results").fetchone()
+        return {
+            "path": self.path,
+            "entries": row[0],
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class MemorySegmentationResultCache:
+    """In-process (source, model, params) -> SEG SeriesInstanceUID map (same interface)"""
+
+    def __init__(self):
+        self.path = ":memory:"
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[str, str, str], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        source_uid: str,
+        model_fingerprint: str,
+        params: Dict[str, Any],
+        source_version: str
+    ) -> Optional[str]:
+        key = (source_uid, model_fingerprint, params_key(params))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            cached_version, seg_uid = entry
+            if cached_version != source_version:
+                logger.info(f"Cached segmentation of {source_uid} is stale (series changed), discarding")
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return seg_uid
+
+    def put(
+        self,
+        source_uid: str,
+        model_fingerprint: str,
+        params: Dict[str, Any],
+        source_version: str,
+        seg_uid: str
+    ):
+        with self._lock:
+            self._entries[(source_uid, model_fingerprint, params_key(params))] = (source_version, seg_uid)
+
+    def invalidate(self, source_uid: str, model_fingerprint: str, params: Dict[str, Any]):
+        with self._lock:
+            self._entries.pop((source_uid, model_fingerprint, params_key(params)), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "path": self.path,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def create_result_cache():
+    """Open the SQLite result cache, falling back to memory if it cannot be opened"""
+    try:
+        return SegmentationResultCache(RESULT_CACHE_PATH)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Could not open result cache at {RESULT_CACHE_PATH} ({e}), keeping results in memory")
+        return MemorySegmentationResultCache()
+
+
+# Shared application-wide result cache
+segmentation_results = create_result_cache()
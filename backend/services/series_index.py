@@ -0,0 +1,220 @@
+"""
+Orthanc Series Index
+Local SeriesInstanceUID -> Orthanc series lookup table.
+
+The index is built once from paged GET /series?expand requests and then kept
+current by replaying Orthanc's /changes feed, so lookups by UID, modality or
+size no longer cost one GET /series/{id} per series in the PACS. A full
+rebuild runs every SERIES_INDEX_REBUILD_INTERVAL seconds as a safety net for
+changes the feed does not report (e.g. deleted instances).
+
+Entries are dicts:
+    {"orthanc_id", "series_uid", "modality", "instances", "last_update", "study_id"}
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Any
+
+from services.http_clients import get_orthanc_client
+
+logger = logging.getLogger(__name__)
+
+SERIES_INDEX_REFRESH_INTERVAL = float(os.getenv("SERIES_INDEX_REFRESH_INTERVAL", "2"))  # seconds
+SERIES_INDEX_REBUILD_INTERVAL = float(os.getenv("SERIES_INDEX_REBUILD_INTERVAL", "3600"))  # seconds
+SERIES_INDEX_PAGE_SIZE = int(os.getenv("SERIES_INDEX_PAGE_SIZE", "1000"))
+
+# Concurrent GET /series/{id} requests when applying changes
+_REFRESH_CONCURRENCY = 8
+
+
+def _entry_from_series(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Build an index entry from an Orthanc /series/{id} response"""
+    tags = info.get("MainDicomTags", {})
+    return {
+        "orthanc_id": info["ID"],
+        "series_uid": tags.get("SeriesInstanceUID", ""),
+        "modality": tags.get("Modality", ""),
+        "instances": len(info.get("Instances", [])),
+        "last_update": info.get("LastUpdate", ""),
+        "study_id": info.get("ParentStudy"),
+    }
+
+
+class SeriesIndex:
+    """In-memory index of the series stored in Orthanc"""
+
+    def __init__(self):
+        self._by_uid: Dict[str, Dict[str, Any]] = {}
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._last_change: Optional[int] = None
+        self._last_refresh = 0.0
+        self._last_build = 0.0
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def _put(self, entry: Dict[str, Any]):
+        self._remove(entry["orthanc_id"])
+        self._by_id[entry["orthanc_id"]] = entry
+        if entry["series_uid"]:
+            self._by_uid[entry["series_uid"]] = entry
+
+    def _remove(self, orthanc_id: str):
+        old = self._by_id.pop(orthanc_id, None)
+        if old and self._by_uid.get(old["series_uid"]) is old:
+            del self._by_uid[old["series_uid"]]
+
+    async def _build(self):
+        """(Re)build the whole index with paged expanded series listings"""
+        client = get_orthanc_client()
+
+        # Remember the change sequence first so nothing slips through during the build
+        response = await client.get("/changes", params={"last": ""})
+        response.raise_for_status()
+        last_change = response.json().get("Last", 0)
+
+        by_id: Dict[str, Dict[str, Any]] = {}
+        since = 0
+        while True:
+            response = await client.get(
+                "/series",
+                params={"expand": "", "since": since, "limit": SERIES_INDEX_PAGE_SIZE}
+            )
+            response.raise_for_status()
+            page = response.json()
+            for info in page:
+                by_id[info["ID"]] = _entry_from_series(info)
+            if len(page) < SERIES_INDEX_PAGE_SIZE:
+                break
+            since += len(page)
+
+        self._by_id = {}
+        self._by_uid = {}
+        for entry in by_id.values():
+            self._put(entry)
+
+        self._last_change = last_change
+        self._last_build = time.monotonic()
+        logger.info(f"Series index built: {len(self._by_id)} series (change sequence {last_change})")
+
+    async def _apply_changes(self):
+        """Replay /changes since the last seen sequence number"""
+        client = get_orthanc_client()
+        changed: Dict[str, bool] = {}  # orthanc_id -> deleted
+
+        while True:
+            response = await client.get(
+                "/changes",
+                params={"since": self._last_change, "limit": SERIES_INDEX_PAGE_SIZE}
+            )
+            response.raise_for_status()
+            result = response.json()
+
+            for change in result.get("Changes", []):
+                if change.get("ResourceType") == "Series":
+                    changed[change["ID"]] = change.get("ChangeType") == "Deleted"
+
+            self._last_change = result.get("Last", self._last_change)
+            if result.get("Done", True):
+                break
+
+        if not changed:
+            return
+
+        semaphore = asyncio.Semaphore(_REFRESH_CONCURRENCY)
+
+        async def refresh_one(orthanc_id: str):
+            async with semaphore:
+                response = await client.get(f"/series/{orthanc_id}")
+            if response.status_code == 200:
+                self._put(_entry_from_series(response.json()))
+            elif response.status_code == 404:
+                self._remove(orthanc_id)
+
+        for orthanc_id in [sid for sid, deleted in changed.items() if deleted]:
+            self._remove(orthanc_id)
+        await asyncio.gather(*(refresh_one(sid) for sid, deleted in changed.items() if not deleted))
+
+        logger.debug(f"Series index applied {len(changed)} series changes")
+
+    async def refresh(self, force: bool = False):
+        """
+        Bring the index up to date.
+
+        Builds the index on first use, rebuilds it periodically, and otherwise
+        applies the /changes feed at most every SERIES_INDEX_REFRESH_INTERVAL seconds.
+        """
+        async with self._lock:
+            now = time.monotonic()
+            if self._last_change is None or now - self._last_build >= SERIES_INDEX_REBUILD_INTERVAL:
+                await self._build()
+            elif force or now - self._last_refresh >= SERIES_INDEX_REFRESH_INTERVAL:
+                await self._apply_changes()
+            self._last_refresh = time.monotonic()
+
+    def invalidate(self, orthanc_id: str):
+        """Drop an entry that turned out to be stale (e.g. Orthanc returned 404)"""
+        self._remove(orthanc_id)
+
+    async def get(self, series_uid: str) -> Optional[Dict[str, Any]]:
+        """Exact lookup by SeriesInstanceUID"""
+        await self.refresh()
+        return self._by_uid.get(series_uid)
+
+    async def resolve(self, series_uid: str) -> Optional[Dict[str, Any]]:
+        """
+        Exact lookup by SeriesInstanceUID, falling back to Orthanc's /tools/find.
+
+        The fallback covers a series stored after the last refresh, or Orthanc
+        being unreachable for /changes; found series are added to the index.
+        """
+        try:
+            entry = await self.get(series_uid)
+            if entry:
+                return entry
+        except Exception as e:
+            logger.warning(f"Series index refresh failed: {e}")
+
+        client = get_orthanc_client()
+        response = await client.post(
+            "/tools/find",
+            json={
+                "Level": "Series",
+                "Query": {"SeriesInstanceUID": series_uid},
+                "Expand": True
+            }
+        )
+        if response.status_code != 200 or not response.json():
+            return None
+
+        entry = _entry_from_series(response.json()[0])
+        self._put(entry)
+        return entry
+
+    async def find_partial(self, series_uid: str) -> Optional[Dict[str, Any]]:
+        """Find a series whose UID contains the given (possibly truncated) UID"""
+        await self.refresh()
+        for entry in self._by_id.values():
+            if series_uid and series_uid in entry["series_uid"]:
+                return entry
+        return None
+
+    async def list_series(self, modality: Optional[str] = None) -> List[Dict[str, Any]]:
+        """All indexed series, optionally filtered by modality"""
+        await self.refresh()
+        return [
+            entry for entry in self._by_id.values()
+            if modality is None or entry["modality"] == modality
+        ]
+
+    async def largest_series(self, modality: str = "CT") -> Optional[Dict[str, Any]]:
+        """The series of the given modality with the most instances"""
+        candidates = await self.list_series(modality)
+        return max(candidates, key=lambda e: e["instances"], default=None)
+
+
+# Shared application-wide index
+series_index = SeriesIndex()
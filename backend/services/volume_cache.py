@@ -0,0 +1,207 @@
+"""
+Volume Cache
+On-disk and in-memory caches of decoded volumes keyed by SeriesInstanceUID:
+CBCT series, the label maps decoded from DICOM SEG series, and the mesh
+files exported from them.
+
+Each entry is a directory named after a hash of the key, holding the assembled
+volume as a memory-mappable .npy file plus a meta.json with the geometry
+metadata and a version token. The version token (Orthanc's LastUpdate and
+instance count for the series) is checked on every read, so a series that
+changed in Orthanc is re-fetched. Total size is bounded by LRU eviction.
+
+The in-memory cache sits in front of it for interactive workflows (detect
+arch, generate, regenerate after a curve edit) and keeps ready-to-use arrays
+within a byte budget shared by all jobs in the process.
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VOLUME_CACHE_DIR = os.getenv("VOLUME_CACHE_DIR", "/tmp/voxel3di_volume_cache")
+VOLUME_CACHE_MAX_GB = float(os.getenv("VOLUME_CACHE_MAX_GB", "20"))
+HOT_VOLUME_CACHE_MB = float(os.getenv("HOT_VOLUME_CACHE_MB", "2048"))
+
+LABELMAP_CACHE_DIR = os.getenv("LABELMAP_CACHE_DIR", "/tmp/voxel3di_labelmap_cache")
+LABELMAP_CACHE_MAX_GB = float(os.getenv("LABELMAP_CACHE_MAX_GB", "5"))
+HOT_LABELMAP_CACHE_MB = float(os.getenv("HOT_LABELMAP_CACHE_MB", "512"))
+
+MESH_CACHE_DIR = os.getenv("MESH_CACHE_DIR", "/tmp/voxel3di_mesh_cache")
+MESH_CACHE_MAX_GB = float(os.getenv("MESH_CACHE_MAX_GB", "2"))
+
+_VOLUME_FILE = "volume.npy"
+_META_FILE = "meta.json"
+
+
+def series_version(entry: Dict[str, Any]) -> str:
+    """Version token for a series index entry (changes whenever the series does)"""
+    return f"{entry.get('last_update', '')}/{entry.get('instances', 0)}"
+
+
+class DiskVolumeCache:
+    """Size-bounded LRU cache of numpy arrays and their metadata on disk"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, version: str) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        """
+        Look up a cached volume.
+
+        Returns:
+            (read-only memory-mapped array, metadata) or None on a miss or stale entry
+        """
+        entry_dir = self._entry_dir(key)
+        meta_path = entry_dir / _META_FILE
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("key") != key or meta.get("version") != version:
+                logger.info(f"Volume cache entry for {key} is stale, discarding")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                self.misses += 1
+                return None
+
+            array = np.load(entry_dir / _VOLUME_FILE, mmap_mode="r")
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # Access time drives LRU eviction
+        os.utime(meta_path)
+        self.hits += 1
+        return array, meta.get("metadata", {})
+
+    def put(self, key: str, version: str, array: np.ndarray, metadata: Dict[str, Any]):
+        """Store a volume (written to a temp dir and renamed into place), then evict"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        entry_dir = self._entry_dir(key)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=".tmp_", dir=self.root))
+
+        try:
+            np.save(tmp_dir / _VOLUME_FILE, np.ascontiguousarray(array))
+            with open(tmp_dir / _META_FILE, "w") as f:
+                json.dump({"key": key, "version": version, "metadata": metadata}, f)
+
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            logger.warning(f"Could not write volume cache entry for {key}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for entry_dir in self.root.iterdir():
+            if not entry_dir.is_dir() or entry_dir.name.startswith(".tmp_"):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in entry_dir.iterdir())
+                last_used = (entry_dir / _META_FILE).stat().st_mtime
+            except OSError:
+                continue
+            entries.append((last_used, size, entry_dir))
+            total += size
+
+        for last_used, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted volume cache entry {entry_dir.name} ({size / 1e6:.0f} MB)")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.root),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class MemoryVolumeCache:
+    """
+    Byte-budgeted in-process LRU of numpy arrays.
+
+    Cached arrays are shared between jobs and marked read-only.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[str, np.ndarray, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, version: str) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key: str, version: str, array: np.ndarray, metadata: Dict[str, Any]):
+        if array.nbytes > self.max_bytes:
+            return
+        array.flags.writeable = False
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1].nbytes
+            self._entries[key] = (version, array, metadata)
+            self._bytes += array.nbytes
+
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Shared cache of decoded CBCT series (panoramic stacks and segmentation sources, under different keys)
+volume_cache = DiskVolumeCache(VOLUME_CACHE_DIR, int(VOLUME_CACHE_MAX_GB * 1024 ** 3))
+
+# Ready-to-use volumes for the interactive panoramic workflow and repeated segmentation jobs
+hot_volume_cache = MemoryVolumeCache(int(HOT_VOLUME_CACHE_MB * 1024 ** 2))
+
+# Decoded DICOM SEG label maps, keyed by SEG SeriesInstanceUID (viewer and export endpoints)
+labelmap_cache = DiskVolumeCache(LABELMAP_CACHE_DIR, int(LABELMAP_CACHE_MAX_GB * 1024 ** 3))
+hot_labelmap_cache = MemoryVolumeCache(int(HOT_LABELMAP_CACHE_MB * 1024 ** 2))
+
+# Exported mesh files (STL ZIP, GLB) as uint8 arrays, keyed by SEG SeriesInstanceUID and mesh parameters
+mesh_cache = DiskVolumeCache(MESH_CACHE_DIR, int(MESH_CACHE_MAX_GB * 1024 ** 3))
@@ -0,0 +1,49 @@
+"""Tests for services.dicom_series: caching a decoded series"""
+import io
+import json
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+from services.dicom_series import DicomSeries, load_dicom_series
+
+
+def make_slice(index: int, study_uid: str, series_uid: str) -> bytes:
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = CTImageStorage
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.Modality = "CT"
+    ds.Rows, ds.Columns = 4, 5
+    ds.PixelSpacing = [0.4, 0.5]
+    ds.ImagePositionPatient = [-10.0, -20.0, 5.0 + 0.25 * index]
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 1
+    ds.PixelData = np.full((4, 5), index, dtype=np.int16).tobytes()
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def test_series_survives_cache_round_trip():
+    study_uid, series_uid = generate_uid(), generate_uid()
+    series = load_dicom_series([make_slice(i, study_uid, series_uid) for i in (3, 0, 2, 1)])
+
+    # Stored as meta.json by the volume cache
+    metadata = json.loads(json.dumps(series.cache_metadata()))
+    restored = DicomSeries.from_cache(series.volume, metadata)
+
+    assert np.array_equal(restored.volume[:, 0, 0], [0, 1, 2, 3])
+    assert restored.geometry == series.geometry
+    assert [ds.SOPInstanceUID for ds in restored.datasets] == [ds.SOPInstanceUID for ds in series.datasets]
+    assert [ds.ImagePositionPatient for ds in restored.datasets] == [ds.ImagePositionPatient for ds in series.datasets]
+    assert restored.datasets[0].file_meta.TransferSyntaxUID == ExplicitVRLittleEndian
+    assert "PixelData" not in restored.datasets[0]
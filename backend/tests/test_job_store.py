@@ -0,0 +1,85 @@
+"""Tests for services.job_store: claims of jobs that will never finish"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from services.job_store import MemoryJobStore, SQLiteJobStore
+
+BACKEND = Path(__file__).resolve().parent.parent
+
+
+def create_in_other_process(path: Path, job_id: str, key: str):
+    """Create and claim a queued job from a process that then exits, like a crashed worker"""
+    script = (
+        "import sys; sys.path.insert(0, sys.argv[1]);"
+        "from services.job_store import SQLiteJobStore;"
+        "jobs = SQLiteJobStore(sys.argv[2]).table('segmentation');"
+        "jobs.create(sys.argv[3], status='queued');"
+        "assert jobs.claim(sys.argv[4], sys.argv[3]) == sys.argv[3]"
+    )
+    subprocess.run([sys.executable, "-c", script, str(BACKEND), str(path), job_id, key], check=True)
+
+
+def test_orphaned_jobs_fail_on_startup(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    create_in_other_process(path, "old", "series-1")
+
+    jobs = SQLiteJobStore(str(path)).table("segmentation")
+    assert jobs.claim("series-1", "probe") == "old"
+    jobs.release("series-1", "probe")
+
+    assert jobs.fail_orphaned(error="stopped") == 1
+    assert jobs.get("old")["status"] == "failed"
+    assert jobs.get("old")["error"] == "stopped"
+    assert jobs.claim("series-1", "new") == "new"
+
+
+def test_orphaned_leaves_live_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    running = SQLiteJobStore(path).table("segmentation")
+    running.create("live", status="running")
+    running.claim("series-1", "live")
+
+    # Another worker starting up on the same store
+    starting = SQLiteJobStore(path).table("segmentation")
+    assert starting.fail_orphaned(error="stopped") == 0
+    assert starting.get("live")["status"] == "running"
+    assert starting.claim("series-1", "new") == "live"
+
+
+@pytest.mark.parametrize("store", ["memory", "sqlite"])
+def test_abandoned_jobs_fail_on_shutdown(store, tmp_path):
+    job_store = MemoryJobStore() if store == "memory" else SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    jobs = job_store.table("segmentation")
+    jobs.create("queued", status="queued")
+    jobs.claim("series-1", "queued")
+    jobs.create("done", status="completed")
+
+    assert jobs.fail_abandoned(error="stopped") == 1
+    assert jobs.get("queued")["status"] == "failed"
+    assert jobs.get("done")["status"] == "completed"
+    assert jobs.claim("series-1", "new") == "new"
+    if store == "sqlite":
+        # Still failed after a restart
+        reopened = SQLiteJobStore(str(tmp_path / "jobs.sqlite3")).table("segmentation")
+        assert reopened.get("queued")["status"] == "failed"
+
+
+def test_orphaned_covers_reused_pid_and_legacy_rows(tmp_path):
+    job_store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    jobs = job_store.table("segmentation")
+    jobs.create("mine", status="running")
+    jobs.create("reused", status="running")
+    jobs.create("legacy", status="queued")
+    conn = job_store._connect()
+    # A dead process that had this pid, and a record from before owners were stored
+    conn.execute("UPDATE jobs SET owner = ? WHERE job_id = 'reused'", (f"{os.getpid()}:dead",))
+    conn.execute("UPDATE jobs SET owner = NULL WHERE job_id = 'legacy'")
+
+    assert jobs.fail_orphaned(error="stopped") == 2
+    assert jobs.get("mine")["status"] == "running"
+    assert jobs.get("reused")["status"] == "failed"
+    assert jobs.get("legacy")["status"] == "failed"
@@ -0,0 +1,139 @@
+"""Tests for services.mesh_export: STL and GLB writers, meshing backends"""
+import io
+import json
+import struct
+import sys
+
+import numpy as np
+import pytest
+
+from services.mesh_export import (
+    STL_HEADER_BYTES,
+    STL_RECORD_DTYPE,
+    _index_windows,
+    mesh_segment,
+    mesh_to_xyz,
+    write_binary_stl,
+    write_glb,
+)
+
+_COMPONENT_DTYPES = {5120: "<i1", 5123: "<u2", 5125: "<u4"}
+
+
+def signed_volume(triangles: np.ndarray) -> float:
+    """Enclosed volume of (M, 3, 3) triangles; positive when wound counter-clockwise seen from outside"""
+    triangles = triangles.astype(np.float64)
+    return float(np.einsum("ij,ij->i", triangles[:, 0], np.cross(triangles[:, 1], triangles[:, 2])).sum() / 6.0)
+
+
+def read_glb(data: bytes):
+    """(glTF JSON, binary chunk) of a GLB file"""
+    magic, version, total = struct.unpack_from("<III", data, 0)
+    assert (magic, version, total) == (0x46546C67, 2, len(data))
+    json_length, _ = struct.unpack_from("<II", data, 12)
+    gltf = json.loads(data[20:20 + json_length])
+    binary_length, _ = struct.unpack_from("<II", data, 20 + json_length)
+    start = 28 + json_length
+    return gltf, data[start:start + binary_length]
+
+
+def read_accessor(gltf, binary: bytes, index: int) -> np.ndarray:
+    """Elements of an accessor (count, components), honouring the bufferView stride"""
+    accessor = gltf["accessors"][index]
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    dtype = np.dtype(_COMPONENT_DTYPES[accessor["componentType"]])
+    components = {"SCALAR": 1, "VEC3": 3}[accessor["type"]]
+    stride = view.get("byteStride", dtype.itemsize * components)
+    offset = view["byteOffset"] + accessor.get("byteOffset", 0)
+    raw = np.frombuffer(binary, dtype=np.uint8, count=stride * (accessor["count"] - 1) + dtype.itemsize * components, offset=offset)
+    rows = np.lib.stride_tricks.as_strided(raw, shape=(accessor["count"], dtype.itemsize * components), strides=(stride, 1))
+    return rows.copy().view(dtype).reshape(accessor["count"], components)
+
+
+def glb_triangles(data: bytes):
+    """World-space (M, 3, 3) triangles per mesh of a GLB written by write_glb, and its index accessors"""
+    gltf, binary = read_glb(data)
+    meshes = []
+    index_accessors = []
+    for node in gltf["nodes"]:
+        triangles = []
+        for primitive in gltf["meshes"][node["mesh"]]["primitives"]:
+            positions = read_accessor(gltf, binary, primitive["attributes"]["POSITION"]) * node["scale"] + node["translation"]
+            indices = read_accessor(gltf, binary, primitive["indices"]).reshape(-1, 3)
+            index_accessors.append((gltf["accessors"][primitive["indices"]], indices))
+            triangles.append(positions[indices])
+        meshes.append(np.concatenate(triangles))
+    return meshes, index_accessors
+
+
+def sphere_mask(size: int = 40, radius: float = 14.0) -> np.ndarray:
+    z, y, x = np.mgrid[:size, :size, :size]
+    centre = (size - 1) / 2.0
+    return (z - centre) ** 2 + (y - centre) ** 2 + (x - centre) ** 2 < radius ** 2
+
+
+@pytest.fixture(params=["marching_cubes", "surface_nets"])
+def backend(request, monkeypatch):
+    """Mesh with skimage's marching cubes, or with surface nets as when skimage is missing"""
+    if request.param == "marching_cubes":
+        pytest.importorskip("skimage")
+    else:
+        monkeypatch.setitem(sys.modules, "skimage", None)
+    return request.param
+
+
+def test_stl_encloses_positive_volume(backend):
+    mask = sphere_mask()
+    _, levels = mesh_segment(mask.astype(np.uint8), 1, (0.5, 0.4, 0.3), (0, 0, 0))
+    verts, faces = levels[0]
+
+    buffer = io.BytesIO()
+    write_binary_stl(buffer, verts, faces, "sphere")
+    records = np.frombuffer(buffer.getvalue()[STL_HEADER_BYTES + 4:], STL_RECORD_DTYPE)
+
+    volume = signed_volume(records["vectors"])
+    assert volume > 0
+    assert volume == pytest.approx(mask.sum() * 0.5 * 0.4 * 0.3, rel=0.05)
+
+
+def test_glb_encloses_positive_volume(backend):
+    mask = sphere_mask()
+    _, levels = mesh_segment(mask.astype(np.uint8), 1, (0.5, 0.4, 0.3), (0, 0, 0), max_faces=2000)
+    verts, faces = levels[0]
+
+    buffer = io.BytesIO()
+    write_glb(buffer, [("sphere", (255, 255, 255, 255), *mesh_to_xyz(verts, faces))], translation=(10.0, -5.0, 2.0))
+    (triangles,), _ = glb_triangles(buffer.getvalue())
+
+    assert signed_volume(triangles) > 0
+
+
+def test_index_windows_never_reach_restart_index():
+    # A strip of 200000 vertices: every face widens the run by one vertex
+    count = 200000
+    faces = np.stack([np.arange(count - 2), np.arange(1, count - 1), np.arange(2, count)], axis=1)
+    windows = _index_windows(faces)
+    assert len(windows) > 1
+    for start, stop, base, vertices in windows:
+        assert vertices <= 65535
+        assert faces[start:stop].max() - base < 65535
+
+    # A single face spanning 65536 vertices needs uint32 indices
+    assert _index_windows(np.array([[0, 1, 65535]])) is None
+
+
+def test_glb_uint16_indices_below_restart_value():
+    count = 200000
+    verts = np.stack([np.arange(count), np.arange(count) % 7, np.arange(count) % 3], axis=1).astype(np.float32)
+    faces = np.stack([np.arange(count - 2), np.arange(1, count - 1), np.arange(2, count)], axis=1)
+
+    buffer = io.BytesIO()
+    write_glb(buffer, [("strip", (255, 0, 0, 255), verts, faces)])
+    (triangles,), index_accessors = glb_triangles(buffer.getvalue())
+
+    assert len(index_accessors) > 1
+    for accessor, indices in index_accessors:
+        assert accessor["componentType"] == 5123
+        assert indices.max() < 65535
+    # Dequantized triangles still match the input
+    assert np.allclose(triangles, verts[faces], atol=count / 65535.0)
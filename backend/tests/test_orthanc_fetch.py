@@ -0,0 +1,75 @@
+"""Tests for services.orthanc_fetch: archive decoding and the per-instance fallback"""
+import asyncio
+import io
+import zipfile
+
+import httpx
+import pytest
+
+from services import http_clients, orthanc_fetch
+from services.orthanc_fetch import ArchiveFormatError, fetch_series, iter_zip_members
+
+INSTANCES = {f"instance-{i}": f"DICOM instance {i} ".encode() * 200 for i in range(4)}
+
+
+def make_archive() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for instance_id, data in INSTANCES.items():
+            zf.writestr(f"SERIES/{instance_id}.dcm", data)
+    return buffer.getvalue()
+
+
+def corrupt_second_member(archive: bytes) -> bytes:
+    """Garble the deflate data of the second member, so the first one still decodes"""
+    second = archive.index(b"PK\x03\x04", 4)
+    name_len, extra_len = int.from_bytes(archive[second + 26:second + 28], "little"), int.from_bytes(archive[second + 28:second + 30], "little")
+    start = second + 30 + name_len + extra_len
+    return archive[:start] + b"\xff" * 16 + archive[start + 16:]
+
+
+async def chunked(data: bytes, size: int = 100):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def collect(data: bytes):
+    return [member async for member in iter_zip_members(chunked(data))]
+
+
+def test_archive_members_decode():
+    members = asyncio.run(collect(make_archive()))
+    assert [data for _, data in members] == list(INSTANCES.values())
+
+
+def test_corrupt_deflate_raises_archive_format_error():
+    with pytest.raises(ArchiveFormatError):
+        asyncio.run(collect(corrupt_second_member(make_archive())))
+
+
+def test_corrupt_archive_falls_back_to_instances(monkeypatch):
+    archive = corrupt_second_member(make_archive())
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/archive"):
+            return httpx.Response(200, content=archive)
+        instance_id = request.url.path.split("/")[2]
+        return httpx.Response(200, content=INSTANCES[instance_id])
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://orthanc")
+    monkeypatch.setattr(http_clients, "_orthanc_client", client)
+    monkeypatch.setattr(orthanc_fetch, "ORTHANC_BULK_FETCH", True)
+
+    delivered = {}
+    resets = []
+
+    def on_reset():
+        resets.append(len(delivered))
+        delivered.clear()
+
+    count = asyncio.run(fetch_series("series", list(INSTANCES), delivered.__setitem__, on_reset=on_reset))
+
+    assert count == len(INSTANCES)
+    # The member decoded before the corrupt one was discarded before the fallback
+    assert resets == [1]
+    assert [delivered[i] for i in range(len(INSTANCES))] == list(INSTANCES.values())